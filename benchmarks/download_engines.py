@@ -0,0 +1,148 @@
+"""
+throughput of the download engines against a local fake CDN (benchmarks/fake_cdn.py), no network needed.
+Each scenario runs in a fresh process and reports MB/s, cpu seconds per GB, peak rss and event loop lag.
+
+usage: python benchmarks/download_engines.py [--size 256MB] [--http2] [--bandwidth 20MB] [--latency 0.01]
+       [--error-rate 0.01] [--scenario file hls] [--json out.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_cdn import CDNConfig, serve, fmp4_layout  # noqa: E402
+from bilix.utils import parse_bytes_str  # noqa: E402
+
+SCENARIOS = ['file', 'clip', 'hls', 'hls-aes']
+
+
+class LagSampler:
+    """sample how late the event loop wakes up a sleeping task"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(loop.time() - t - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def summary(self) -> Dict[str, float]:
+        lags = sorted(self.lags) or [0.]
+        return {'lag_p99_ms': lags[int(len(lags) * .99)] * 1000, 'lag_max_ms': lags[-1] * 1000}
+
+
+async def _download(name: str, base: str, size: int, args, out: Path):
+    import httpx
+    from bilix.download.base_downloader_part import BaseDownloaderPart
+    from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+    client = httpx.AsyncClient(http1=not args.http2, http2=args.http2, timeout=30,
+                               limits=httpx.Limits(max_connections=args.part_con * 2))
+    seg_size = 2_000_000
+    note = ''
+    async with client:
+        if name == 'file':
+            d = BaseDownloaderPart(client=client, part_concurrency=args.part_con, stream_retry=10)
+            await d.get_file(f"{base}/file/{size}", path=out / 'file.bin')
+        elif name == 'clip':
+            d = BaseDownloaderPart(client=client, part_concurrency=args.part_con, stream_retry=10)
+            fragments = max(size // seg_size, 1)
+            _, init_range, seg_range = fmp4_layout(fragments, seg_size)
+            try:
+                await d.get_media_clip(f"{base}/fmp4/{fragments}/{seg_size}.mp4", out / 'clip.mp4',
+                                       time_range=(0, fragments * 2), init_range=init_range, seg_range=seg_range)
+            except FileNotFoundError:  # transfer and merge are done, only ffmpeg cut is missing
+                note = 'ffmpeg not found, clip step skipped'
+        else:
+            d = BaseDownloaderM3u8(client=client, part_concurrency=args.part_con, stream_retry=10)
+            await d.get_m3u8_video(f"{base}/{name}/{max(size // seg_size, 1)}/{seg_size}/index.m3u8",
+                                   path=out / f'{name}.mp4')
+    return note
+
+
+def run_scenario(name: str, base: str, args) -> Dict:
+    """run in a fresh process"""
+    out = Path(tempfile.mkdtemp(prefix='bilix-bench-'))
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def main():
+            with LagSampler() as sampler:
+                note = await _download(name, base, int(args.size), args, out)
+            return note, sampler.summary()
+
+        cpu, wall = time.process_time(), time.perf_counter()
+        note, lag = loop.run_until_complete(main())
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        loop.close()
+        size = sum(f.stat().st_size for f in out.iterdir())
+        return {'scenario': name, 'bytes': size, 'seconds': wall, 'mb_s': size / wall / 1e6,
+                'cpu_s_per_gb': cpu / (size / 1e9), 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                **lag, 'note': note}
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=parse_bytes_str, default=parse_bytes_str('256MB'))
+    parser.add_argument('--part-con', type=int, default=10)
+    parser.add_argument('--http2', action='store_true', help='h2c with prior knowledge')
+    parser.add_argument('--bandwidth', type=parse_bytes_str, default=None, help='per connection, e.g. 20MB')
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--scenario', nargs='*', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--json', type=Path, help='save results')
+    parser.add_argument('--compare', type=Path, help='results json of a baseline run, report MB/s change')
+    args = parser.parse_args()
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve, args=(CDNConfig(args.bandwidth, args.latency, args.error_rate),), kwargs={'ready': ready},
+        daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{ready.get(timeout=10)}"
+    print(f"{'http2' if args.http2 else 'http1.1'} size {args.size / 1e6:.0f}MB part_con {args.part_con} "
+          f"bandwidth {args.bandwidth} latency {args.latency} error_rate {args.error_rate}")
+    baseline = {r['scenario']: r for r in json.loads(args.compare.read_text())} if args.compare else {}
+    results = []
+    try:
+        for name in args.scenario:
+            with ProcessPoolExecutor(1) as pool:
+                r = pool.submit(run_scenario, name, base, args).result()
+            results.append(r)
+            line = (f"{name:>8}: {r['mb_s']:8.1f} MB/s {r['cpu_s_per_gb']:6.2f} cpu s/GB "
+                    f"{r['peak_rss_mb']:7.1f} MB rss  lag p99 {r['lag_p99_ms']:6.1f} ms max {r['lag_max_ms']:6.1f} ms")
+            if name in baseline:
+                line += f"  {r['mb_s'] / baseline[name]['mb_s'] - 1:+.1%} vs baseline"
+            print(line + (f"  ({r['note']})" if r['note'] else ''))
+    finally:
+        server.terminate()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
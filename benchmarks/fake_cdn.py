@@ -0,0 +1,301 @@
+"""
+local fake CDN for the download engine benchmarks. It serves, with Range support:
+
+    /file/<size>                            e.g. /file/64MB, plain bytes
+    /hls/<segments>/<seg_size>/index.m3u8   fMP4 HLS playlist with init section
+    /hls-aes/<segments>/<seg_size>/index.m3u8   same, segments encrypted by AES-128 (iv = media sequence)
+    /fmp4/<fragments>/<frag_size>.mp4       sidx indexed fMP4, layout given by fmp4_layout()
+
+Bandwidth is limited per connection, latency is added before each response and error_rate of responses
+fail (half with 503, half by dropping the connection in the middle of the body). HTTP/1.1, and HTTP/2 with
+prior knowledge (h2c) when h2 is installed, on the same port.
+
+usage: python benchmarks/fake_cdn.py [--port 8000] [--bandwidth 10MB] [--latency 0.02] [--error-rate 0.01]
+"""
+import argparse
+import asyncio
+import random
+import re
+import struct
+from functools import lru_cache
+from typing import NamedTuple, Optional, Dict, Tuple, Iterator
+
+from bilix.utils import parse_bytes_str
+
+CHUNK = 64 * 1024
+BLOCK = random.Random(0).randbytes(1024 * 1024) if hasattr(random.Random, 'randbytes') else \
+    bytes(random.Random(0).getrandbits(8) for _ in range(1024 * 1024))
+KEY = bytes(range(16))
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+SEG_DURATION = 2.  # seconds of each hls segment and fmp4 fragment
+
+
+class CDNConfig(NamedTuple):
+    bandwidth: Optional[float] = None  # bytes/s per connection
+    latency: float = 0.  # seconds before each response
+    error_rate: float = 0.
+    seed: int = 0
+
+
+class Resource(NamedTuple):
+    """virtual file: prefix bytes followed by BLOCK pattern up to size"""
+    prefix: bytes
+    size: int
+    content_type: str = 'application/octet-stream'
+
+    def chunks(self, start: int, end: int) -> Iterator[memoryview]:
+        """bytes [start, end]"""
+        head = memoryview(self.prefix)
+        while start <= end:
+            if start < len(head):
+                piece = head[start:min(end + 1, len(head), start + CHUNK)]
+            else:
+                offset = (start - len(head)) % len(BLOCK)
+                piece = memoryview(BLOCK)[offset:offset + min(CHUNK, end + 1 - start)]
+            start += len(piece)
+            yield piece
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+@lru_cache(maxsize=8)
+def fmp4_layout(fragments: int, frag_size: int) -> Tuple[bytes, str, str]:
+    """:return: header (ftyp moov sidx), init_range, seg_range as used by get_media_clip"""
+    init = _box(b'ftyp', b'iso6\x00\x00\x00\x00iso6dash') + _box(b'moov', bytes(1024))
+    refs = b''.join(struct.pack('>III', frag_size & 0x7fffffff, int(SEG_DURATION * 1000), 0x90000000)
+                    for _ in range(fragments))
+    sidx = _box(b'sidx', struct.pack('>B3xIIIIHH', 0, 1, 1000, 0, 0, 0, fragments) + refs)
+    return init + sidx, f"0-{len(init) - 1}", f"{len(init)}-{len(init) + len(sidx) - 1}"
+
+
+@lru_cache(maxsize=1024)
+def _encrypted(seg_size: int, idx: int) -> bytes:
+    from Crypto.Cipher import AES
+    plain = b''.join(Resource(b'', seg_size).chunks(0, seg_size - 1))
+    pad = 16 - len(plain) % 16
+    plain += bytes([pad]) * pad  # pkcs7
+    return AES.new(KEY, AES.MODE_CBC, idx.to_bytes(16, 'big')).encrypt(plain)
+
+
+def _playlist(segments: int, aes: bool) -> bytes:
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', f'#EXT-X-TARGETDURATION:{int(SEG_DURATION)}',
+             '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-MAP:URI="init.mp4"']
+    if aes:
+        lines.append('#EXT-X-KEY:METHOD=AES-128,URI="/key"')
+    for i in range(segments):
+        lines.extend([f'#EXTINF:{SEG_DURATION:.1f},', f'{i}.m4s'])
+    lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def route(path: str) -> Optional[Resource]:
+    path = path.split('?')[0]
+    if m := re.fullmatch(r'/file/(\w+)', path):
+        return Resource(b'', int(parse_bytes_str(m.group(1))))
+    if m := re.fullmatch(r'/(hls|hls-aes)/(\d+)/(\w+)/(index\.m3u8|init\.mp4|(\d+)\.m4s)', path):
+        aes, segments, seg_size = m.group(1) == 'hls-aes', int(m.group(2)), int(parse_bytes_str(m.group(3)))
+        if m.group(4) == 'index.m3u8':
+            data = _playlist(segments, aes)
+            return Resource(data, len(data), 'application/vnd.apple.mpegurl')
+        if m.group(4) == 'init.mp4':
+            data = fmp4_layout(1, 1)[0]
+            return Resource(data, len(data))
+        if aes:
+            data = _encrypted(seg_size, int(m.group(5)))
+            return Resource(data, len(data))
+        return Resource(b'', seg_size)
+    if path == '/key':
+        return Resource(KEY, len(KEY))
+    if m := re.fullmatch(r'/fmp4/(\d+)/(\w+)\.mp4', path):
+        fragments, frag_size = int(m.group(1)), int(parse_bytes_str(m.group(2)))
+        header = fmp4_layout(fragments, frag_size)[0]
+        return Resource(header, len(header) + fragments * frag_size, 'video/mp4')
+
+
+def _parse_range(value: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not value or not (m := re.fullmatch(r'bytes=(\d*)-(\d*)', value.strip())):
+        return None
+    if m.group(1):
+        start, end = int(m.group(1)), int(m.group(2)) if m.group(2) else size - 1
+    else:  # suffix range
+        start, end = size - int(m.group(2)), size - 1
+    return max(start, 0), min(end, size - 1)
+
+
+class Throttle:
+    """pace bytes sent on one connection at rate bytes/s"""
+
+    def __init__(self, rate: Optional[float]):
+        self.rate = rate
+        self._t = 0.
+
+    async def __call__(self, n: int):
+        if not self.rate:
+            return
+        now = asyncio.get_event_loop().time()
+        self._t = max(self._t, now) + n / self.rate
+        if self._t - now > 0.001:
+            await asyncio.sleep(self._t - now)
+
+
+class FakeCDN:
+    def __init__(self, config: CDNConfig = CDNConfig()):
+        self.config = config
+        self.rnd = random.Random(config.seed)
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def _prepare(self, method: str, path: str, headers: Dict[str, str]):
+        """:return: status, response headers, chunks iterator or None, fail after bytes (or None)"""
+        self.requests += 1
+        fail = self.config.error_rate and self.rnd.random() < self.config.error_rate
+        res = route(path)
+        if res is None:
+            return 404, {'content-length': '0'}, None, None
+        if fail and self.rnd.random() < .5:
+            return 503, {'content-length': '0'}, None, None
+        rng = _parse_range(headers.get('range'), res.size)
+        if rng:
+            start, end = rng
+            status = 206
+            out = {'content-range': f'bytes {start}-{end}/{res.size}'}
+        else:
+            start, end = 0, res.size - 1
+            status = 200
+            out = {}
+        out.update({'content-length': str(end - start + 1), 'accept-ranges': 'bytes',
+                    'content-type': res.content_type})
+        body = res.chunks(start, end) if method != 'HEAD' else None
+        return status, out, body, (end - start + 1) // 2 if fail else None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        throttle = Throttle(self.config.bandwidth)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line == H2_PREFACE[:16]:
+                    await self._serve_h2(reader, writer, line + await reader.readexactly(len(H2_PREFACE) - 16),
+                                         throttle)
+                    break
+                method, target, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (h := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    k, v = h.decode('latin-1').split(':', 1)
+                    headers[k.strip().lower()] = v.strip()
+                if self.config.latency:
+                    await asyncio.sleep(self.config.latency)
+                status, out, body, fail_after = self._prepare(method, target, headers)
+                writer.write(f'HTTP/1.1 {status} X\r\n'.encode() +
+                             ''.join(f'{k}: {v}\r\n' for k, v in out.items()).encode() + b'\r\n')
+                sent = 0
+                for chunk in body or ():
+                    if fail_after is not None and sent >= fail_after:
+                        writer.transport.abort()
+                        return
+                    writer.write(chunk)
+                    sent += len(chunk)
+                    self.bytes_sent += len(chunk)
+                    await throttle(len(chunk))
+                    await writer.drain()
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_h2(self, reader, writer, preface: bytes, throttle: Throttle):
+        import h2.config
+        import h2.connection
+        import h2.events
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        conn.initiate_connection()
+        windows: Dict[int, asyncio.Event] = {}
+        tasks: Dict[int, asyncio.Task] = {}
+
+        async def wait_window(stream_id: int):
+            while conn.local_flow_control_window(stream_id) <= 0:
+                event = windows[stream_id] = asyncio.Event()
+                await event.wait()
+
+        async def respond(stream_id: int, headers: Dict[str, str]):
+            if self.config.latency:
+                await asyncio.sleep(self.config.latency)
+            status, out, body, fail_after = self._prepare(headers[':method'], headers[':path'], headers)
+            conn.send_headers(stream_id, [(':status', str(status)), *out.items()], end_stream=body is None)
+            writer.write(conn.data_to_send())
+            sent = 0
+            for chunk in body or ():
+                if fail_after is not None and sent >= fail_after:
+                    conn.reset_stream(stream_id)
+                    writer.write(conn.data_to_send())
+                    return
+                while chunk:
+                    await wait_window(stream_id)
+                    n = min(len(chunk), conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)
+                    conn.send_data(stream_id, bytes(chunk[:n]))
+                    writer.write(conn.data_to_send())
+                    chunk = chunk[n:]
+                    sent += n
+                    self.bytes_sent += n
+                    await throttle(n)
+                    await writer.drain()
+            if body is not None:
+                conn.end_stream(stream_id)
+                writer.write(conn.data_to_send())
+
+        data = preface
+        while data:
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    task = tasks[event.stream_id] = asyncio.ensure_future(respond(event.stream_id, dict(event.headers)))
+                    task.add_done_callback(lambda t, sid=event.stream_id: tasks.pop(sid, None))
+                elif isinstance(event, h2.events.WindowUpdated):
+                    for sid in ([event.stream_id] if event.stream_id else list(windows)):
+                        if sid in windows:
+                            windows.pop(sid).set()
+                elif isinstance(event, h2.events.StreamReset) and event.stream_id in tasks:
+                    tasks[event.stream_id].cancel()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    data = b''
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            if data:
+                data = await reader.read(65536)
+        for task in list(tasks.values()):
+            task.cancel()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def serve(config: CDNConfig, port: int = 0, ready=None):
+    """run the server forever, put the bound port to ready (a multiprocessing queue) if given"""
+
+    async def main():
+        server = await FakeCDN(config).start(port=port)
+        bound = server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready.put(bound)
+        else:
+            print(f"fake cdn on http://127.0.0.1:{bound}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--bandwidth', type=parse_bytes_str, default=None, help='per connection, e.g. 10MB')
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    args = parser.parse_args()
+    serve(CDNConfig(args.bandwidth, args.latency, args.error_rate), args.port)
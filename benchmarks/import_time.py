@@ -0,0 +1,64 @@
+"""
+import time of bilix entry points measured by `python -X importtime`, each in a fresh interpreter
+
+usage: python benchmarks/import_time.py [module ...] [--repeat N] [--top N]
+"""
+import argparse
+import re
+import subprocess
+import sys
+from statistics import median
+from typing import Dict, List, Tuple
+
+ENTRY_POINTS = [
+    'bilix',
+    'bilix.cli.main',
+    'bilix.download.base_downloader_part',
+    'bilix.download.base_downloader_m3u8',
+    'bilix.sites.bilibili',
+    'bilix.sites.bilibili.api',
+    'bilix.sites.cctv',
+    'bilix.sites.douyin',
+]
+# optional heavy modules that should only be imported at their call sites
+HEAVY = ['danmakuC', 'pymp4', 'json5', 'Crypto', 'm3u8', 'bs4']
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def importtime(module: str) -> Tuple[int, Dict[str, int]]:
+    """:return: cumulative us of the module and {top-level package: cumulative us} of its imports"""
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         capture_output=True, text=True, check=True)
+    lines = LINE.findall(res.stderr)
+    # skip the imports of interpreter startup which finish with top level `site`
+    start = next((i + 1 for i, l in enumerate(lines) if l[3] == 'site' and not l[2]), 0)
+    total, packages = 0, {}
+    for _, cumulative, _, name in lines[start:]:
+        if name == module:
+            total = int(cumulative)
+        if '.' not in name:  # top-level package, cumulative time includes all its submodules
+            packages[name] = int(cumulative)
+    return total, packages
+
+
+def main(modules: List[str], repeat: int, top: int):
+    print(f"{'module':40} {'median ms':>10}  heaviest imports")
+    for module in modules:
+        runs = [importtime(module) for _ in range(repeat)]
+        total = median(r[0] for r in runs) / 1000
+        packages = runs[-1][1]
+        packages.pop(module.split('.')[0], None)
+        heaviest = sorted(packages.items(), key=lambda x: x[1], reverse=True)[:top]
+        heavy = [name for name in HEAVY if name in packages]
+        print(f"{module:40} {total:10.1f}  " + ', '.join(f"{n} {t / 1000:.1f}" for n, t in heaviest))
+        if heavy:
+            print(f"{'':40} {'':10}  [optional heavy imported] {', '.join(heavy)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=4)
+    args = parser.parse_args()
+    main(args.modules, args.repeat, args.top)
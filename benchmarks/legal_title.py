@@ -0,0 +1,64 @@
+"""
+file name sanitization of bilibili titles: legacy replace chain + re.sub vs bilix.utils (precompiled, memoized)
+
+usage: python benchmarks/legal_title.py [title_num]
+"""
+import html
+import random
+import re
+import sys
+import time
+from bilix.utils import legal_title, legal_name
+
+
+def legacy_legal_title(*parts: str, join_str: str = '-'):
+    def replace_illegal(s: str):
+        s = s.strip()
+        s = html.unescape(s)
+        s = re.sub(r"[/\\:*?\"<>|\n\t]", '', s)
+        return s
+
+    return join_str.join(filter(lambda x: len(x) > 0, map(replace_illegal, parts)))
+
+
+def legacy_name(s: str) -> str:
+    for c in 'SE':
+        for d in '0123456789':
+            s = s.replace(f"{c}{d}", f"{c}·{d}")
+    return re.sub(r'[\.\:\*\?\"\<\>\|]', '_', s)
+
+
+def fake_titles(n: int):
+    rnd = random.Random(0)
+    chars = '测试标题合集番剧SE0123456789 .:?&abcdef'
+    return [''.join(rnd.choice(chars) for _ in range(rnd.randint(10, 60))) for _ in range(n)]
+
+
+def bench(func, titles, repeat: int = 5) -> float:
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for t in titles:
+            # one video names its folder, media, cover, subtitle, danmaku and nfo from the same title
+            for _ in range(6):
+                func(t)
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    titles = fake_titles(n)
+    print(f"{n} titles")
+    cases = [
+        ('legacy legal_title', lambda t: legacy_legal_title(t, 'p1')),
+        ('legal_title', lambda t: legal_title(t, 'p1')),
+        ('legacy name', legacy_name),
+        ('legal_name', lambda t: legal_name(t, split_episode=True)),
+    ]
+    for name, func in cases:
+        print(f"{name:>20}: {bench(func, titles) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+json subtitle conversion on synthetic long tracks: legacy string concatenation vs list/join in bilix.subtitle
+
+usage: python benchmarks/subtitle_convert.py [cue_num]
+"""
+import json
+import random
+import sys
+import time
+from bilix.subtitle import json2srt, json2vtt, json2ass
+
+
+def legacy_json2srt(data: bytes):
+    data = json.loads(data)
+
+    def t2str(t):
+        ms = int(round(t % 1, 3) * 1000)
+        s = int(t)
+        m = s // 60
+        h = m // 60
+        m, s = m % 60, s % 60
+        t_str = f'{h:0>2}:{m:0>2}:{s:0>2},{ms:0>3}'
+        return t_str
+
+    res = ''
+    for idx, i in enumerate(data['body']):
+        from_time, to_time = t2str(i['from']), t2str(i['to'])
+        content = i['content']
+        res += f"{idx + 1}\n{from_time} --> {to_time}\n{content}\n\n"
+    return res.encode('utf-8')
+
+
+def fake_track(n: int) -> bytes:
+    rnd = random.Random(0)
+    body, t = [], 0.
+    for i in range(n):
+        start = t + rnd.random()
+        t = start + 1 + rnd.random() * 3
+        body.append({'from': round(start, 3), 'to': round(t, 3), 'location': 2,
+                     'content': ''.join(rnd.choice('自动生成的字幕内容abcdef ') for _ in range(rnd.randint(5, 30)))})
+    return json.dumps({'font_size': 0.4, 'body': body}, ensure_ascii=False).encode('utf-8')
+
+
+def bench(func, data: bytes, repeat: int = 5) -> float:
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = fake_track(n)
+    print(f"{n} cues, {len(data) / 1024 / 1024:.1f} MiB json")
+    for func in (legacy_json2srt, json2srt, json2vtt, json2ass):
+        print(f"{func.__name__:>16}: {bench(func, data) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+memory per queued bilibili video: pydantic VideoInfo vs the slotted VideoInfoRecord used on the internal hot path
+
+usage: python benchmarks/video_info_memory.py [video_num]
+"""
+import sys
+import gc
+import tracemalloc
+from bilix.sites.bilibili import api
+
+QUALITIES = [(127, '8K 超高清'), (120, '4K 超清'), (116, '1080P 60帧'), (80, '1080P 高清'), (64, '720P 准高清'),
+             (32, '480P 清晰'), (16, '360P 流畅')]
+CODECS = ['avc1.640032', 'hev1.1.6.L150.90', 'av01.0.00M.10.0.110.01.01.01.0']
+
+
+def fake_media(idx: int, codec: str, **kwargs) -> dict:
+    return {
+        'id': kwargs.pop('id', 30280), 'codecs': codec, 'bandwidth': 1000000 + idx,
+        'base_url': f'https://upos-sz-mirrorcos.bilivideo.com/upgcxcode/{idx}/{idx}-1-{codec}.m4s?e=ig8euxZM2rNcNbdl',
+        'backup_url': [f'https://upos-sz-mirrorali.bilivideo.com/upgcxcode/{idx}/{idx}-1-{codec}.m4s?e=ig8euxZM2rNc'],
+        'width': 1920, 'height': 1080, 'frame_rate': '30.000', 'sar': '1:1', 'start_with_sap': 1,
+        'segment_base': {'initialization': '0-1000', 'index_range': '1001-2000'}, **kwargs,
+    }
+
+
+def fake_play_info(idx: int) -> dict:
+    return {
+        'support_formats': [{'quality': q, 'new_description': d} for q, d in QUALITIES],
+        'dash': {
+            'duration': 600,
+            'video': [fake_media(idx, c, id=q) for q, _ in QUALITIES for c in CODECS],
+            'audio': [fake_media(idx, 'mp4a.40.2', id=30280)],
+            'dolby': {'type': 0},
+            'flac': None,
+        },
+    }
+
+
+def build(idx: int, record: bool):
+    status = api.Status(view=1, danmaku=1, coin=1, like=1, reply=1, favorite=1, share=1)
+    pages = [(f'P{i + 1}-part', f'https://www.bilibili.com/video/BV1xx411c7m{idx}?p={i + 1}') for i in range(3)]
+    kwargs = dict(title=f'title {idx}', aid=idx, cid=idx, p=0, img_url='http://i0.hdslb.com/bfs/archive/x.jpg',
+                  status=status, bvid=f'BV1xx411c7m{idx}', desc='desc', tags=['tag'])
+    if record:
+        return api.VideoInfoRecord(pages=[api.PageRecord(p_name=n, p_url=u) for n, u in pages],
+                                   dash=api.DashRecord.from_dict(fake_play_info(idx)), other=[], **kwargs)
+    return api.VideoInfo(pages=[api.Page(p_name=n, p_url=u) for n, u in pages],
+                         dash=api.Dash.from_dict(fake_play_info(idx)), other=[], **kwargs)
+
+
+def measure(n: int, record: bool) -> float:
+    gc.collect()
+    tracemalloc.start()
+    infos = [build(i, record) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del infos
+    return size / n
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for name, record in (('pydantic VideoInfo', False), ('slotted VideoInfoRecord', True)):
+        print(f"{name:24} {measure(num, record) / 1024:8.2f} KiB per queued video ({num} videos)")
@@ -0,0 +1,73 @@
+"""
+pluggable json decoder, parse http bytes content directly with orjson or msgspec when installed
+"""
+import json
+from typing import Union, Callable, Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+__all__ = ['loads', 'set_backend', 'backend']
+
+
+def _std_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)  # stdlib detects utf-8/16/32 for bytes input
+
+
+def _orjson_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    return orjson.loads(data)
+
+
+def _msgspec_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    return msgspec.json.decode(data)
+
+
+_backends = {'json': _std_loads}
+if orjson is not None:
+    _backends['orjson'] = _orjson_loads
+if msgspec is not None:
+    _backends['msgspec'] = _msgspec_loads
+
+_loads: Callable[[Union[bytes, str]], Any] = _std_loads
+_backend = 'json'
+
+
+def set_backend(name: str = None):
+    """
+    choose json decoder backend, by default orjson > msgspec > json (stdlib)
+
+    :param name: one of 'orjson', 'msgspec', 'json', None for auto choice
+    :return:
+    """
+    global _loads, _backend
+    if name is None:
+        name = next(n for n in ('orjson', 'msgspec', 'json') if n in _backends)
+    if name not in _backends:
+        raise ValueError(f"json backend '{name}' is not available, installed: {list(_backends)}")
+    _loads, _backend = _backends[name], name
+
+
+def backend() -> str:
+    """name of the json backend in use"""
+    return _backend
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    decode json from bytes (recommended, e.g. httpx.Response.content) or str without intermediate decoding
+
+    :param data:
+    :return:
+    """
+    return _loads(data)
+
+
+set_backend()
@@ -1,14 +1,17 @@
 import asyncio
+import collections.abc
 import inspect
 import re
 import time
 from functools import wraps
-from pathlib import Path
-from typing import Callable, Union, Tuple
+from typing import Callable, Union, Tuple, List, get_args, get_origin
 from importlib import import_module
 
+import click
+
 from bilix.exception import HandleMethodError, HandleError
 from bilix.log import logger
+from bilix.cli.registry import Registry, load_registry
 
 
 def kwargs_filter(obj: Union[type, Callable], kwargs: dict):
@@ -58,6 +61,12 @@ def module_handle_funcs(module):
         yield handle_func
 
 
+def accepts_ranges(func: Callable) -> bool:
+    """whether time_range of func is annotated to take a sequence of ranges, like bilibili get_video"""
+    p = inspect.signature(func).parameters.get('time_range')
+    return p is not None and any(get_origin(a) in (list, collections.abc.Sequence) for a in get_args(p.annotation))
+
+
 def auto_assemble(handle_func):
     @wraps(handle_func)
     def wrapped(cls, method: str, keys: Tuple[str, ...], options: dict):
@@ -67,12 +76,17 @@ def auto_assemble(handle_func):
         executor, cor = res
         # handle func return class instead of instance
         if inspect.isclass(executor):
-            kwargs = kwargs_filter(executor, options)
-            executor = executor(**kwargs)
-            logger.debug(f"auto assemble {executor} by {kwargs}")
+            if hasattr(executor, 'from_options'):  # downloaders, also switch on options like adaptive
+                executor = executor.from_options(options)
+            else:
+                executor = executor(**kwargs_filter(executor, options))
+            logger.debug(f"auto assemble {executor}")
         # handle func return async function instead of coroutine
         if inspect.iscoroutinefunction(cor):
             kwargs = kwargs_filter(cor, options)
+            if isinstance(kwargs.get('time_range'), list) and not accepts_ranges(cor):
+                raise click.BadParameter(f"multiple time ranges are not supported by {cor.__qualname__}",
+                                         param_hint="'-tr' / '--time-range'")
             cors = []
             for key in keys:
                 if not hasattr(cor, '__self__'):  # coroutine function has not bound to instance
@@ -98,38 +112,45 @@ def longest_common_len(str1, str2):
     return max_length
 
 
-def find_sites():
-    sites_path = Path(__file__).parent.parent / 'sites'
-    for site in sites_path.iterdir():
-        if not site.is_dir() or not (site / '__init__.py').exists():
-            continue
-        yield site
+BASE_CMP_KEYS = {'download.base_downloader_m3u8': 'm3u8', 'download.base_downloader_part': 'file'}
 
 
-def assign(cli_kwargs):
-    method = cli_kwargs.pop('method')
-    keys = cli_kwargs.pop('keys')
-    options = cli_kwargs
-    modules = [
-        # path, cmp_key
-        ('download.base_downloader_m3u8', 'm3u8'),
-        ('download.base_downloader_part', 'file'),
-    ]
-    for site in find_sites():
-        modules.append((f"sites.{site.name}", site.name))
+def _rank_by_name(method: str, key: str, modules: List[str]) -> List[str]:
+    """fallback order: longest common substring between module name and url domain or method"""
     pattern = re.compile(r"https?://(?:[\w-]*\.)?([\w-]+)\.([\w-]+)")
-    if g := pattern.search(keys[0]):
+    if g := pattern.search(key):
         cmp_base = g.group(1)
     else:
-        cmp_base = keys[0]
+        cmp_base = key
 
-    def key(x: Tuple[str, str]):
-        if x[0].startswith("sites"):
-            return longest_common_len(cmp_base, x[-1])
+    def rank(module: str):
+        if module.startswith("sites"):
+            return longest_common_len(cmp_base, module.split('.')[-1])
         else:  # base_downloader
-            return longest_common_len(method, x[-1])
+            return longest_common_len(method, BASE_CMP_KEYS.get(module, module))
+
+    return sorted(modules, key=rank, reverse=True)
+
+
+def _candidates(method: str, key: str):
+    """modules to try in order, the precomputed registry makes the first guess import exactly one module"""
+    registry = Registry(load_registry())
+    tried = set()
+    for module in registry.lookup(method, key):
+        if module not in tried:
+            tried.add(module)
+            yield module
+    # registry can not decide, fall back to try the rest
+    for module in _rank_by_name(method, key, [m for m in registry.modules if m not in tried]):
+        yield module
+
+
+def assign(cli_kwargs):
+    method = cli_kwargs.pop('method')
+    keys = cli_kwargs.pop('keys')
+    options = cli_kwargs
 
-    for module, _ in sorted(modules, key=key, reverse=True):
+    for module in _candidates(method, keys[0]):
         a = time.time()
         try:
             module = import_module(f"bilix.{module}")
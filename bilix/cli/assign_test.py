@@ -0,0 +1,25 @@
+import click
+import pytest
+from bilix.cli.assign import auto_assemble, accepts_ranges
+from bilix.sites.bilibili import DownloaderBilibili
+from bilix.sites.cctv import DownloaderCctv
+
+
+def test_multiple_time_ranges():
+    @auto_assemble
+    def handle(cls, method, keys, options):
+        return cls, cls._cli_map[method]
+
+    assert accepts_ranges(DownloaderBilibili.get_video)
+    assert not accepts_ranges(DownloaderCctv.get_video)
+    with pytest.raises(click.BadParameter):
+        handle(DownloaderCctv, 'v', ('https://tv.cctv.com/x.shtml',), {'time_range': [(0, 1), (2, 3)]})
+
+
+def test_adaptive_option():
+    @auto_assemble
+    def handle(cls, method, keys, options):
+        return cls, None
+
+    executor, _ = handle(DownloaderCctv, 'v', ('https://tv.cctv.com/x.shtml',), {'adaptive': True})
+    assert executor.concurrency is not None
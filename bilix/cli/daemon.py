@@ -0,0 +1,145 @@
+"""
+run cli calls through a durable job queue with bounded workers, see bilix.download.jobs
+"""
+import asyncio
+from importlib import import_module
+from pathlib import Path
+from typing import Dict, Union
+
+from bilix.download.jobs import JobQueue, Job, current_job, SECRET_OPTIONS
+from bilix.log import logger
+from bilix import metrics
+from bilix.cli.assign import assign
+
+__all__ = ['JobRunner']
+
+
+class JobRunner:
+    """
+    consume a job queue, downloaders are created once per site and shared by all jobs of the site.
+    Without daemon, run() returns when no job is left; with daemon, it keeps waiting for new jobs
+    (added by other `bilix ... --queue` calls).
+    """
+
+    def __init__(self, queue: Union[str, Path, JobQueue], workers: int = 3, daemon: bool = False,
+                 poll: float = 5., report: float = 30.):
+        """
+
+        :param queue: job queue or its sqlite file
+        :param workers: number of jobs run at the same time
+        :param daemon: keep running when queue is empty
+        :param poll: seconds between checks of an empty queue
+        :param report: seconds between progress reports
+        """
+        self.queue = queue if isinstance(queue, JobQueue) else JobQueue(queue)
+        self.workers = workers
+        self.daemon = daemon
+        self.poll = poll
+        self.report = report
+        self._executors: Dict[str, object] = {}
+        self._busy = 0
+        self._workers = None
+
+    async def add(self, method: str, keys, options: dict):
+        """add a cli call (method keys options) to the queue"""
+        # secrets are not stored, jobs run by this process use the ones of this call
+        self.queue.secrets.update({k: options[k] for k in SECRET_OPTIONS if options.get(k) is not None})
+        await self.queue.add_root(method, keys, options)
+
+    def _executor(self, job: Job):
+        executor = self._executors.get(job.site)
+        if executor is None:
+            module, qualname = job.site.split(':')
+            cls = getattr(import_module(module), qualname)
+            executor = self._executors[job.site] = cls.from_options(job.options)
+            executor.job_queue = self.queue
+        return executor
+
+    async def _execute(self, job: Job):
+        if job.site:
+            await getattr(self._executor(job), job.method)(job.key, **job.kwargs)
+            return
+        # cli call, dispatch like a normal invocation
+        executor, cor = assign({'method': job.method, 'keys': (job.key,), **job.options})
+        executor.job_queue = self.queue
+        site = f"{type(executor).__module__}:{type(executor).__qualname__}"
+        if site not in self._executors:
+            self._executors[site] = executor
+        try:
+            await cor
+        finally:
+            if self._executors[site] is not executor:
+                await executor.aclose()
+
+    async def _run_job(self, job: Job):
+        token = current_job.set(job)
+        try:
+            await self._execute(job)
+        except asyncio.CancelledError:
+            await self.queue.release(job)
+            raise
+        except Exception as e:
+            retry = await self.queue.fail(job, e)
+            logger.warning(f"任务{'稍后重试' if retry else '失败'} {job.method} {job.key} {e.__class__.__name__}: {e}")
+        else:
+            await self.queue.finish(job)
+        finally:
+            current_job.reset(token)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.claim()
+            if job is None:
+                if not self.daemon and self._busy == 0:
+                    return
+                # running jobs may still add sub jobs
+                await asyncio.sleep(self.poll if self._busy == 0 else min(self.poll, 1.))
+                continue
+            self._busy += 1
+            try:
+                await self._run_job(job)
+            finally:
+                self._busy -= 1
+
+    async def _log_counts(self):
+        counts = await self.queue.counts()
+        for state, n in counts.items():
+            metrics.set_gauge('bilix_jobs', n, state=state)
+        logger.info('任务队列 ' + ' '.join(f"{state} {n}" for state, n in counts.items()))
+
+    async def _background(self):
+        renew_every = self.queue.lease / 3
+        last_report = 0.
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(min(renew_every, self.report))
+            await self.queue.renew()
+            if loop.time() - last_report >= self.report:
+                last_report = loop.time()
+                await self._log_counts()
+
+    async def run(self, method: str = None, keys=(), options: dict = None):
+        """run jobs, add the cli call (method keys options) first if provided"""
+        if method is not None:
+            await self.add(method, keys, options or {})
+        background = asyncio.ensure_future(self._background())
+        self._workers = asyncio.gather(*[self._worker() for _ in range(self.workers)])
+        try:
+            await self._workers
+        finally:
+            background.cancel()
+        await self._log_counts()
+
+    async def aclose(self):
+        """stop workers, give back unfinished jobs and close downloaders"""
+        if self._workers is not None and not self._workers.done():  # interrupted
+            self._workers.cancel()
+            try:
+                await self._workers
+            except asyncio.CancelledError:
+                pass
+        await self.queue.release_running()
+        for executor in self._executors.values():
+            await executor.aclose()
+        await self.queue.aclose()
+
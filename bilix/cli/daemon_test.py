@@ -0,0 +1,67 @@
+import pytest
+from bilix.cli.daemon import JobRunner
+from bilix.download.jobs import DONE, FAILED
+
+done = []
+
+
+class FakeDownloader:
+    job_queue = None
+
+    @classmethod
+    def from_options(cls, options: dict):
+        return cls()
+
+    async def get_list(self, key: str, num: int):
+        for i in range(num):
+            await self.job_queue.submit(self, 'get_item', f'{key}-{i}', {'fail': i == 1})
+
+    async def get_item(self, key: str, fail: bool):
+        if fail and key not in done:
+            done.append(key)
+            raise ValueError(key)
+        done.append(key)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_runner(tmp_path):
+    runner = JobRunner(tmp_path / 'jobs.db', workers=2, poll=0.01)
+    await runner.queue.submit(FakeDownloader(), 'get_list', 'a', {'num': 3})
+    await runner.run()
+    await runner.aclose()
+    assert sorted(done) == ['a-0', 'a-1', 'a-1', 'a-2']  # a-1 succeeded on retry
+    runner = JobRunner(tmp_path / 'jobs.db')
+    assert await runner.queue.counts() == {'pending': 0, 'running': 0, DONE: 4, FAILED: 0}
+    await runner.aclose()
+
+
+@pytest.mark.asyncio
+async def test_runner_root_job(tmp_path, monkeypatch):
+    from bilix.sites.bilibili import api
+    from bilix.sites.bilibili.downloader import DownloaderBilibili
+    calls = []
+
+    async def get_up_info(client, url_or_mid):
+        return {'name': 'up', 'mid': 123}
+
+    async def get_up_video_info(client, url_or_mid, pn=1, ps=30, order="pubdate", keyword=""):
+        return 'up', 2, ['BV1', 'BV2'], ['a', 'b']
+
+    async def get_series(self, url, path, **kwargs):
+        calls.append((url, path))
+
+    monkeypatch.setattr(api, 'get_up_info', get_up_info)
+    monkeypatch.setattr(api, 'get_up_video_info', get_up_video_info)
+    monkeypatch.setattr(DownloaderBilibili, 'get_series', get_series)
+    runner = JobRunner(tmp_path / 'jobs.db', workers=1, poll=0.01)
+    # options come back from json, path as str
+    await runner.run('up', ('https://space.bilibili.com/123',), {'path': tmp_path, 'num': 2, 'cookie': 'secret'})
+    await runner.aclose()
+    runner = JobRunner(tmp_path / 'jobs.db')
+    assert await runner.queue.counts() == {'pending': 0, 'running': 0, DONE: 3, FAILED: 0}
+    await runner.aclose()
+    assert sorted(calls) == [(f'https://www.bilibili.com/video/BV{i}', tmp_path / '【up】up') for i in (1, 2)]
+    assert b'secret' not in (tmp_path / 'jobs.db').read_bytes()
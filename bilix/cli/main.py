@@ -6,7 +6,7 @@ import rich
 from rich.panel import Panel
 from rich.table import Table
 
-from .. import __version__
+from .. import __version__, metrics
 from ..log import logger
 from .assign import assign
 from ..progress.cli_progress import CLIProgress
@@ -163,12 +163,45 @@ def print_help():
     )
     table.add_row(
         "-tr --time-range", '[dark_cyan]str',
-        '下载视频的时间范围，格式如 h:m:s-h:m:s 或 s-s，默认无，仅get_video时生效',
+        '下载视频的时间范围，格式如 h:m:s-h:m:s 或 s-s，多个范围用逗号分隔（分段只下载一次），默认无，仅get_video时生效',
+    )
+    table.add_row(
+        "--speedup", '[dark_cyan]float',
+        'm3u8下载速度至少为播放速度的倍数，在前几个分段上测量吞吐量，达不到时改用较低码率，'
+        '批量下载时可设为总时长/时间预算，默认不测量，仅m3u8类站点生效',
+    )
+    table.add_row(
+        "--duration", '[dark_cyan]str',
+        '直播录制时长，格式如 h:m:s 或 s，默认录制到直播结束，仅live时生效',
     )
     table.add_row(
         "--meta", '',
         '下载视频元数据'
     )
+    table.add_row(
+        "--queue", '[dark_cyan]str',
+        '任务队列文件（sqlite），提供时批量下载的每个视频和分p作为任务持久化（视频内的音视频流和附属文件不单独记录），'
+        '中断后重复执行命令从剩余任务继续，'
+        'cookie不写入队列文件，执行任务时使用本次命令的--cookie或环境变量BILIX_COOKIE',
+    )
+    table.add_row(
+        "--daemon", '',
+        '配合--queue使用，队列为空时不退出，持续执行其他命令加入队列的任务',
+    )
+    table.add_row(
+        "--asset-cache", '',
+        '缓存封面、头像等图片（~/.cache/bilix/assets，最多512MB），多个视频共用的图片只下载一次并以只读硬链接放置，'
+        '再次下载时用条件请求校验，默认不缓存',
+    )
+    table.add_row(
+        "--adaptive", '',
+        '自适应并发，根据各主机吞吐量和403/429、网络错误在运行时增减分段并发和视频并发，以设置的并发数为初始值',
+    )
+    table.add_row(
+        "--metrics", '[dark_cyan]str',
+        '导出下载指标，json（写入日志） | statsd://host:port | prom:文件路径（prometheus textfile） | '
+        'http://host:port（prometheus抓取地址 /metrics），默认不记录',
+    )
     table.add_row("-h --help", '', "帮助信息")
     table.add_row("-v --version", '', "版本信息")
     table.add_row("--debug", '', "显示debug信息")
@@ -201,8 +234,16 @@ class BasedTimeRange(click.ParamType):
     name = "time_range"
 
     def convert(self, value, param, ctx):
-        start_time, end_time = map(s2t, value.split('-'))
-        return start_time, end_time
+        ranges = [tuple(map(s2t, r.split('-'))) for r in value.split(',') if r]
+        return ranges[0] if len(ranges) == 1 else ranges
+
+
+class BasedDuration(click.ParamType):
+    name = "duration"
+
+    def convert(self, value, param, ctx):
+        if value is not None:
+            return s2t(value)
 
 
 @click.command(add_help_option=False)
@@ -341,6 +382,18 @@ class BasedTimeRange(click.ParamType):
     type=BasedTimeRange(),
     default=None,
 )
+@click.option(
+    '--speedup',
+    'speedup',
+    type=float,
+    default=None,
+)
+@click.option(
+    '--duration',
+    'duration',
+    type=BasedDuration(),
+    default=None,
+)
 @click.option(
     '-h',
     "--help",
@@ -370,21 +423,66 @@ class BasedTimeRange(click.ParamType):
     is_flag=True,
     default=False,
 )
+@click.option(
+    '--queue',
+    'queue',
+    type=Path,
+    default=None,
+)
+@click.option(
+    '--daemon',
+    'daemon',
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    '--asset-cache',
+    'asset_cache',
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    '--adaptive',
+    'adaptive',
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    '--metrics',
+    'metrics_spec',
+    type=str,
+    default=None,
+)
 def main(**kwargs):
     loop = asyncio.new_event_loop()  # avoid deprecated warning in 3.11
     asyncio.set_event_loop(loop)
     logger.debug(f'CLI KEY METHOD and OPTIONS: {kwargs}')
+    executor = None
+    queue, daemon = kwargs.pop('queue'), kwargs.pop('daemon')
+    metrics_spec, reporter = kwargs.pop('metrics_spec'), None
     try:
+        if metrics_spec:
+            reporter = metrics.enable(metrics.sink_from_spec(metrics_spec))
+            loop.run_until_complete(reporter.start())
         # CLIProgress.switch_theme(gs="cyan", bs="dark_cyan")
         CLIProgress.start()  # start progress
         if not kwargs['path'].exists():
             kwargs['path'].mkdir(parents=True)
             logger.info(f'Directory {kwargs["path"]} not exists, auto created')
-        executor, cor = assign(kwargs)
+        if queue:
+            from .daemon import JobRunner
+            executor = JobRunner(queue, workers=kwargs['video_concurrency'], daemon=daemon)
+            cor = executor.run(kwargs.pop('method'), kwargs.pop('keys'), kwargs)
+        else:
+            executor, cor = assign(kwargs)
         loop.run_until_complete(cor)
     except HandleError as e:  # method no match
         logger.error(e)
     except KeyboardInterrupt:
         logger.info('[cyan]提示：用户中断，重复执行命令可继续下载')
     finally:
+        if executor is not None:
+            loop.run_until_complete(executor.aclose())  # stop worker processes and clean up temporary files
+        if reporter is not None:
+            loop.run_until_complete(reporter.aclose())  # export final values
         CLIProgress.stop()  # stop rich progress to ensure cursor is repositioned
@@ -0,0 +1,152 @@
+"""
+precomputed dispatch table for cli assign, built from the source of bilix download modules without importing them
+"""
+import ast
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple, Iterator
+from urllib.parse import urlparse
+
+from bilix import __version__
+from bilix.log import logger
+from bilix.utils import cache_dir
+
+BILIX_ROOT = Path(__file__).parent.parent
+BASE_MODULES = ['download.base_downloader_m3u8', 'download.base_downloader_part']
+
+
+def cache_path() -> Path:
+    return cache_dir() / 'site_registry.json'
+
+
+def module_files(module: str) -> List[Path]:
+    """source files that may contain handlers of the module (package or single file)"""
+    path = BILIX_ROOT.joinpath(*module.split('.'))
+    if path.is_dir():
+        return sorted(p for p in path.glob('*.py') if not p.name.endswith('_test.py'))
+    return [path.with_suffix('.py')]
+
+
+def find_modules() -> List[str]:
+    modules = list(BASE_MODULES)
+    for site in sorted((BILIX_ROOT / 'sites').iterdir()):
+        if site.is_dir() and (site / '__init__.py').exists():
+            modules.append(f"sites.{site.name}")
+    return modules
+
+
+def _fingerprint(modules: List[str]) -> List:
+    fp = [__version__]
+    for module in modules:
+        for file in module_files(module):
+            st = file.stat()
+            fp.append([str(file.relative_to(BILIX_ROOT)), st.st_mtime_ns, st.st_size])
+    return fp
+
+
+def _parse_class(node: ast.ClassDef) -> dict:
+    info = {'pattern': None, 'methods': [], 'custom': False}
+    for item in node.body:
+        if isinstance(item, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'pattern' for t in item.targets):
+            call = item.value
+            if isinstance(call, ast.Call) and call.args and isinstance(call.args[0], ast.Constant):
+                info['pattern'] = call.args[0].value
+        elif isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name in {'handle', '_decide_handle'}:
+            info['custom'] = True  # decide by code, can not be known statically
+        elif isinstance(item, ast.AsyncFunctionDef) and not item.name.startswith('_'):
+            doc = ast.get_docstring(item) or ''
+            if ':cli:' in doc:
+                info['methods'].append(item.name)
+                if m := re.search(r":cli: short: (\w+)", doc):
+                    info['methods'].append(m.group(1))
+    return info
+
+
+def parse_module(module: str) -> dict:
+    """collect url patterns and cli methods of all downloader classes defined in the module"""
+    entry = {'patterns': [], 'methods': [], 'free_methods': [], 'custom': False}
+    for file in module_files(module):
+        tree = ast.parse(file.read_text(encoding='utf-8'), filename=str(file))
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.ClassDef):
+                continue
+            info = _parse_class(node)
+            entry['custom'] |= info['custom']
+            entry['methods'].extend(info['methods'])
+            if info['pattern']:
+                entry['patterns'].append(info['pattern'])
+            elif not info['custom']:  # handled by method name only, like m3u8, file
+                entry['free_methods'].extend(info['methods'])
+    return entry
+
+
+def build_registry(modules: List[str]) -> Dict[str, dict]:
+    return {module: parse_module(module) for module in modules}
+
+
+def load_registry() -> Dict[str, dict]:
+    """load dispatch table from disk cache, rebuild and save it when bilix source changed"""
+    modules = find_modules()
+    fingerprint = _fingerprint(modules)
+    path = cache_path()
+    try:
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['fingerprint'] == fingerprint:
+            return cache['registry']
+    except (OSError, ValueError, KeyError):
+        pass
+    registry = build_registry(modules)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': fingerprint, 'registry': registry}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug(f"failed to cache site registry to {path}: {e}")
+    return registry
+
+
+class Registry:
+    """lookup candidate modules for a cli call without importing any of them"""
+
+    def __init__(self, registry: Dict[str, dict]):
+        self.modules = list(registry)
+        self._patterns: List[Tuple[re.Pattern, str]] = []
+        self._names: Dict[str, str] = {}
+        self._free_methods: Dict[str, List[str]] = {}
+        self._methods: Dict[str, List[str]] = {}
+        for module, entry in registry.items():
+            self._names[module.split('.')[-1]] = module
+            for p in entry['patterns']:
+                self._patterns.append((re.compile(p), module))
+            for m in entry['free_methods']:
+                self._free_methods.setdefault(m, []).append(module)
+            for m in entry['methods']:
+                self._methods.setdefault(m, []).append(module)
+
+    def lookup(self, method: str, key: str) -> Iterator[str]:
+        """
+        yield modules that are likely to handle the key in priority order, may yield duplicates
+
+        :param method: cli method
+        :param key: the first cli key
+        :return:
+        """
+        if key.startswith('http'):
+            # 1. site name in url host like www.bilibili.com -> sites.bilibili
+            for label in (urlparse(key).hostname or '').split('.'):
+                if label in self._names:
+                    yield self._names[label]
+            # 2. declared url pattern
+            for pattern, module in self._patterns:
+                if pattern.match(key):
+                    yield module
+        # 3. downloader decided by method name only
+        yield from self._free_methods.get(method, ())
+        # 4. any downloader provide the method, like cate of bilibili
+        if not key.startswith('http'):
+            yield from self._methods.get(method, ())
@@ -0,0 +1,10 @@
+from bilix.cli.registry import Registry, build_registry, find_modules
+
+
+def test_registry_lookup():
+    registry = Registry(build_registry(find_modules()))
+    assert next(registry.lookup('v', 'https://www.douyin.com/video/7132430286415252773')) == 'sites.douyin'
+    assert next(registry.lookup('s', 'https://b23.tv/BV1sS4y1b7qb')) == 'sites.bilibili'
+    assert next(registry.lookup('v', 'https://cn.pornhub.com/view_video.php?viewkey=1')) == 'sites.pronhub'
+    assert next(registry.lookup('m3u8', 'https://example.com/a.m3u8')) == 'download.base_downloader_m3u8'
+    assert next(registry.lookup('cate', '宅舞')) == 'sites.bilibili'
@@ -0,0 +1,182 @@
+"""
+content addressed cache of static assets (covers, avatars), shared by all files that use the same url
+"""
+import asyncio
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import aiofiles
+import httpx
+
+from bilix._json import loads
+from bilix.download.utils import req_retry
+from bilix.log import logger
+from bilix import metrics
+from bilix.utils import cache_dir
+
+__all__ = ['AssetCache']
+
+
+def _link_or_copy(src: Path, dst: Path):
+    os.chmod(src, 0o444)  # an in-place edit of one link must not change the object and its other links
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src, dst)  # other filesystem or no hardlink support
+
+
+def _write_object(obj: Path, content: bytes):
+    if obj.exists():
+        return
+    obj.parent.mkdir(parents=True, exist_ok=True)
+    tmp = obj.with_name(f"{obj.name}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, obj)
+
+
+class AssetCache:
+    """
+    objects are stored by sha256 of their content under root/objects, and index.json maps url to
+    hash, ETag, Last-Modified and last use. In one run each url is requested once and every destination is a
+    read-only hardlink (or a copy across filesystems) of the object. In later runs a known url is revalidated
+    with a conditional request instead of downloaded again. Objects least recently used are removed when the
+    cache grows over max_size.
+    """
+
+    def __init__(self, root: Union[str, Path] = None, max_size: int = 512 * 1024 * 1024):
+        """
+
+        :param root: cache directory, default to <cache dir>/assets
+        :param max_size: bytes of objects kept after save
+        """
+        self.root = Path(root) if root else cache_dir() / 'assets'
+        self.max_size = max_size
+        self._index: Optional[Dict[str, dict]] = None
+        self._dirty = False
+        self._fetching: Dict[str, asyncio.Future] = {}
+        self._lock = asyncio.Lock()
+
+    def _object(self, digest: str) -> Path:
+        return self.root / 'objects' / digest[:2] / digest
+
+    async def _load(self):
+        async with self._lock:
+            if self._index is None:
+                try:
+                    async with aiofiles.open(self.root / 'index.json', 'rb') as f:
+                        self._index = loads(await f.read())
+                except (OSError, ValueError):
+                    self._index = {}
+
+    async def _store(self, url: str, res: httpx.Response) -> str:
+        content = res.content
+        digest = hashlib.sha256(content).hexdigest()
+        await asyncio.get_event_loop().run_in_executor(None, _write_object, self._object(digest), content)
+        self._index[url] = {'hash': digest, 'etag': res.headers.get('ETag'),
+                            'last_modified': res.headers.get('Last-Modified'), 'used': time.time()}
+        self._dirty = True
+        return digest
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> str:
+        await self._load()
+        entry = self._index.get(url)
+        if entry and await asyncio.get_event_loop().run_in_executor(None, self._object(entry['hash']).exists):
+            entry['used'] = time.time()
+            self._dirty = True
+            headers = {}
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            if headers:
+                try:
+                    res = await client.get(url, headers=headers)
+                    if res.status_code == 304:
+                        logger.debug(f"asset not modified {url}")
+                        metrics.inc('bilix_asset_cache_total', result='not_modified')
+                        return entry['hash']
+                    res.raise_for_status()
+                    metrics.inc('bilix_asset_cache_total', result='changed')
+                    return await self._store(url, res)
+                except httpx.HTTPError as e:
+                    logger.debug(f"asset revalidation failed {e.__class__.__name__} {url}")
+        metrics.inc('bilix_asset_cache_total', result='miss')
+        res = await req_retry(client, url)
+        return await self._store(url, res)
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, dst: Path) -> Path:
+        """
+        place the content of url at dst
+
+        :param client:
+        :param url:
+        :param dst: destination file path
+        :return: dst
+        """
+        fut = self._fetching.get(url)
+        if fut is None:
+            fut = self._fetching[url] = asyncio.ensure_future(self._fetch(client, url))
+        else:
+            metrics.inc('bilix_asset_cache_total', result='hit')  # fetched in this run
+        try:
+            digest = await asyncio.shield(fut)
+        except Exception:
+            if self._fetching.get(url) is fut:
+                del self._fetching[url]  # let others retry
+            raise
+        await asyncio.get_event_loop().run_in_executor(None, _link_or_copy, self._object(digest), dst)
+        return dst
+
+    def _prune(self, index: Dict[str, dict]) -> Dict[str, dict]:
+        """remove objects least recently used until the total size is under max_size, return index left"""
+        used: Dict[str, float] = {}
+        for entry in index.values():
+            used[entry['hash']] = max(used.get(entry['hash'], 0.), entry.get('used', 0.))
+        objects = []
+        for obj in (self.root / 'objects').glob('*/*'):
+            if not obj.name.endswith('.tmp'):
+                objects.append((used.get(obj.name, 0.), obj.stat().st_size, obj))
+        total = sum(size for _, size, _ in objects)
+        removed = set()
+        for _, size, obj in sorted(objects, key=lambda o: o[0]):
+            if total <= self.max_size:
+                break
+            os.chmod(obj, 0o644)  # read-only files can not be removed on windows
+            obj.unlink()
+            removed.add(obj.name)
+            total -= size
+        if removed:
+            logger.debug(f"asset cache removed {len(removed)} objects")
+        return {url: entry for url, entry in index.items() if entry['hash'] not in removed}
+
+    def _save_sync(self, index: Dict[str, dict]) -> Dict[str, dict]:
+        index = self._prune(index)
+        path = self.root / 'index.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"index.json.{os.getpid()}")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(index, ensure_ascii=False))
+        os.replace(tmp, path)
+        return index
+
+    async def save(self):
+        """persist the url index and remove objects over max_size"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # work on a snapshot, fetches may go on meanwhile
+        snapshot = dict(self._index)
+        index = await asyncio.get_event_loop().run_in_executor(None, self._save_sync, snapshot)
+        self._index = {url: entry for url, entry in self._index.items() if url in index or url not in snapshot}
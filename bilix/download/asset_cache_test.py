@@ -0,0 +1,47 @@
+import asyncio
+import httpx
+import pytest
+from bilix.download.asset_cache import AssetCache
+
+
+@pytest.mark.asyncio
+async def test_asset_cache(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, content=b'jpg', headers={'ETag': '"v1"'})
+
+    url = 'http://i0.hdslb.com/bfs/archive/cover.jpg'
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        cache = AssetCache(tmp_path / 'cache')
+        dst = [tmp_path / 'a-fanart.jpg', tmp_path / 'a-backdrop1.jpg']
+        await asyncio.gather(*[cache.fetch(client, url, p) for p in dst])
+        assert requests == [None]
+        assert dst[0].read_bytes() == dst[1].read_bytes() == b'jpg'
+        assert dst[0].stat().st_ino == dst[1].stat().st_ino
+        await cache.save()
+
+        cache = AssetCache(tmp_path / 'cache')
+        await cache.fetch(client, url, tmp_path / 'b.jpg')
+        assert requests == [None, '"v1"']
+        assert (tmp_path / 'b.jpg').read_bytes() == b'jpg'
+        # objects are read-only, an in-place edit of one link can not reach the others
+        assert dst[0].stat().st_mode & 0o222 == 0
+
+
+@pytest.mark.asyncio
+async def test_asset_cache_prune(tmp_path):
+    def handler(request: httpx.Request):
+        return httpx.Response(200, content=request.url.path.encode() * 10)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        cache = AssetCache(tmp_path / 'cache', max_size=130)
+        for name in ('a', 'b', 'c'):  # 60 bytes each
+            await cache.fetch(client, f'http://i0.hdslb.com/{name}.jpg', tmp_path / f'{name}.jpg')
+        await cache.save()
+    objects = list((tmp_path / 'cache' / 'objects').glob('*/*'))
+    assert len(objects) == 2 and sorted(cache._index) == ['http://i0.hdslb.com/b.jpg', 'http://i0.hdslb.com/c.jpg']
+    assert (tmp_path / 'a.jpg').read_bytes() == b'/a.jpg' * 10  # placed files stay
@@ -1,23 +1,30 @@
 import asyncio
 import inspect
 import logging
+import os
 import re
 import time
 from functools import wraps
-from typing import Union, Optional, Tuple
+from typing import Union, Optional, Tuple, Awaitable, TYPE_CHECKING
 from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 import aiofiles
 import httpx
 
-from bilix.cli.assign import auto_assemble
+from bilix.cli.assign import auto_assemble, kwargs_filter
 from bilix.log import logger as dft_logger
-from bilix.download.utils import req_retry, path_check
+from bilix.download.utils import req_retry
+from bilix.download.fs import afs
+from bilix.download.asset_cache import AssetCache
+from bilix.download.concurrency import AdaptiveConcurrency, AdaptiveSemaphore, THROTTLE, TRANSPORT, ERROR
+from bilix import metrics
 from bilix.progress.abc import Progress
-from bilix.progress.cli_progress import CLIProgress
 from bilix.exception import HandleMethodError
 from pathlib import Path, PurePath
 
+if TYPE_CHECKING:
+    from bilix.download.jobs import JobQueue
+
 __all__ = ['BaseDownloader']
 
 
@@ -28,7 +35,7 @@ class BaseDownloaderMeta(type):
         for method_name, method in dct.items():
             if not method_name.startswith('_') and asyncio.iscoroutinefunction(method):
                 if 'path' in (sig := inspect.signature(method)).parameters:
-                    dct[method_name] = cls.ensure_path(method, sig)
+                    method = dct[method_name] = cls.ensure_path(method, sig)  # cli dispatch goes through it too
 
                 if cls.check_unique_method(method, bases):
                     cli_info = cls.parse_cli_doc(method)
@@ -78,9 +85,20 @@ class BaseDownloaderMeta(type):
         return wrapper
 
 
+class StreamStat:
+    """bytes received by one stream, see BaseDownloader._stream_context"""
+    __slots__ = ('bytes',)
+
+    def __init__(self):
+        self.bytes = 0
+
+
 class BaseDownloader(metaclass=BaseDownloaderMeta):
     pattern: re.Pattern = None
     cookie_domain: str = ""
+    concurrency: Optional[AdaptiveConcurrency] = None  # when set, stream limits adapt at runtime
+    asset_cache: Optional[AssetCache] = None  # when set, get_static without convert_func goes through it
+    job_queue: Optional['JobQueue'] = None  # when set, calls made through _submit are persisted as jobs
     _cli_info: dict
     _cli_map: dict
 
@@ -101,8 +119,11 @@ class BaseDownloader(metaclass=BaseDownloaderMeta):
         :param speed_limit: global download rate for the downloader, should be a number (Byte/s unit)
         :param progress: progress obj
         """
-        # use cli progress by default
-        self.progress = progress or CLIProgress()
+        # use cli progress by default, rich progress is imported lazily to speed up startup
+        if progress is None:
+            from bilix.progress.cli_progress import CLIProgress
+            progress = CLIProgress()
+        self.progress = progress
         self.logger = logger or dft_logger
         self.client = client if client else httpx.AsyncClient(headers={'user-agent': 'PostmanRuntime/7.29.0'})
         if browser:  # load cookies from browser, may need auth
@@ -124,12 +145,14 @@ class BaseDownloader(metaclass=BaseDownloaderMeta):
         """Close transport and proxies for httpx client"""
         await self.client.aclose()
 
-    async def get_static(self, url: str, path: Union[str, Path], convert_func=None) -> Path:
+    @metrics.timed('static')
+    async def get_static(self, url: str, path: Union[str, Path], convert_func=None, overwrite=False) -> Path:
         """
 
         :param url:
         :param path: file path without suffix
         :param convert_func: function used to convert http bytes content, must be named like ...2...
+        :param overwrite: replace an existing file, it is kept until the new content is complete
         :return: downloaded file path
         """
         # use suffix from convert_func's name
@@ -139,46 +162,116 @@ class BaseDownloader(metaclass=BaseDownloaderMeta):
         else:
             suffix = PurePath(urlparse(url).path).suffix
         path = path.with_name(path.name + suffix)
-        exist, path = path_check(path)
-        if exist:
+        exist, path = await afs.path_check(path)
+        if exist and not overwrite:
             self.logger.info(f'[green]已存在[/green] {path}')# .name}')
             return path
-        res = await req_retry(self.client, url)
-        content = convert_func(res.content) if convert_func else res.content
-        async with aiofiles.open(path, 'wb') as f:
-            await f.write(content)
+        dst = path.with_name(f"{path.name}.{os.getpid()}.tmp") if exist else path
+        if not convert_func and self.asset_cache is not None:
+            await self.asset_cache.fetch(self.client, url, dst)
+        else:
+            res = await req_retry(self.client, url)
+            if convert_func:  # conversion of large content should not block the event loop
+                content = await asyncio.get_event_loop().run_in_executor(None, convert_func, res.content)
+            else:
+                content = res.content
+            async with aiofiles.open(dst, 'wb') as f:
+                await f.write(content)
+        if dst != path:
+            await asyncio.get_event_loop().run_in_executor(None, os.replace, dst, path)
         self.logger.info(f'[cyan]已完成[/cyan] {path}')# .name}')
         return path
 
+    def _submit(self, func, key: str, **kwargs) -> Awaitable:
+        """
+        call func(key, **kwargs), used by methods that enumerate videos. When job_queue is set the call is added
+        as a sub job of current job instead, kwargs should be json serializable in that case
+
+        :param func: bound public method of self
+        :param key: first positional argument of func, e.g. url
+        :return: awaitable
+        """
+        if self.job_queue is None:
+            return func(key, **kwargs)
+        return self.job_queue.submit(self, func.__name__, key, kwargs)
+
+    @classmethod
+    def from_options(cls, options: dict):
+        """build downloader from cli options"""
+        executor = cls(**kwargs_filter(cls, options))
+        if options.get('adaptive'):
+            executor.use_adaptive_concurrency()
+        return executor
+
+    def use_adaptive_concurrency(self, controller: AdaptiveConcurrency = None):
+        """
+        let part and video stream limits follow throughput and errors at runtime, starting from the configured
+        concurrency, see bilix.download.concurrency
+
+        :param controller: shared controller, a new one by default
+        """
+        if controller is None and self.concurrency is not None:
+            return  # already adaptive
+        self.concurrency = controller or AdaptiveConcurrency()
+        v_sema = getattr(self, 'v_sema', None)
+        if type(v_sema) is asyncio.Semaphore:
+            self.v_sema = self.concurrency.video_sema(v_sema._value)  # not acquired yet, _value is the initial
+
+    def _part_sema(self, url, concurrency: int) -> Union[asyncio.Semaphore, AdaptiveSemaphore]:
+        """semaphore for the parts or segments of one media"""
+        if self.concurrency is None:
+            return asyncio.Semaphore(concurrency)
+        return self.concurrency.part_sema(url, concurrency)
+
     @asynccontextmanager
-    async def _stream_context(self, times: int):
+    async def _stream_context(self, times: int, url=None):
         """
-        contextmanager to print log, slow down streaming and count active stream number
+        contextmanager to print log, slow down streaming and count active stream number.
+        Add received bytes to the yielded stat, they are recorded with stream duration when metrics is enabled
 
         :param times: error occur times which is related to sleep time
+        :param url: url of the stream, its host is used as metrics label
         :return:
         """
         self._stream_num += 1
+        stat = StreamStat()
+        start = time.perf_counter()
+        host = urlparse(str(url)).netloc if url and metrics.enabled() else ''
+        metrics.add_gauge('bilix_active_streams', 1)
+        error = None
         try:
-            yield
+            yield stat
         except httpx.HTTPStatusError as e:
+            error = THROTTLE if e.response.status_code in (403, 429) else ERROR
+            metrics.inc('bilix_stream_errors_total', host=host, reason=e.response.status_code)
             if e.response.status_code == 403:
                 self.logger.warning(f"STREAM slowing down since 403 forbidden {e}")
+                metrics.inc('bilix_stream_slowdown_seconds_total', 10. * (times + 1), host=host)
                 await asyncio.sleep(10. * (times + 1))
             else:
                 self.logger.warning(f"STREAM {e}")
                 await asyncio.sleep(.5 * (times + 1))
             raise
         except httpx.TransportError as e:
+            error = TRANSPORT
+            metrics.inc('bilix_stream_errors_total', host=host, reason=e.__class__.__name__)
             msg = f'STREAM {e.__class__.__name__} 异常可能由于网络条件不佳或并发数过大导致，若重复出现请考虑降低并发数'
             self.logger.warning(msg) if times > 2 else self.logger.debug(msg)
             await asyncio.sleep(.1 * (times + 1))
             raise
         except Exception as e:
+            error = ERROR
+            metrics.inc('bilix_stream_errors_total', host=host, reason=e.__class__.__name__)
             self.logger.warning(f'STREAM Unexpected Exception class:{e.__class__.__name__} {e}')
             raise
         finally:
             self._stream_num -= 1
+            if self.concurrency is not None and url:
+                self.concurrency.record(url, stat.bytes, error)
+            if metrics.enabled():
+                metrics.add_gauge('bilix_active_streams', -1)
+                metrics.inc('bilix_stream_bytes_total', stat.bytes, host=host)
+                metrics.observe('bilix_stream_seconds', time.perf_counter() - start, host=host)
 
     @property
     def stream_num(self):
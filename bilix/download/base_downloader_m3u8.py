@@ -1,20 +1,86 @@
 import asyncio
-import uuid
+import re
+import time
 from pathlib import Path, PurePath
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union, TYPE_CHECKING
 from urllib.parse import urlparse
 import aiofiles
 import httpx
 import os
-import m3u8
-from Crypto.Cipher import AES
-from m3u8 import Segment
 from bilix.download.base_downloader import BaseDownloader
-from bilix.download.utils import path_check, merge_files
+from bilix.download.utils import merge_files
+from bilix.download.fs import afs
+from bilix.download.concurrency import AdaptiveSemaphore
 from bilix import ffmpeg
+from bilix import metrics
 from .utils import req_retry
 
-__all__ = ['BaseDownloaderM3u8']
+if TYPE_CHECKING:  # m3u8 and Crypto are imported lazily to speed up startup
+    import m3u8
+    from m3u8 import Segment, Playlist
+
+__all__ = ['BaseDownloaderM3u8', 'sort_variants', 'select_variant', 'select_segments']
+
+
+def _variant_key(playlist: 'Playlist') -> Tuple[int, int]:
+    info = playlist.stream_info
+    height = info.resolution[1] if info.resolution else 0
+    return height, info.bandwidth or 0
+
+
+def sort_variants(playlists) -> List['Playlist']:
+    """variants of a master playlist from high to low by declared RESOLUTION, then BANDWIDTH"""
+    return sorted(playlists, key=_variant_key, reverse=True)
+
+
+def select_variant(playlists, quality: Union[int, str] = 0) -> 'Playlist':
+    """
+    choose a variant like the quality option of sites
+
+    :param playlists: variants of a master playlist
+    :param quality: int for relative choice, 0 is the highest, out of range for the lowest;
+        str like '720p' for the highest variant not above the height
+    :return:
+    """
+    variants = sort_variants(playlists)
+    if isinstance(quality, str):
+        if m := re.match(r'(\d+)', quality):
+            height = int(m.group(1))
+            return next((v for v in variants if _variant_key(v)[0] <= height), variants[-1])
+        quality = 0
+    return variants[min(quality, len(variants) - 1)]
+
+
+def select_segments(m3u8_info: 'm3u8.M3U8', time_range: Tuple[int, int] = None) \
+        -> Tuple[List[Tuple[int, 'Segment']], Optional[float]]:
+    """
+    segments to download with their index in the playlist
+
+    :param m3u8_info: media playlist
+    :param time_range: (start, end) in seconds, the first segment is kept whole to start on a key frame
+    :return: segments and seconds kept of the last one when it crosses end, None if kept whole
+    """
+    selected = []
+    tail = None
+    current_time = 0
+    for idx, seg in enumerate(m3u8_info.segments):
+        seg_start = current_time
+        current_time += seg.duration
+        if time_range:
+            start_time, end_time = time_range
+            if seg_start >= end_time:
+                break
+            if current_time <= start_time:
+                continue
+            if current_time > end_time:
+                tail = end_time - seg_start
+        # https://stackoverflow.com/questions/50628791/decrypt-m3u8-playlist-encrypted-with-aes-128-without-iv
+        if seg.key and seg.key.iv is None:  # iv is the media sequence number
+            seg.custom_parser_values['iv'] = ((m3u8_info.media_sequence or 0) + idx).to_bytes(16, 'big')
+        selected.append((idx, seg))
+        if tail is not None:
+            break
+    return selected, tail
 
 
 class BaseDownloaderM3u8(BaseDownloader):
@@ -45,77 +111,124 @@ class BaseDownloaderM3u8(BaseDownloader):
         self.part_concurrency = part_concurrency
         self.decrypt_cache = {}
 
-    async def _decrypt(self, seg: m3u8.Segment, content: bytearray):
-        async def get_key():
-            key_bytes = (await req_retry(self.client, uri)).content
-            iv = bytes.fromhex(seg.key.iv.replace('0x', '')) if seg.key.iv is not None else \
-                seg.custom_parser_values['iv']
-            return AES.new(key_bytes, AES.MODE_CBC, iv)
+    decrypt_cache_size = 16  # keys kept, live streams may rotate keys
+    live_edge_segments = 3  # a live recording starts this many segments from the end of the playlist
+    probe_segments = 3  # segments downloaded to measure throughput of a variant
 
+    @metrics.timed('decrypt')
+    async def _decrypt(self, seg: 'm3u8.Segment', content: bytearray):
+        from Crypto.Cipher import AES
         uri = seg.key.absolute_uri
-        if uri not in self.decrypt_cache:
-            self.decrypt_cache[uri] = asyncio.ensure_future(get_key())
-            self.decrypt_cache[uri] = await self.decrypt_cache[uri]
-        elif asyncio.isfuture(self.decrypt_cache[uri]):
-            await self.decrypt_cache[uri]
-        cipher = self.decrypt_cache[uri]
-        return cipher.decrypt(content)
-
-    async def to_invariant_m3u8(self, m3u8_url: str) -> m3u8.M3U8:
+        if uri not in self.decrypt_cache:  # share the key request, but not the cipher which is stateful in CBC mode
+            self.decrypt_cache[uri] = asyncio.ensure_future(req_retry(self.client, uri))
+            if len(self.decrypt_cache) > self.decrypt_cache_size:
+                self.decrypt_cache.pop(next(iter(self.decrypt_cache)))
+        key_bytes = (await asyncio.shield(self.decrypt_cache[uri])).content
+        iv = bytes.fromhex(seg.key.iv.replace('0x', '')) if seg.key.iv is not None else \
+            seg.custom_parser_values['iv']
+        return AES.new(key_bytes, AES.MODE_CBC, iv).decrypt(content)
+
+    async def _load_m3u8(self, m3u8_url: str) -> 'm3u8.M3U8':
+        import m3u8
         res = await req_retry(self.client, m3u8_url, follow_redirects=True)
         m3u8_info = m3u8.loads(res.text)
         if not m3u8_info.base_uri:
             m3u8_info.base_uri = m3u8_url
+        return m3u8_info
+
+    async def to_invariant_m3u8(self, m3u8_url: str, quality: Union[int, str] = 0) -> 'm3u8.M3U8':
+        m3u8_info = await self._load_m3u8(m3u8_url)
         if m3u8_info.is_variant:
-            self.logger.debug(f"m3u8 is variant, use first playlist: {m3u8_info.playlists[0].absolute_uri}")
-            return await self.to_invariant_m3u8(m3u8_info.playlists[0].absolute_uri)
+            playlist = select_variant(m3u8_info.playlists, quality)
+            self.logger.debug(f"m3u8 is variant, use {_variant_key(playlist)} playlist: {playlist.absolute_uri}")
+            return await self.to_invariant_m3u8(playlist.absolute_uri)
         return m3u8_info
 
-    async def get_m3u8_video(self, m3u8_url: str, path: Union[str, Path], time_range: Tuple[int, int] = None) -> Path:
+    async def _probe_m3u8(self, m3u8_url: str, quality: Union[int, str], speedup: float, path: Path,
+                          time_range: Tuple[int, int] = None) -> 'm3u8.M3U8':
+        """
+        like to_invariant_m3u8, but measure throughput on the first segments of the chosen variant and switch to
+        the highest lower variant that the link can download speedup times faster than playback
+        """
+        m3u8_info = await self._load_m3u8(m3u8_url)
+        if not m3u8_info.is_variant:
+            return m3u8_info
+        variants = sort_variants(m3u8_info.playlists)
+        chosen = select_variant(variants, quality)
+        m3u8_info = await self.to_invariant_m3u8(chosen.absolute_uri)
+        if chosen is variants[-1]:
+            return m3u8_info
+        probe = select_segments(m3u8_info, time_range)[0][:self.probe_segments]
+        if not probe:
+            return m3u8_info
+        task_id = await self.progress.add_task(total=None, description=f"测速 {path.name}")
+        p_sema = self._part_sema(probe[0][1].absolute_uri, self.part_concurrency)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        contents = await asyncio.gather(*[self._fetch_seg(seg, task_id, p_sema, estimate=False) for _, seg in probe])
+        elapsed = max(loop.time() - start, 1e-3)
+        await self.progress.update(task_id, visible=False)
+        ratio = sum(seg.duration for _, seg in probe) / elapsed
+        if ratio >= speedup:  # keep the probed segments
+            for (idx, _), content in zip(probe, contents):
+                async with aiofiles.open(self._seg_path(path, idx), 'wb') as f:  # replaces a partial segment
+                    await f.write(content)
+            return m3u8_info
+        bps = sum(len(c) for c in contents) * 8 / elapsed
+        lower = next((v for v in variants[variants.index(chosen) + 1:]
+                      if (v.stream_info.average_bandwidth or v.stream_info.bandwidth or 0) * speedup <= bps),
+                     variants[-1])
+        self.logger.info(f"{path.name} 下载速度为播放速度的{ratio:.1f}倍，低于{speedup}倍，"
+                         f"改用较低码率 {_variant_key(lower)[0]}p {_variant_key(lower)[1] // 1000}kbps")
+        return await self.to_invariant_m3u8(lower.absolute_uri)
+
+    @staticmethod
+    def _seg_path(path: Path, idx: int) -> Path:
+        return path.with_name(f"{path.stem}-{idx}.ts")
+
+    async def get_m3u8_video(self, m3u8_url: str, path: Union[str, Path], time_range: Tuple[int, int] = None,
+                             quality: Union[int, str] = 0, speedup: float = None) -> Path:
         """
         download video from m3u8 url
         :cli: short: m3u8
         :param m3u8_url:
         :param path: file path or file dir, if dir, filename will be set according to m3u8_url
         :param time_range: (start, end) in seconds, if provided, only download the clip and add start-end to filename
+        :param quality: variant of master playlist, int for relative choice by declared resolution and bandwidth,
+            0 is the highest, or str like '720p'
+        :param speedup: if provided, measure throughput on the first segments and switch to a lower variant when
+            the download is not speedup times faster than playback
         :return: downloaded file path
         """
         if path.is_dir():
             path = (path / PurePath(urlparse(m3u8_url).path).stem).with_suffix('.mp4')
         if time_range:
             path = path.with_stem(f"{path.stem}-{time_range[0]}-{time_range[1]}")
-        exist, path = path_check(path)
+        exist, path = await afs.path_check(path)
         if exist:
             self.logger.info(f"[green]已存在[/green] {path}")# .name}")
             return path
         async with self.v_sema:
             task_id = await self.progress.add_task(total=None, description=path.name)
-            m3u8_info = await self.to_invariant_m3u8(m3u8_url)
-            cors = []
-            p_sema = asyncio.Semaphore(self.part_concurrency)
-            total_time = 0
-            if time_range:
-                current_time = 0
-                start_time, end_time = time_range
-                inside = False
+            # segments of different variants can not be merged, a resumed download keeps the variant chosen before
+            variant_path = path.with_name(f"{path.stem}-variant")
+            if (await afs.path_check(variant_path))[0]:
+                async with aiofiles.open(variant_path, 'r') as f:
+                    m3u8_info = await self._load_m3u8(await f.read())
             else:
-                inside = True
-            for idx, seg in enumerate(m3u8_info.segments):
-                if time_range:
-                    current_time += seg.duration
-                    if not inside and current_time > start_time:
-                        inside = True
-                        s = seg.duration - (current_time - start_time)
-                    elif current_time > end_time:
-                        break
-                if inside:
-                    total_time += seg.duration
-                    # https://stackoverflow.com/questions/50628791/decrypt-m3u8-playlist-encrypted-with-aes-128-without-iv
-                    if seg.key and seg.key.iv is None:
-                        seg.custom_parser_values['iv'] = idx.to_bytes(16, 'big')
-                    cors.append(self._get_seg(seg, path.with_name(f"{path.stem}-{idx}.ts"), task_id, p_sema))
-            if len(cors) == 0 and time_range:
-                raise Exception(f"time range <{start_time}-{end_time}> invalid for <{path.name}>")
+                if speedup:
+                    m3u8_info = await self._probe_m3u8(m3u8_url, quality, speedup, path, time_range)
+                else:
+                    m3u8_info = await self.to_invariant_m3u8(m3u8_url, quality)
+                async with aiofiles.open(variant_path, 'w') as f:
+                    await f.write(m3u8_info.base_uri)
+            p_sema = self._part_sema(
+                m3u8_info.segments[0].absolute_uri if m3u8_info.segments else m3u8_url, self.part_concurrency)
+            segments, tail = select_segments(m3u8_info, time_range)
+            if len(segments) == 0 and time_range:
+                raise Exception(f"time range <{time_range[0]}-{time_range[1]}> invalid for <{path.name}>")
+            total_time = sum(seg.duration for _, seg in segments)
+            cors = [self._get_seg(seg, self._seg_path(path, idx), task_id, p_sema) for idx, seg in segments]
             if init_sec := m3u8_info.segments[0].init_section:
                 async def _get_init():
                     r = await req_retry(self.client, init_sec.absolute_uri)
@@ -128,18 +241,127 @@ class BaseDownloaderM3u8(BaseDownloader):
             else:
                 merge_fn = ffmpeg.concat
             await self.progress.update(task_id, total_time=total_time)
-            file_list = await asyncio.gather(*cors)
+            with metrics.Timer('bilix_phase_seconds', phase='transfer'):  # trim and concat are timed as mux
+                file_list = await asyncio.gather(*cors)
 
+        if tail is not None and not init_sec:  # fmp4 fragments can not be cut without init, they are kept whole
+            # only the last segment is cut, the others are concatenated untouched
+            last = file_list[-1]
+            file_list[-1] = last.with_name(f"{last.stem}-{tail:.3f}.ts")
+            await ffmpeg.trim_segment(last, tail, file_list[-1])
         await merge_fn(file_list, path)
-        if time_range:
-            path_tmp = path.with_stem(str(uuid.uuid4()))
-            # to save key frame, use 0 as start time instead of s, clip will be a little longer than expected
-            await ffmpeg.time_range_clip(path, 0, end_time - start_time + s, path_tmp)
-            os.rename(path_tmp, path)
+        os.remove(variant_path)
         self.logger.info(f"[cyan]已完成[/cyan] {path}")# .name}")
         await self.progress.update(task_id, visible=False)
         return path
 
+    async def record_m3u8(self, m3u8_url: str, path: Union[str, Path], duration: float = None,
+                          quality: Union[int, str] = 0) -> List[Path]:
+        """
+        record live m3u8 stream, the playlist is reloaded every target duration and new segments are appended to
+        the output as they appear, until the stream ends, duration is reached or interrupted
+        :cli: short: live
+        :param m3u8_url:
+        :param path: file path or file dir, if dir, filename will be set according to m3u8_url and start time
+        :param duration: seconds of media to record, None to record until the stream ends
+        :param quality: variant of master playlist, see get_m3u8_video
+        :return: recorded file paths, a new file is started after each discontinuity
+        """
+        import m3u8
+        async with self.v_sema:
+            m3u8_info = await self.to_invariant_m3u8(m3u8_url, quality)
+            media_url = m3u8_info.base_uri
+            if path.is_dir():
+                suffix = '.mp4' if m3u8_info.segments and m3u8_info.segments[0].init_section else '.ts'
+                path = path / f"{PurePath(urlparse(m3u8_url).path).stem}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}"
+            task_id = await self.progress.add_task(total=None, description=path.name)
+            p_sema = self._part_sema(
+                m3u8_info.segments[0].absolute_uri if m3u8_info.segments else media_url, self.part_concurrency)
+            queue: asyncio.Queue = asyncio.Queue()
+            writer = asyncio.ensure_future(self._write_live(queue, path, task_id))
+            fetching = set()
+            last_seq = None if m3u8_info.is_endlist else (m3u8_info.media_sequence or 0) - 1 + \
+                max(0, len(m3u8_info.segments) - self.live_edge_segments)
+            recorded = 0.
+            init_uri = None
+            restart = False
+            try:
+                while True:
+                    first_seq = m3u8_info.media_sequence or 0
+                    if last_seq is not None and first_seq + len(m3u8_info.segments) - 1 < last_seq:
+                        self.logger.warning(f"{path.name} 媒体序号回退，直播可能已重启")
+                        last_seq = first_seq - 1
+                        restart = True  # the new stream goes to a new file
+                    new = 0
+                    for idx, seg in enumerate(m3u8_info.segments):
+                        seq = first_seq + idx
+                        if last_seq is not None and seq <= last_seq:
+                            continue
+                        if last_seq is not None and seq > last_seq + 1 and new == 0:
+                            self.logger.warning(f"{path.name} 丢失{seq - last_seq - 1}个分段，重载间隔内分段已过期")
+                        if seg.key and seg.key.iv is None:
+                            seg.custom_parser_values['iv'] = seq.to_bytes(16, 'big')
+                        seg_init = seg.init_section.absolute_uri if seg.init_section else None
+                        rotate = bool(seg.discontinuity) or seg_init != init_uri or restart
+                        init_uri, restart = seg_init, False
+                        fut = asyncio.ensure_future(self._fetch_seg(seg, task_id, p_sema, estimate=False))
+                        fetching.add(fut)
+                        fut.add_done_callback(fetching.discard)
+                        queue.put_nowait((fut, rotate, init_uri))
+                        last_seq = seq
+                        new += 1
+                        recorded += seg.duration
+                        if duration is not None and recorded >= duration:
+                            break
+                    if m3u8_info.is_endlist or (duration is not None and recorded >= duration) or writer.done():
+                        break
+                    # https://datatracker.ietf.org/doc/html/rfc8216#section-6.3.4
+                    target = m3u8_info.target_duration or 2
+                    await asyncio.sleep(target if new else target / 2)
+                    res = await req_retry(self.client, media_url, follow_redirects=True)
+                    m3u8_info = m3u8.loads(res.text, uri=media_url)
+                queue.put_nowait(None)
+                paths = await writer
+            except BaseException:
+                writer.cancel()
+                for fut in fetching:
+                    fut.cancel()
+                raise
+        self.logger.info(f"[cyan]已完成[/cyan] {', '.join(p.name for p in paths)}")
+        await self.progress.update(task_id, visible=False)
+        return paths
+
+    async def _write_live(self, queue: asyncio.Queue, path: Path, task_id) -> List[Path]:
+        """append segments to the output in order, one file per continuous part"""
+        paths = []
+        f = None
+        pending = False  # rotation of skipped segments
+        try:
+            while (item := await queue.get()) is not None:
+                fut, rotate, init_uri = item
+                try:
+                    content = await fut
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:  # an expired segment should not stop the recording
+                    self.logger.warning(f"{path.name} 分段下载失败，已跳过 {e}")
+                    pending = pending or rotate
+                    continue
+                rotate, pending = rotate or pending, False
+                if f is None or rotate:
+                    if f is not None:
+                        await f.close()
+                    paths.append(path if not paths else path.with_stem(f"{path.stem}-{len(paths)}"))
+                    f = await aiofiles.open(paths[-1], 'wb')
+                    if init_uri:
+                        await f.write((await req_retry(self.client, init_uri)).content)
+                    await self.progress.update(task_id, description=paths[-1].name)
+                await f.write(content)
+        finally:
+            if f is not None:
+                await f.close()
+        return paths
+
     async def _update_task_total(self, task_id, time_part: float, update_size: int):
         task = self.progress.tasks[task_id]
         if task.total is None:
@@ -151,13 +373,26 @@ class BaseDownloaderM3u8(BaseDownloader):
         predicted_total = task.fields['total_time'] * confirmed_b / confirmed_t
         await self.progress.update(task_id, total=predicted_total, confirmed_t=confirmed_t, confirmed_b=confirmed_b)
 
-    async def _get_seg(self, seg: Segment, path: Path, task_id, p_sema: asyncio.Semaphore) -> Path:
-        exists, path = path_check(path)
+    async def _get_seg(self, seg: 'Segment', path: Path, task_id,
+                       p_sema: Union[asyncio.Semaphore, AdaptiveSemaphore]) -> Path:
+        exists, path = await afs.path_check(path)
         if exists:
             downloaded = os.path.getsize(path)
             await self._update_task_total(task_id, time_part=seg.duration, update_size=downloaded)
             await self.progress.update(task_id, advance=downloaded)
             return path
+        content = await self._fetch_seg(seg, task_id, p_sema)
+        async with aiofiles.open(path, 'wb') as f:
+            await f.write(content)
+        return path
+
+    async def _fetch_seg(self, seg: 'Segment', task_id, p_sema: Union[asyncio.Semaphore, AdaptiveSemaphore],
+                         estimate=True) -> bytes:
+        """
+        download and decrypt a segment
+
+        :param estimate: estimate task total from the durations of the segments, False for live streams
+        """
         seg_url = seg.absolute_uri
         async with p_sema:
             content = None
@@ -165,17 +400,20 @@ class BaseDownloaderM3u8(BaseDownloader):
                 content = bytearray()
                 try:
                     async with self.client.stream("GET", seg_url,
-                                                  follow_redirects=True) as r, self._stream_context(times):
+                                                  follow_redirects=True) as r, \
+                            self._stream_context(times, seg_url) as stat:
                         r.raise_for_status()
                         # pre-update total if content-length is provided and first time to get content
-                        if 'content-length' in r.headers and not content:
+                        if estimate and 'content-length' in r.headers and not content:
                             await self._update_task_total(
                                 task_id, time_part=seg.duration, update_size=int(r.headers['content-length']))
                         async for chunk in r.aiter_bytes(chunk_size=self.chunk_size):
                             content.extend(chunk)
+                            stat.bytes += len(chunk)
                             await self.progress.update(task_id, advance=len(chunk))
                             await self._check_speed(len(chunk))
-                    if 'content-length' not in r.headers:  # after-update total if content-length is not provided
+                    # after-update total if content-length is not provided
+                    if estimate and 'content-length' not in r.headers:
                         await self._update_task_total(task_id, time_part=seg.duration, update_size=len(content))
                     break
                 except (httpx.HTTPStatusError, httpx.TransportError):
@@ -186,10 +424,8 @@ class BaseDownloaderM3u8(BaseDownloader):
         # in case encrypted
         if seg.key:
             content = await self._decrypt(seg, content)
-        async with aiofiles.open(path, 'wb') as f:
-            await f.write(content)
-        return path
+        return content
 
-    def _after_seg(self, seg: Segment, content: bytearray) -> bytearray:
+    def _after_seg(self, seg: 'Segment', content: bytearray) -> bytearray:
         """hook for subclass to modify segment content, happened before decrypt"""
         return content
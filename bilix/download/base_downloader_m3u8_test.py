@@ -0,0 +1,124 @@
+import asyncio
+import httpx
+import pytest
+from bilix import ffmpeg
+from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8, select_variant
+
+PLAYLIST = "#EXTM3U\n#EXT-X-TARGETDURATION:2\n" + \
+           ''.join(f"#EXTINF:2.0,\n{i}.ts\n" for i in range(5)) + "#EXT-X-ENDLIST\n"
+MASTER = "#EXTM3U\n" + ''.join(f"#EXT-X-STREAM-INF:BANDWIDTH={b},RESOLUTION={r}\n{n}/index.m3u8\n" for b, r, n in [
+    (800000, '640x360', 'low'), (5000000, '1920x1080', 'high'), (2000000, '1280x720', 'mid')])
+
+
+def test_select_variant():
+    import m3u8
+    playlists = m3u8.loads(MASTER, uri='https://cdn.test/v/master.m3u8').playlists
+    assert select_variant(playlists).uri == 'high/index.m3u8'
+    assert select_variant(playlists, 1).uri == 'mid/index.m3u8'
+    assert select_variant(playlists, 999).uri == 'low/index.m3u8'
+    assert select_variant(playlists, '720p').uri == 'mid/index.m3u8'
+    assert select_variant(playlists, '240').uri == 'low/index.m3u8'
+
+
+@pytest.mark.parametrize('speedup, variant', [(1., 'high'), (1e12, 'low')])
+@pytest.mark.asyncio
+async def test_probe_variant(tmp_path, monkeypatch, speedup, variant):
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.url.path)
+        if request.url.path.endswith('master.m3u8'):
+            return httpx.Response(200, text=MASTER)
+        if request.url.path.endswith('.m3u8'):
+            return httpx.Response(200, text=PLAYLIST)
+        return httpx.Response(200, content=request.url.path.encode())
+
+    async def concat(path_lst, output_path, remove=True):
+        output_path.write_bytes(b''.join(p.read_bytes() for p in path_lst))
+
+    monkeypatch.setattr(ffmpeg, 'concat', concat)
+    d = BaseDownloaderM3u8(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    path = await d.get_m3u8_video('https://cdn.test/v/master.m3u8', tmp_path / 'a.mp4', speedup=speedup)
+    assert path.read_bytes() == b''.join(f'/v/{variant}/{i}.ts'.encode() for i in range(5))
+    # probed segments are kept when the variant is kept
+    assert len([r for r in requests if r.endswith('.ts')]) == (5 if variant == 'high' else 8)
+    assert not (tmp_path / 'a-variant').exists()
+
+    # resumed after an interrupted run chose the low variant: segments are not mixed
+    (tmp_path / 'b-variant').write_text('https://cdn.test/v/low/index.m3u8')
+    (tmp_path / 'b-0.ts').write_bytes(b'/v/low/0.ts')
+    path = await d.get_m3u8_video('https://cdn.test/v/master.m3u8', tmp_path / 'b.mp4', speedup=speedup)
+    assert path.read_bytes() == b''.join(f'/v/low/{i}.ts'.encode() for i in range(5))
+
+
+@pytest.mark.asyncio
+async def test_time_range_trims_last_segment(tmp_path, monkeypatch):
+    def handler(request: httpx.Request):
+        if request.url.path.endswith('.m3u8'):
+            return httpx.Response(200, text=PLAYLIST)
+        return httpx.Response(200, content=request.url.path.encode())
+
+    calls = {}
+
+    async def trim_segment(input_path, t, output_path, remove=True):
+        calls['trim'] = (input_path.name, t)
+        input_path.rename(output_path)
+
+    async def concat(path_lst, output_path, remove=True):
+        calls['concat'] = [p.read_bytes() for p in path_lst]
+        output_path.touch()
+
+    monkeypatch.setattr(ffmpeg, 'trim_segment', trim_segment)
+    monkeypatch.setattr(ffmpeg, 'concat', concat)
+    d = BaseDownloaderM3u8(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    path = await d.get_m3u8_video('https://cdn.test/v/index.m3u8', tmp_path / 'a.mp4', time_range=(3, 7))
+    assert path.name == 'a-3-7.mp4'
+    assert calls['concat'] == [b'/v/1.ts', b'/v/2.ts', b'/v/3.ts']
+    assert calls['trim'] == ('a-3-7-3.ts', 1.)
+
+
+@pytest.mark.asyncio
+async def test_record_live(tmp_path, monkeypatch):
+    reloads = 0
+    failed = set()
+    restart = False
+
+    def handler(request: httpx.Request):
+        nonlocal reloads
+        if request.url.path in failed:
+            return httpx.Response(404)
+        if not request.url.path.endswith('.m3u8'):
+            return httpx.Response(200, content=request.url.path.encode())
+        # a window of 3 segments sliding by one each reload, a discontinuity before 6, ends after 7
+        reloads += 1
+        if restart and reloads == 3:  # stream restarted, media sequence goes back
+            return httpx.Response(200, text="#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:0\n"
+                                            "#EXTINF:2.0,\n0.ts\n#EXT-X-ENDLIST\n")
+        first = reloads + 1
+        text = f"#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:{first}\n"
+        for seq in range(first, first + 3):
+            text += ("#EXT-X-DISCONTINUITY\n" if seq == 6 else "") + f"#EXTINF:2.0,\n{seq}.ts\n"
+        return httpx.Response(200, text=text + ("#EXT-X-ENDLIST\n" if first + 2 == 7 else ""))
+
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, 'sleep', lambda t: sleep(0))
+    d = BaseDownloaderM3u8(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    d.live_edge_segments = 2
+    paths = await d.record_m3u8('https://cdn.test/live/index.m3u8', tmp_path / 'a.ts')
+    assert [p.name for p in paths] == ['a.ts', 'a-1.ts']
+    assert paths[0].read_bytes() == b''.join(f'/live/{i}.ts'.encode() for i in range(3, 6))
+    assert paths[1].read_bytes() == b'/live/6.ts/live/7.ts'
+    # stop after duration
+    reloads = 0
+    paths = await d.record_m3u8('https://cdn.test/live/index.m3u8', tmp_path / 'b.ts', duration=3)
+    assert paths[0].read_bytes() == b'/live/3.ts/live/4.ts'
+    # the segment after a discontinuity failed, the next one still starts a new file
+    reloads = 0
+    failed.add('/live/6.ts')
+    paths = await d.record_m3u8('https://cdn.test/live/index.m3u8', tmp_path / 'c.ts')
+    assert [p.read_bytes() for p in paths] == [b'/live/3.ts/live/4.ts/live/5.ts', b'/live/7.ts']
+    # restarted stream is recorded to a new file
+    reloads, restart = 0, True
+    failed.clear()
+    paths = await d.record_m3u8('https://cdn.test/live/index.m3u8', tmp_path / 'd.ts')
+    assert [p.read_bytes() for p in paths] == [b'/live/3.ts/live/4.ts/live/5.ts', b'/live/0.ts']
@@ -1,6 +1,8 @@
 import asyncio
+import shutil
+from collections import OrderedDict
 from pathlib import Path, PurePath
-from typing import Union, List, Iterable, Tuple
+from typing import Union, List, Iterable, Tuple, NamedTuple
 from urllib.parse import urlparse
 import aiofiles
 import httpx
@@ -8,13 +10,77 @@ import uuid
 import random
 import os
 from email.message import Message
-from pymp4.parser import Box
 from bilix.download.base_downloader import BaseDownloader
-from bilix.download.utils import path_check, merge_files
+from bilix.download.utils import merge_files
+from bilix.download.fs import afs
 from bilix import ffmpeg
+from bilix import metrics
 from .utils import req_retry
 
-__all__ = ['BaseDownloaderPart']
+__all__ = ['BaseDownloaderPart', 'Fragment', 'select_fragments', 'coalesce', 'split_range']
+
+
+class Fragment(NamedTuple):
+    """a media fragment referenced by sidx, byte offsets are inclusive"""
+    start: float
+    duration: float
+    first: int
+    last: int
+
+
+def select_fragments(fragments: List[Fragment], start_time: float, end_time: float) -> Tuple[float, List[Fragment]]:
+    """
+    fragments covering [start_time, end_time]
+
+    :return: offset of start_time in the first fragment, fragments
+    """
+    selected = []
+    s = 0.
+    for frag in fragments:
+        if not selected and start_time < frag.start + frag.duration:
+            s = start_time - frag.start
+            selected.append(frag)
+        elif selected:
+            if end_time < frag.start:
+                break
+            selected.append(frag)
+    return s, selected
+
+
+def coalesce(ranges: Iterable[Tuple[int, int]], max_gap: int = 0) -> List[Tuple[int, int]]:
+    """merge byte ranges that overlap, touch or are at most max_gap apart (one request is cheaper)"""
+    merged = []
+    for a, b in sorted(ranges):
+        if merged and a <= merged[-1][1] + 1 + max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def split_range(a: int, b: int, size: int) -> List[Tuple[int, int]]:
+    """split [a, b] into parts of at most size bytes"""
+    return [(i, min(i + size - 1, b)) for i in range(a, b + 1, size)]
+
+
+@metrics.timed('merge')
+def assemble_clip(out: Path, init: Path, chunks: List[Tuple[Tuple[int, int], Path]], first: int, last: int):
+    """write init segment and bytes [first, last] taken from downloaded chunks to out"""
+    with open(out, 'wb') as f:
+        with open(init, 'rb') as fi:
+            shutil.copyfileobj(fi, f)
+        for (a, b), chunk in chunks:
+            if b < first or a > last:
+                continue
+            with open(chunk, 'rb') as fc:
+                fc.seek(max(a, first) - a)
+                remain = min(b, last) - max(a, first) + 1
+                while remain > 0:
+                    data = fc.read(min(remain, 1 << 20))
+                    if not data:
+                        raise EOFError(f"chunk {chunk} is shorter than its range")
+                    f.write(data)
+                    remain -= len(data)
 
 
 class BaseDownloaderPart(BaseDownloader):
@@ -41,6 +107,12 @@ class BaseDownloaderPart(BaseDownloader):
             logger=logger
         )
         self.part_concurrency = part_concurrency
+        self.file_part_size = 4 * 1024 * 1024  # large files are split in parts of this size
+        self.file_part_factor = 4  # up to part_concurrency times this parts, so that a changed limit applies soon
+        self.clip_part_size = 1024 * 1024  # min part size of clips
+        self.clip_max_gap = 256 * 1024  # download the gap between fragments of two clips instead of a new range
+        self.sidx_cache_size = 64
+        self._sidx_cache: 'OrderedDict[Tuple[str, str], asyncio.Future]' = OrderedDict()
 
     async def _pre_req(self, urls: List[str]) -> Tuple[int, str]:
         # use GET instead of HEAD due to 404 bug https://github.com/HFrost0/bilix/issues/16
@@ -58,6 +130,42 @@ class BaseDownloaderPart(BaseDownloader):
             urls[0] = str(res.url)
         return total, filename
 
+    async def _get_sidx(self, urls: List[str], seg_range: str) -> List[Fragment]:
+        """media fragments listed in the sidx box at seg_range, cached per media url"""
+        key = (urls[0], seg_range)
+        fut = self._sidx_cache.get(key)
+        if fut is None:
+            fut = self._sidx_cache[key] = asyncio.ensure_future(self._fetch_sidx(urls, seg_range))
+            while len(self._sidx_cache) > self.sidx_cache_size:
+                self._sidx_cache.popitem(last=False)
+        else:
+            self._sidx_cache.move_to_end(key)
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            if self._sidx_cache.get(key) is fut:
+                del self._sidx_cache[key]  # let others retry
+            raise
+
+    async def _fetch_sidx(self, urls: List[str], seg_range: str) -> List[Fragment]:
+        from pymp4.parser import Box  # heavy, only import when clip is required
+        seg_start, seg_end = map(int, seg_range.split('-'))
+        res = await req_retry(self.client, urls[0], follow_redirects=True,
+                              headers={'Range': f'bytes={seg_start}-{seg_end}'})
+        container = Box.parse(res.content)
+        assert container.type == b'sidx'
+        fragments = []
+        pre_time, pre_byte = 0., seg_end + 1
+        for ref in container.references:
+            if ref.reference_type != "MEDIA":
+                self.logger.debug("not a media", ref)
+                continue
+            seg_duration = ref.segment_duration / container.timescale
+            fragments.append(Fragment(pre_time, seg_duration, pre_byte, pre_byte + ref.referenced_size - 1))
+            pre_time += seg_duration
+            pre_byte += ref.referenced_size
+        return fragments
+
     async def get_media_clip(
             self,
             url_or_urls: Union[str, Iterable[str]],
@@ -81,72 +189,113 @@ class BaseDownloaderPart(BaseDownloader):
         :param task_id:
         :return:
         """
+        return (await self.get_media_clips(
+            url_or_urls, [path], [time_range], init_range, seg_range,
+            get_s=get_s and [get_s], set_s=set_s and [set_s], task_id=task_id))[0]
+
+    async def get_media_clips(
+            self,
+            url_or_urls: Union[str, Iterable[str]],
+            paths: List[Union[Path, str]],
+            time_ranges: List[Tuple[int, int]],
+            init_range: str,
+            seg_range: str,
+            get_s: List[asyncio.Future] = None,
+            set_s: List[asyncio.Future] = None,
+            snap: bool = False,
+            task_id=None,
+    ) -> List[Path]:
+        """
+        clip several time ranges of one fragmented mp4 in a batch, fragments needed by any clip are downloaded
+        once as a few coalesced ranges
+
+        :param url_or_urls:
+        :param paths: output path of each clip
+        :param time_ranges: (start_time, end_time) of each clip
+        :param init_range: xxx-xxx
+        :param seg_range: xxx-xxx, range of sidx box
+        :param get_s: futures of clip (start, end) time set by the video clips, used by the audio clips to keep in sync
+        :param set_s: futures to set the actual (start, end) time of the video clips
+        :param snap: extend clips to fragment (keyframe) boundaries, so they are cut in-process without ffmpeg.
+            Clips whose range is already on fragment boundaries are always cut in-process. Clips following get_s
+            are never snapped but cut to the range set by the video
+        :param task_id:
+        :return: clip paths
+        """
         upper = task_id is not None and self.progress.tasks[task_id].fields.get('upper', None)
-        exist, path = path_check(path)
-        if exist:
-            if not upper:
-                self.logger.info(f'[green]已存在[/green] {path}')# .name}')
-            return path
+        paths = [Path(p) for p in paths]
+        todo = []
+        for i, path in enumerate(paths):
+            exist, paths[i] = await afs.path_check(path)
+            if exist:
+                if not upper:
+                    self.logger.info(f'[green]已存在[/green] {paths[i]}')# .name}')
+                if set_s:
+                    set_s[i].set_result(tuple(time_ranges[i]))
+            else:
+                todo.append(i)
+        if not todo:
+            return paths
 
         urls = [url_or_urls] if isinstance(url_or_urls, str) else [url for url in url_or_urls]
         init_start, init_end = map(int, init_range.split('-'))
-        seg_start, seg_end = map(int, seg_range.split('-'))
-        res = await req_retry(self.client, urls[0], follow_redirects=True,
-                              headers={'Range': f'bytes={seg_start}-{seg_end}'})
-        container = Box.parse(res.content)
-        assert container.type == b'sidx'
-        if get_s:
-            start_time = await get_s
-            end_time = time_range[1]
-        else:
-            start_time, end_time = time_range
-        pre_time, pre_byte = 0, seg_end + 1
-        inside = False
-        parts = [(init_start, init_end)]
-        total = init_end - init_start + 1
-        s = 0
-        for idx, ref in enumerate(container.references):
-            if ref.reference_type != "MEDIA":
-                self.logger.debug("not a media", ref)
-                continue
-            seg_duration = ref.segment_duration / container.timescale
-            if not inside and start_time < pre_time + seg_duration:
-                s = start_time - pre_time
-                inside = True
-            if inside and end_time < pre_time:
-                break
-            if inside:
-                total += ref.referenced_size
-                parts.append((pre_byte, pre_byte + ref.referenced_size - 1))
-            pre_time += seg_duration
-            pre_byte += ref.referenced_size
-        if len(parts) == 1:
-            raise Exception(f"time range <{start_time}-{end_time}> invalid for <{path.name}>")
-        if set_s:
-            set_s.set_result(start_time - s)
+        fragments = await self._get_sidx(urls, seg_range)
+        plans = {}
+        for i in todo:
+            if get_s:
+                start_time, end_time = await get_s[i]
+            else:
+                start_time, end_time = time_ranges[i]
+            s, selected = select_fragments(fragments, start_time, end_time)
+            if not selected:
+                raise Exception(f"time range <{start_time}-{end_time}> invalid for <{paths[i].name}>")
+            aligned = snap and not get_s  # audio follows the video start, snapping it again would go out of sync
+            if abs(s) < 1e-3:  # starts at a fragment, check whether it also ends at one
+                ends = [j for j, f in enumerate(selected) if abs(f.start + f.duration - end_time) < 1e-3]
+                if ends:
+                    selected, aligned = selected[:ends[0] + 1], True
+            if set_s:  # the whole fragments when aligned, else cut from the keyframe before start to end_time
+                set_s[i].set_result(
+                    (start_time - s, selected[-1].start + selected[-1].duration if aligned else end_time))
+            plans[i] = (start_time, end_time, s, aligned, selected[0].first, selected[-1].last)
+
+        ranges = coalesce(((first, last) for *_, first, last in plans.values()), max_gap=self.clip_max_gap)
+        total = init_end - init_start + 1 + sum(b - a + 1 for a, b in ranges)
+        part_size = max(self.clip_part_size, total // self.part_concurrency + 1)
+        parts = [(init_start, init_end)] + [r for a, b in ranges for r in split_range(a, b, part_size)]
         if task_id is not None:
             await self.progress.update(
                 task_id,
                 total=self.progress.tasks[task_id].total + total if self.progress.tasks[task_id].total else total)
         else:
-            task_id = await self.progress.add_task(description=path.name, total=total)
-        p_sema = asyncio.Semaphore(self.part_concurrency)
+            task_id = await self.progress.add_task(description=paths[todo[0]].name, total=total)
+        p_sema = self._part_sema(urls[0], self.part_concurrency)
+        base = paths[todo[0]]
 
-        async def get_seg(part_range: Tuple[int, int]):
+        async def get_part(part_range: Tuple[int, int]):
             async with p_sema:
-                return await self._get_file_part(urls, path=path, part_range=part_range, task_id=task_id)
+                return await self._get_file_part(urls, path=base, part_range=part_range, task_id=task_id)
 
-        file_list = await asyncio.gather(*[get_seg(part_range) for part_range in parts])
-        path_tmp = path.with_name(str(uuid.uuid4()))
-        await merge_files(file_list, path_tmp)
-        if set_s:
-            await ffmpeg.time_range_clip(path_tmp, start=0, t=end_time - start_time + s, output_path=path)
-        else:
-            await ffmpeg.time_range_clip(path_tmp, start=s, t=end_time - start_time, output_path=path)
+        with metrics.Timer('bilix_phase_seconds', phase='transfer'):  # network only, cut and merge are timed apart
+            file_list = await asyncio.gather(*[get_part(part_range) for part_range in parts])
+        init_path, chunks = file_list[0], list(zip(parts[1:], file_list[1:]))
+        loop = asyncio.get_event_loop()
+        for i, (start_time, end_time, s, aligned, first, last) in plans.items():
+            path_tmp = paths[i].with_name(str(uuid.uuid4()))
+            await loop.run_in_executor(None, assemble_clip, path_tmp, init_path, chunks, first, last)
+            if aligned:  # whole fragments, nothing to cut
+                os.replace(path_tmp, paths[i])
+            elif set_s:
+                await ffmpeg.time_range_clip(path_tmp, start=0, t=end_time - start_time + s, output_path=paths[i])
+            else:
+                await ffmpeg.time_range_clip(path_tmp, start=s, t=end_time - start_time, output_path=paths[i])
+            if not upper:
+                self.logger.info(f"[cyan]已完成[/cyan] {paths[i]}")# {path.name}")
+        for p in file_list:
+            os.remove(p)
         if not upper:  # no upstream task
             await self.progress.update(task_id, visible=False)
-            self.logger.info(f"[cyan]已完成[/cyan] {path}")# {path.name}")
-        return path
+        return paths
 
     async def get_file(self, url_or_urls: Union[str, Iterable[str]], path: Union[Path, str], task_id=None) -> Path:
         """
@@ -161,7 +310,7 @@ class BaseDownloaderPart(BaseDownloader):
         upper = task_id is not None and self.progress.tasks[task_id].fields.get('upper', None)
 
         if not path.is_dir():
-            exist, path = path_check(path)
+            exist, path = await afs.path_check(path)
             if exist:
                 if not upper:
                     self.logger.info(f'[green]已存在[/green] {path}')# .name}')
@@ -172,7 +321,7 @@ class BaseDownloaderPart(BaseDownloader):
         if path.is_dir():
             file_name = req_filename if req_filename else PurePath(urlparse(urls[0]).path).name
             path /= file_name
-            exist, path = path_check(path)
+            exist, path = await afs.path_check(path)
             if exist:
                 if not upper:
                     self.logger.info(f'[green]已存在[/green] {path}')# .name}')
@@ -184,13 +333,23 @@ class BaseDownloaderPart(BaseDownloader):
                 total=self.progress.tasks[task_id].total + total if self.progress.tasks[task_id].total else total)
         else:
             task_id = await self.progress.add_task(description=path.name, total=total)
-        part_length = total // self.part_concurrency
+        # the split only depends on total, parts of an interrupted run are resumed with or without --adaptive
+        part_num = max(self.part_concurrency,
+                       min(total // self.file_part_size, self.part_concurrency * self.file_part_factor))
+        part_length = total // part_num
+        p_sema = self._part_sema(urls[0], self.part_concurrency)
+
+        async def get_part(part_range: Tuple[int, int]):
+            async with p_sema:
+                return await self._get_file_part(urls, path=path, part_range=part_range, task_id=task_id)
+
         cors = []
-        for i in range(self.part_concurrency):
+        for i in range(part_num):
             start = i * part_length
-            end = (i + 1) * part_length - 1 if i < self.part_concurrency - 1 else total - 1
-            cors.append(self._get_file_part(urls, path=path, part_range=(start, end), task_id=task_id))
-        file_list = await asyncio.gather(*cors)
+            end = (i + 1) * part_length - 1 if i < part_num - 1 else total - 1
+            cors.append(get_part((start, end)))
+        with metrics.Timer('bilix_phase_seconds', phase='transfer'):
+            file_list = await asyncio.gather(*cors)
         await merge_files(file_list, new_path=path)
         if not upper:
             await self.progress.update(task_id, visible=False)
@@ -201,7 +360,7 @@ class BaseDownloaderPart(BaseDownloader):
                              task_id) -> Path:
         start, end = part_range
         part_path = path.with_name(f'{path.name}.{part_range[0]}-{part_range[1]}')
-        exist, part_path = path_check(part_path)
+        exist, part_path = await afs.path_check(part_path)
         if exist:
             downloaded = os.path.getsize(part_path)
             start += downloaded
@@ -215,7 +374,7 @@ class BaseDownloaderPart(BaseDownloader):
                 async with \
                         self.client.stream("GET", urls[url_idx], follow_redirects=True,
                                            headers={'Range': f'bytes={start}-{end}'}) as r, \
-                        self._stream_context(times), \
+                        self._stream_context(times, urls[url_idx]) as stat, \
                         aiofiles.open(part_path, 'ab') as f:
                     r.raise_for_status()
                     if r.history:  # avoid twice redirect
@@ -223,6 +382,7 @@ class BaseDownloaderPart(BaseDownloader):
                     async for chunk in r.aiter_bytes(chunk_size=self.chunk_size):
                         await f.write(chunk)
                         start += len(chunk)
+                        stat.bytes += len(chunk)
                         await self.progress.update(task_id, advance=len(chunk))
                         await self._check_speed(len(chunk))
                 break
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import struct
+import httpx
+import pytest
+from bilix import ffmpeg, metrics
+from bilix.download.base_downloader_part import (BaseDownloaderPart, Fragment, select_fragments, coalesce,
+                                                 split_range)
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+def _fmp4(fragments: int, frag_size: int, duration: int = 1000):
+    """init, sidx with fragments of duration ms, media bytes"""
+    init = _box(b'ftyp', b'iso6\x00\x00\x00\x00iso6dash') + _box(b'moov', bytes(64))
+    refs = b''.join(struct.pack('>III', frag_size, duration, 0x90000000) for _ in range(fragments))
+    sidx = _box(b'sidx', struct.pack('>B3xIIIIHH', 0, 1, 1000, 0, 0, 0, fragments) + refs)
+    media = b''.join(bytes([i]) * frag_size for i in range(fragments))
+    return init + sidx + media, f"0-{len(init) - 1}", f"{len(init)}-{len(init) + len(sidx) - 1}"
+
+
+def test_clip_planner():
+    fragments = [Fragment(i * 2., 2., i * 10, i * 10 + 9) for i in range(10)]
+    s, selected = select_fragments(fragments, 3, 7)
+    assert s == 1. and [f.first for f in selected] == [10, 20, 30]
+    assert select_fragments(fragments, 30, 40)[1] == []
+    assert coalesce([(30, 39), (10, 19), (20, 29), (60, 69)]) == [(10, 39), (60, 69)]
+    assert coalesce([(10, 19), (25, 29)], max_gap=5) == [(10, 29)]
+    assert split_range(0, 24, 10) == [(0, 9), (10, 19), (20, 24)]
+
+
+@pytest.mark.asyncio
+async def test_get_media_clips(tmp_path, monkeypatch):
+    content, init_range, seg_range = _fmp4(20, 1000)
+    requests = []
+
+    def handler(request: httpx.Request):
+        a, b = map(int, request.headers['Range'][len('bytes='):].split('-'))
+        requests.append((a, b))
+        return httpx.Response(206, content=content[a:b + 1],
+                              headers={'Content-Range': f'bytes {a}-{b}/{len(content)}'})
+
+    async def clip(input_path, start, t, output_path, remove=True):  # ffmpeg is not needed to check bytes
+        os.rename(input_path, output_path)
+
+    monkeypatch.setattr(ffmpeg, 'time_range_clip', clip)
+    d = BaseDownloaderPart(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), part_concurrency=2)
+    d.clip_part_size = 1
+    init_end = int(init_range.split('-')[1])
+    media_start = int(seg_range.split('-')[1]) + 1
+    paths = await d.get_media_clips('https://cdn.test/a.m4s', [tmp_path / 'a.mp4', tmp_path / 'b.mp4'],
+                                    [(2, 4), (3.5, 6)], init_range, seg_range)
+    a, b = (p.read_bytes() for p in paths)
+    # on fragment boundaries, cut in-process
+    assert a == content[:init_end + 1] + content[media_start + 2000:media_start + 4000]
+    assert b == content[:init_end + 1] + content[media_start + 3000:media_start + 7000]
+    # overlapping fragments are downloaded once
+    sidx_size = media_start - init_end - 1
+    assert sum(b - a + 1 for a, b in requests) == init_end + 1 + sidx_size + 5000
+    assert sorted(os.listdir(tmp_path)) == ['a.mp4', 'b.mp4']
+    # sidx is cached
+    await d.get_media_clip('https://cdn.test/a.m4s', tmp_path / 'c.mp4', (0, 1), init_range, seg_range)
+    assert len([r for r in requests if f'{r[0]}-{r[1]}' == seg_range]) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_media_clips_snap(tmp_path, monkeypatch):
+    video, v_init, v_seg = _fmp4(20, 100)
+    audio, a_init, a_seg = _fmp4(10, 100, duration=2000)
+    cuts = []
+
+    def handler(request: httpx.Request):
+        content = video if request.url.path == '/v.m4s' else audio
+        a, b = map(int, request.headers['Range'][len('bytes='):].split('-'))
+        return httpx.Response(206, content=content[a:b + 1],
+                              headers={'Content-Range': f'bytes {a}-{b}/{len(content)}'})
+
+    async def clip(input_path, start, t, output_path, remove=True):
+        cuts.append((output_path.name, start, t))
+        os.rename(input_path, output_path)
+
+    monkeypatch.setattr(ffmpeg, 'time_range_clip', clip)
+    d = BaseDownloaderPart(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    futs = [asyncio.get_event_loop().create_future()]
+    await asyncio.gather(
+        d.get_media_clips('https://cdn.test/v.m4s', [tmp_path / 'v.mp4'], [(3.5, 6.5)], v_init, v_seg,
+                          set_s=futs, snap=True),
+        d.get_media_clips('https://cdn.test/a.m4s', [tmp_path / 'a.mp4'], [(3.5, 6.5)], a_init, a_seg,
+                          get_s=futs, snap=True))
+    # video snapped to the fragments 3-7s, audio fragment starts at 2s and is cut to the same range
+    assert futs[0].result() == (3., 7.) and cuts == [('a.mp4', 1., 4.)]
+
+
+@pytest.mark.asyncio
+async def test_get_file_resume(tmp_path):
+    content = bytes(range(100))
+    requests = []
+
+    def handler(request: httpx.Request):
+        a, b = map(int, request.headers['Range'][len('bytes='):].split('-'))
+        requests.append((request.url.path, a, b))
+        return httpx.Response(206, content=content[a:b + 1],
+                              headers={'Content-Range': f'bytes {a}-{b}/{len(content)}'})
+
+    def downloader(adaptive: bool):
+        d = BaseDownloaderPart(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), part_concurrency=2)
+        d.file_part_size = 10
+        if adaptive:
+            d.use_adaptive_concurrency()
+        return d
+
+    await downloader(True).get_file('https://cdn.test/a.bin', tmp_path / 'a.bin')
+    # a part left by an interrupted run with --adaptive is resumed without it
+    (tmp_path / 'b.bin.0-11').write_bytes(content[:6])
+    metrics.enable()
+    try:
+        path = await downloader(False).get_file('https://cdn.test/b.bin', tmp_path / 'b.bin')
+        # merge is not counted as transfer again
+        histograms = metrics.registry().snapshot()['histograms']
+        assert [k for k in histograms if k.startswith('bilix_phase_seconds')] == \
+               ['bilix_phase_seconds{phase=transfer,status=ok}', 'bilix_phase_seconds{phase=merge,status=ok}']
+    finally:
+        metrics.disable()
+    assert path.read_bytes() == content and sorted(os.listdir(tmp_path)) == ['a.bin', 'b.bin']
+    a_parts = sorted(r[1:] for r in requests if r[0] == '/a.bin' and r[1:] != (0, 1))
+    b_parts = sorted(r[1:] for r in requests if r[0] == '/b.bin' and r[1:] != (0, 1))
+    assert len(a_parts) == 8 and b_parts == [(6, 11)] + a_parts[1:]
@@ -0,0 +1,205 @@
+"""
+adaptive stream limits. Like tcp congestion control, a limit grows by one while its streams are saturated and
+more streams bring more throughput (additive increase), and is cut by half on 403/429 or frequent transport
+errors (multiplicative decrease). Part limits are kept per host, the video limit follows all hosts.
+"""
+import asyncio
+import time
+import weakref
+from collections import deque
+from typing import Deque, Dict, Optional
+from urllib.parse import urlparse
+
+from bilix.log import logger
+from bilix import metrics
+
+__all__ = ['AdaptiveSemaphore', 'AIMDLimit', 'AdaptiveConcurrency', 'THROTTLE', 'TRANSPORT', 'ERROR']
+
+# error kinds reported by streams
+THROTTLE, TRANSPORT, ERROR = 'throttle', 'transport', 'error'
+
+
+class AdaptiveSemaphore:
+    """semaphore whose limit can be changed while in use, a lower limit takes effect as holders release"""
+
+    def __init__(self, limit: int, owner: 'AIMDLimit' = None):
+        self._limit = max(1, limit)
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._owner = owner
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def set_limit(self, limit: int):
+        self._limit = max(1, limit)
+        self._wake()
+
+    def locked(self) -> bool:
+        return self._active >= self._limit
+
+    def _wake(self):
+        while self._waiters and self._active < self._limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._active += 1  # hand the slot over
+                fut.set_result(None)
+
+    async def acquire(self):
+        if self._active < self._limit and not self._waiters:
+            self._active += 1
+            return True
+        if self._owner is not None:
+            self._owner.saturated = True
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():  # got the slot at the same time, give it back
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+        return True
+
+    def release(self):
+        self._active -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __repr__(self):
+        return f"<AdaptiveSemaphore {self._active}/{self._limit}>"
+
+
+class AIMDLimit:
+    """one limit shared by the semaphores it creates, adjusted once per interval from the recorded streams"""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None, interval: float = 5.,
+                 error_ratio: float = .1, min_gain: float = .05, name: str = ''):
+        """
+
+        :param initial: limit to start with
+        :param minimum: lower bound
+        :param maximum: upper bound, 4 times initial by default
+        :param interval: seconds of one observation window
+        :param error_ratio: share of failed streams in a window that counts as congestion
+        :param min_gain: throughput gain an increase must bring to keep probing
+        :param name: used in logs and metrics
+        """
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum or initial * 4
+        self.interval = interval
+        self.error_ratio = error_ratio
+        self.min_gain = min_gain
+        self.name = name
+        self.saturated = False
+        self._semaphores = weakref.WeakSet()
+        self._window = time.monotonic()
+        self._bytes = 0
+        self._ok = 0
+        self._errors = 0
+        self._throttled = 0
+        self._last_rate = 0.
+        self._hold_until = 0.
+
+    def semaphore(self) -> AdaptiveSemaphore:
+        sema = AdaptiveSemaphore(self.limit, owner=self)
+        self._semaphores.add(sema)
+        return sema
+
+    def _set(self, limit: int):
+        limit = min(self.maximum, max(self.minimum, limit))
+        if limit != self.limit:
+            logger.debug(f"adaptive concurrency {self.name} {self.limit} -> {limit}")
+            self.limit = limit
+            for sema in self._semaphores:
+                sema.set_limit(limit)
+        metrics.set_gauge('bilix_concurrency_limit', limit, scope=self.name)
+
+    def record(self, nbytes: int, error: Optional[str] = None):
+        """record a finished stream, error is one of THROTTLE TRANSPORT ERROR or None"""
+        self._bytes += nbytes
+        if error is None:
+            self._ok += 1
+        else:
+            self._errors += 1
+            self._throttled += error == THROTTLE
+        now = time.monotonic()
+        if now - self._window >= self.interval:
+            self._adjust(now)
+
+    def _adjust(self, now: float):
+        rate = self._bytes / (now - self._window)
+        total = self._ok + self._errors
+        if self._throttled or (total and self._errors / total > self.error_ratio):
+            self._set(self.limit // 2)  # multiplicative decrease
+            self._last_rate = 0.
+            self._hold_until = now + self.interval * 2
+        elif self.saturated and now >= self._hold_until:
+            if self._last_rate and rate < self._last_rate * (1 + self.min_gain):
+                # the last increase brought no bandwidth, step back and probe again later
+                self._set(self.limit - 1)
+                self._last_rate = 0.
+                self._hold_until = now + self.interval * 6
+            else:
+                self._last_rate = rate if self.limit < self.maximum else 0.
+                self._set(self.limit + 1)  # additive increase
+        self._window = now
+        self._bytes = self._ok = self._errors = self._throttled = 0
+        self.saturated = False
+
+
+class AdaptiveConcurrency:
+    """stream limits of a downloader, see BaseDownloader.use_adaptive_concurrency"""
+
+    def __init__(self, max_factor: int = 4, interval: float = 5.):
+        """
+
+        :param max_factor: a limit grows up to max_factor times of the configured concurrency
+        :param interval: seconds between adjustments
+        """
+        self.max_factor = max_factor
+        self.interval = interval
+        self.video: Optional[AIMDLimit] = None
+        self._hosts: Dict[str, AIMDLimit] = {}
+
+    def host_limit(self, url, initial: int) -> AIMDLimit:
+        host = urlparse(str(url)).netloc
+        limit = self._hosts.get(host)
+        if limit is None:
+            limit = self._hosts[host] = AIMDLimit(initial, maximum=initial * self.max_factor,
+                                                  interval=self.interval, name=host)
+        return limit
+
+    def part_sema(self, url, initial: int) -> AdaptiveSemaphore:
+        """semaphore for the parts or segments of one media from url"""
+        return self.host_limit(url, initial).semaphore()
+
+    def video_sema(self, initial: int) -> AdaptiveSemaphore:
+        """semaphore for videos downloaded at the same time"""
+        if self.video is None:
+            self.video = AIMDLimit(initial, maximum=initial * self.max_factor, interval=self.interval, name='video')
+        return self.video.semaphore()
+
+    def record(self, url, nbytes: int, error: Optional[str] = None):
+        """record a finished stream of url"""
+        limit = self._hosts.get(urlparse(str(url)).netloc)
+        if limit is not None:
+            limit.record(nbytes, error)
+        if self.video is not None:
+            self.video.record(nbytes, error)
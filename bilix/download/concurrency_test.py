@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from bilix.download.concurrency import AdaptiveSemaphore, AIMDLimit, AdaptiveConcurrency, THROTTLE, TRANSPORT
+
+
+@pytest.mark.asyncio
+async def test_adaptive_semaphore():
+    sema = AdaptiveSemaphore(2)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        async with sema:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(.01)
+            running -= 1
+
+    await asyncio.gather(*[work() for _ in range(6)])
+    assert peak == 2
+    sema.set_limit(4)
+    peak = 0
+    await asyncio.gather(*[work() for _ in range(8)])
+    assert peak == 4 and sema.active == 0
+
+    await sema.acquire()
+    sema.set_limit(1)
+    waiter = asyncio.ensure_future(sema.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    sema.release()
+    assert sema.active == 0 and not sema.locked()
+
+
+def test_aimd_limit():
+    limit = AIMDLimit(4, maximum=8, interval=0.)
+    sema = limit.semaphore()
+    # saturated and throughput grows: additive increase
+    limit.saturated = True
+    limit.record(100)
+    assert limit.limit == sema.limit == 5
+    limit.saturated = True
+    limit.record(10 ** 9)
+    assert limit.limit == 6
+    # throttled: multiplicative decrease
+    limit.record(0, THROTTLE)
+    assert limit.limit == sema.limit == 3
+    # not saturated, nothing to probe
+    limit._hold_until = 0.
+    limit.record(100)
+    assert limit.limit == 3
+    # too many transport errors
+    for _ in range(3):
+        limit.record(100, TRANSPORT)
+    assert limit.limit == 1
+
+
+def test_adaptive_concurrency_hosts():
+    c = AdaptiveConcurrency(interval=0.)
+    a = c.part_sema('https://a.com/1.m4s', 10)
+    b = c.part_sema('https://b.com/1.m4s', 10)
+    v = c.video_sema(3)
+    c.record('https://a.com/2.m4s', 0, THROTTLE)
+    assert a.limit == 5 and b.limit == 10 and v.limit == 1
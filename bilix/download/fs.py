@@ -0,0 +1,143 @@
+"""
+filesystem helpers that keep blocking file operations off the event loop. Operations requested while a batch
+is running in the worker thread are collected into the next batch, so many stats on a slow (network)
+filesystem cost a few thread hops instead of stalling every stream.
+"""
+import asyncio
+import os
+import weakref
+from pathlib import Path
+from typing import List, Tuple, Union, Set, Callable, Any
+
+from bilix.download.utils import path_check
+
+__all__ = ['AsyncFS', 'BatchWriter', 'afs']
+
+
+def _each(func: Callable) -> Callable[[List], List[Any]]:
+    """turn func(item) into a batch function returning result or OSError per item"""
+
+    def batch(items: List) -> List[Any]:
+        results = []
+        for item in items:
+            try:
+                results.append(func(item))
+            except OSError as e:
+                results.append(e)
+        return results
+
+    return batch
+
+
+class _LoopState:
+    __slots__ = ('pending', 'task')
+
+    def __init__(self):
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.task = None
+
+
+class _Batcher:
+    """run batch function on submitted items in worker thread, items submitted during a run go to the next batch"""
+
+    def __init__(self, func: Callable[[List], List[Any]], batch_size: int = 256):
+        self.func = func
+        self.batch_size = batch_size
+        # futures and flush task belong to one loop, a module level batcher may serve several loops in turn
+        self._states: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]' = \
+            weakref.WeakKeyDictionary()
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+        return state
+
+    async def submit(self, item):
+        state = self._state()
+        fut = asyncio.get_running_loop().create_future()
+        state.pending.append((item, fut))
+        if state.task is None or state.task.done():
+            state.task = asyncio.ensure_future(self._flush(state))
+        return await fut
+
+    async def _flush(self, state: _LoopState):
+        loop = asyncio.get_running_loop()
+        while state.pending:
+            batch, state.pending = state.pending[:self.batch_size], state.pending[self.batch_size:]
+            try:
+                results = await loop.run_in_executor(None, self.func, [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, fut), res in zip(batch, results):
+                if fut.done():
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+    async def join(self):
+        task = self._state().task
+        if task is not None:
+            await task
+
+
+class AsyncFS:
+    """mkdir and path_check off the event loop, directories created or checked before are remembered"""
+
+    def __init__(self):
+        self._dirs: Set[Path] = set()
+        self._mkdir = _Batcher(_each(self._mkdir_sync))
+        self._check = _Batcher(_each(path_check))
+
+    def _mkdir_sync(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        self._dirs.add(path)
+
+    async def mkdir(self, path: Union[str, Path]) -> Path:
+        """create directory with parents"""
+        path = Path(path)
+        if path not in self._dirs:
+            await self._mkdir.submit(path)
+        return path
+
+    async def path_check(self, path: Path) -> Tuple[bool, Path]:
+        """same as bilix.download.utils.path_check"""
+        return await self._check.submit(path)
+
+
+afs = AsyncFS()  # shared by all downloaders of the process
+
+
+def _write_file(item: Tuple[Path, bytes]):
+    path, content = item
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class BatchWriter:
+    """write small files (nfo, index json...) atomically from a worker thread in batches"""
+
+    def __init__(self, batch_size: int = 64, fs: AsyncFS = None):
+        self.fs = fs or afs
+        self._writer = _Batcher(_each(_write_file), batch_size)
+
+    async def write(self, path: Union[str, Path], content: Union[bytes, str]) -> Path:
+        """write content to path, parent directory is created on demand, return after the content is on disk"""
+        path = Path(path)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        await self.fs.mkdir(path.parent)
+        await self._writer.submit((path, content))
+        return path
+
+    async def mkdir(self, path: Union[str, Path]) -> Path:
+        return await self.fs.mkdir(path)
+
+    async def aclose(self):
+        """wait for pending writes"""
+        await self._writer.join()
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from bilix.download.fs import AsyncFS, BatchWriter
+from bilix.download import utils
+from bilix.download.utils import truncate_name, path_check, name_max
+
+
+def test_truncate_name():
+    name = '测试' * 100 + '.mp4'
+    short = truncate_name(name, 255)
+    assert len(short.encode('utf-8')) <= 255
+    assert short.endswith('.mp4') and '…' in short
+    assert truncate_name('a.mp4', 255) == 'a.mp4'
+
+
+@pytest.mark.asyncio
+async def test_async_fs(tmp_path):
+    fs = AsyncFS()
+    (tmp_path / '1.mp4').touch()
+    res = await asyncio.gather(*[fs.path_check(tmp_path / f'{i}.mp4') for i in range(3)])
+    assert [exist for exist, _ in res] == [False, True, False]
+    exist, path = await fs.path_check(tmp_path / ('长' * 200 + '.mp4'))
+    assert not exist and len(path.name.encode('utf-8')) <= 255
+
+    await asyncio.gather(*[fs.mkdir(tmp_path / 'a' / 'b') for _ in range(3)])
+    assert (tmp_path / 'a' / 'b').is_dir()
+    writer = BatchWriter(fs=fs)
+    await writer.write(tmp_path / 'c' / 'x.nfo', 'x')
+    await writer.aclose()
+    assert (tmp_path / 'c' / 'x.nfo').read_text() == 'x'
+
+
+def test_path_limits(tmp_path, monkeypatch):
+    # limits of a directory not created yet are those of its filesystem, not a cached fallback
+    assert utils._existing(tmp_path / 'a' / 'b') == tmp_path
+    assert name_max(tmp_path / 'a' / 'b') == name_max(tmp_path)
+    # the full path is limited too
+    parent = len(str(tmp_path / 'a').encode('utf-8')) + 1
+    monkeypatch.setattr(utils, 'path_max', lambda directory: parent + 101)
+    exist, path = path_check(tmp_path / 'a' / ('长' * 100 + '.mp4'))
+    assert not exist and len(str(path).encode('utf-8')) <= parent + 100 and path.suffix == '.mp4'
+
+
+def test_batcher_loops(tmp_path):
+    fs = AsyncFS()
+    loop = asyncio.new_event_loop()
+    loop.create_task(fs.path_check(tmp_path / 'a.mp4'))
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()  # closed while a batch is in flight
+    assert asyncio.run(asyncio.wait_for(fs.path_check(tmp_path / 'b.mp4'), 1)) == (False, tmp_path / 'b.mp4')
@@ -0,0 +1,239 @@
+"""
+sqlite backed durable job queue. A root job is one cli call (method + key), enumeration methods (up, favour,
+collection, series...) add the calls they would make as sub jobs instead of running them in one gather tree,
+so a restarted process continues from the jobs left instead of listing and checking everything again.
+Jobs stop at one video or page, its media and sidecar files are resumed by the downloader from the files on disk.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, NamedTuple, Union, List, Tuple
+
+__all__ = ['Job', 'JobQueue', 'current_job', 'PENDING', 'RUNNING', 'DONE', 'FAILED', 'SECRET_OPTIONS']
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+# never written to the queue file, given again by the running cli call or the environment (BILIX_COOKIE)
+SECRET_OPTIONS = ('cookie',)
+_PATH_OPTIONS = ('path', 'people_path')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    site TEXT NOT NULL,
+    method TEXT NOT NULL,
+    key TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    lease REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (site, method, key, kwargs)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class Job(NamedTuple):
+    id: int
+    parent: Optional[int]
+    site: str  # "module:Class" of the downloader, "" for a cli call which is assigned like a normal invocation
+    method: str
+    key: str
+    kwargs: dict
+    options: dict  # cli options, used to build the downloader after restart
+    attempts: int
+
+
+# the job being run by current task, sub jobs added in the task are linked to it
+current_job: 'contextvars.ContextVar[Optional[Job]]' = contextvars.ContextVar('current_job', default=None)
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str)  # Path -> str
+
+
+def _loads(s: str) -> dict:
+    """json gives back str for Path and list for tuple, restore the ones cli options and method kwargs use"""
+    obj = json.loads(s)
+    for k in _PATH_OPTIONS:
+        if isinstance(obj.get(k), str):
+            obj[k] = Path(obj[k])
+    if isinstance(time_range := obj.get('time_range'), list):
+        obj['time_range'] = [tuple(r) for r in time_range] if time_range and isinstance(time_range[0], list) \
+            else tuple(time_range)
+    return obj
+
+
+class JobQueue:
+    """
+    jobs move pending -> running -> done, or back to pending on error until max_attempts is reached (failed).
+    A running job holds a lease which is renewed while it runs, jobs whose lease expired (process died) are
+    claimed again. All sqlite operations run in one worker thread.
+    """
+
+    def __init__(self, path: Union[str, Path], lease: float = 120., max_attempts: int = 3, secrets: dict = None):
+        """
+
+        :param path: sqlite database file
+        :param lease: seconds a claimed job is reserved without renewal
+        :param max_attempts: times a job is tried before marked failed
+        :param secrets: values of SECRET_OPTIONS added to the options of claimed jobs
+        """
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.secrets = dict(secrets or {})
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='bilix-jobs')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._running: Dict[int, Job] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')  # enqueue from other processes while a daemon is running
+            conn.executescript(_SCHEMA)
+            try:  # queue files written by older versions
+                conn.execute("UPDATE jobs SET options = json_remove(options, '$.cookie') "
+                             "WHERE json_extract(options, '$.cookie') IS NOT NULL")
+            except sqlite3.OperationalError:  # sqlite built without json1
+                pass
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _add(self, items: List[Tuple], root: bool) -> List[int]:
+        conn = self._connect()
+        now = time.time()
+        ids = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for parent, site, method, key, kwargs, options in items:
+                options = {k: v for k, v in options.items() if k not in SECRET_OPTIONS}
+                kwargs, options = _dumps(kwargs), _dumps(options)
+                conn.execute(
+                    'INSERT OR IGNORE INTO jobs (parent, site, method, key, kwargs, options, state, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (parent, site, method, key, kwargs, options, PENDING, now, now))
+                row = conn.execute('SELECT id, state FROM jobs WHERE site = ? AND method = ? AND key = ? AND kwargs = ?',
+                                   (site, method, key, kwargs)).fetchone()
+                if root and row[1] in (DONE, FAILED):  # the user asks again, list again for new videos
+                    conn.execute('UPDATE jobs SET state = ?, attempts = 0, error = NULL, options = ?, updated = ? '
+                                 'WHERE id = ?', (PENDING, options, now, row[0]))
+                ids.append(row[0])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return ids
+
+    async def add_root(self, method: str, keys, options: dict) -> List[int]:
+        """add cli calls, a call that already finished is queued again"""
+        return await self._run(self._add, [(None, '', method, key, {}, options) for key in keys], True)
+
+    async def submit(self, executor, method: str, key: str, kwargs: dict) -> int:
+        """
+        add executor.method(key, **kwargs) as a sub job of current job, a call added before is not added again
+
+        :return: job id
+        """
+        parent = current_job.get()
+        site = f"{type(executor).__module__}:{type(executor).__qualname__}"
+        item = (parent and parent.id, site, method, key, kwargs, parent.options if parent else {})
+        return (await self._run(self._add, [item], False))[0]
+
+    def _claim(self) -> Optional[Job]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, parent, site, method, key, kwargs, options, attempts FROM jobs '
+                'WHERE state = ? OR (state = ? AND lease < ?) ORDER BY id LIMIT 1', (PENDING, RUNNING, now)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET state = ?, attempts = attempts + 1, lease = ?, updated = ? WHERE id = ?',
+                             (RUNNING, now + self.lease, now, row[0]))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job_id, parent, site, method, key, kwargs, options, attempts = row
+        options = {**_loads(options), **self._secrets()}
+        return Job(job_id, parent, site, method, key, _loads(kwargs), options, attempts + 1)
+
+    def _secrets(self) -> dict:
+        secrets = {k: v for k, v in self.secrets.items() if v is not None}
+        if 'cookie' not in secrets and os.environ.get('BILIX_COOKIE'):
+            secrets['cookie'] = os.environ['BILIX_COOKIE']
+        return secrets
+
+    async def claim(self) -> Optional[Job]:
+        """take the oldest runnable job, None if there is none"""
+        job = await self._run(self._claim)
+        if job is not None:
+            self._running[job.id] = job
+        return job
+
+    def _set(self, sql: str, *args):
+        self._connect().execute(sql, args)
+
+    async def renew(self):
+        """extend leases of jobs run by this queue"""
+        if self._running:
+            ids = list(self._running)
+            await self._run(self._set, f"UPDATE jobs SET lease = ? WHERE id IN ({','.join('?' * len(ids))})",
+                            time.time() + self.lease, *ids)
+
+    async def finish(self, job: Job):
+        self._running.pop(job.id, None)
+        await self._run(self._set, 'UPDATE jobs SET state = ?, error = NULL, updated = ? WHERE id = ?',
+                        DONE, time.time(), job.id)
+
+    async def fail(self, job: Job, error: BaseException) -> bool:
+        """record error, return True if the job will be retried"""
+        self._running.pop(job.id, None)
+        retry = job.attempts < self.max_attempts
+        await self._run(self._set, 'UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?',
+                        PENDING if retry else FAILED, f"{error.__class__.__name__}: {error}", time.time(), job.id)
+        return retry
+
+    async def release(self, job: Job):
+        """give back a job without counting the attempt, e.g. on user interrupt"""
+        self._running.pop(job.id, None)
+        await self._run(self._set, 'UPDATE jobs SET state = ?, attempts = attempts - 1, lease = 0, updated = ? '
+                                   'WHERE id = ?', PENDING, time.time(), job.id)
+
+    async def release_running(self):
+        """give back all jobs claimed by this queue"""
+        for job in list(self._running.values()):
+            await self.release(job)
+
+    def _counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(self._connect().execute('SELECT state, count(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    async def counts(self) -> Dict[str, int]:
+        """number of jobs in each state"""
+        return await self._run(self._counts)
+
+    async def aclose(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    def __repr__(self):
+        return f"<JobQueue {self.path}>"
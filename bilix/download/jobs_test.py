@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from bilix.download.jobs import JobQueue, current_job, PENDING, RUNNING, DONE, FAILED
+
+
+class Site:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_job_queue(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs.db', lease=60, max_attempts=2)
+    await queue.add_root('up', ['123'], {'path': tmp_path})
+    root = await queue.claim()
+    assert root.method == 'up' and root.options == {'path': tmp_path}  # restored from json
+    token = current_job.set(root)
+    ids = [await queue.submit(Site(), 'get_series', f'BV{i}', {'quality': 0}) for i in range(2)]
+    assert await queue.submit(Site(), 'get_series', 'BV0', {'quality': 0}) == ids[0]  # no duplicate
+    current_job.reset(token)
+    await queue.finish(root)
+
+    job = await queue.claim()
+    assert (job.id, job.parent, job.site, job.kwargs) == (ids[0], root.id, f'{__name__}:Site', {'quality': 0})
+    assert job.options == root.options
+    assert await queue.fail(job, ValueError('x'))  # retried
+    assert (await queue.claim()).id == ids[0]
+    assert not await queue.fail(job._replace(attempts=2), ValueError('x'))
+    assert await queue.counts() == {PENDING: 1, RUNNING: 0, DONE: 1, FAILED: 1}
+    await queue.aclose()
+
+    # process died while running: job is claimed again after its lease expired
+    queue = JobQueue(tmp_path / 'jobs.db', lease=0.1)
+    assert (await queue.claim()).id == ids[1]
+    assert await queue.claim() is None
+    await asyncio.sleep(0.2)
+    assert (await queue.claim()).id == ids[1]
+    await queue.release_running()
+    assert (await queue.counts())[PENDING] == 1
+    # the same cli call queues the finished root again
+    await queue.add_root('up', ['123'], {'path': tmp_path})
+    assert (await queue.counts())[PENDING] == 2
+    await queue.aclose()
+
+    # secrets are not written to the file but given back to claimed jobs
+    queue = JobQueue(tmp_path / 'secret.db', secrets={'cookie': 'SESSDATA'})
+    await queue.add_root('up', ['123'], {'cookie': 'SESSDATA', 'num': 1})
+    assert (await queue.claim()).options == {'cookie': 'SESSDATA', 'num': 1}
+    await queue.aclose()
+    assert b'SESSDATA' not in (tmp_path / 'secret.db').read_bytes()
@@ -0,0 +1,101 @@
+"""
+request rate limiting for site apis. Requests are classified into endpoint families, each family has a token
+bucket (requests per second + burst). When the site's risk control is detected, the family or all families
+cool down for a jittered, exponentially growing time.
+"""
+import asyncio
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+
+from bilix.download.utils import backoff_delay
+from bilix.log import logger
+from bilix import metrics
+
+__all__ = ['TokenBucket', 'RateLimiter']
+
+
+class TokenBucket:
+    """allow rate requests per second on average and up to burst at once"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = None
+
+    async def acquire(self):
+        now = asyncio.get_event_loop().time()
+        if self._last is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= 1  # reserve, waiters queue up as negative tokens
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class RateLimiter:
+    """token buckets per endpoint family and cool-downs shared by all callers"""
+
+    def __init__(self, families: Dict[str, Tuple[float, int]], classify: Callable[[httpx.URL], Optional[str]],
+                 cooldown: float = 10., max_cooldown: float = 300.):
+        """
+
+        :param families: family -> (requests per second, burst)
+        :param classify: url -> family, None for requests not limited (e.g. cdn)
+        :param cooldown: first cool-down seconds, doubled when risk control is hit again soon after
+        :param max_cooldown: upper bound of a cool-down
+        """
+        self.buckets = {family: TokenBucket(rate, burst) for family, (rate, burst) in families.items()}
+        self.classify = classify
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._until: Dict[Optional[str], float] = {}  # None is the cool-down of all families
+        self._strikes: Dict[Optional[str], int] = {}
+
+    async def acquire(self, url):
+        """wait until a request to url is allowed"""
+        family = self.classify(httpx.URL(url) if isinstance(url, str) else url)
+        if family is None:
+            return
+        loop = asyncio.get_event_loop()
+        while (wait := max(self._until.get(None, 0.), self._until.get(family, 0.)) - loop.time()) > 0:
+            await asyncio.sleep(wait)  # loop since a cool-down may be extended meanwhile
+        await self.buckets[family].acquire()
+
+    def trip(self, family: str = None, reason: str = ''):
+        """
+        enter cool-down after risk control is detected
+
+        :param family: the family to cool down, None for all
+        :param reason: for log
+        """
+        now = asyncio.get_event_loop().time()
+        until = self._until.get(family, 0.)
+        if now < until:
+            return  # requests sent before the cool-down report it again
+        # hit again within a max cool-down after the last one ended: back off longer
+        strikes = self._strikes.get(family, 0) if now - until < self.max_cooldown else 0
+        delay = backoff_delay(strikes, self.cooldown, self.max_cooldown)
+        self._until[family] = now + delay
+        self._strikes[family] = strikes + 1
+        metrics.inc('bilix_risk_control_total', family=family or 'all')
+        logger.warning(f"触发风控{f' {reason}' if reason else ''}，{'全部' if family is None else family}请求暂停{delay:.0f}s")
+
+    def cooling(self, family: str = None) -> bool:
+        return asyncio.get_event_loop().time() < self._until.get(family, 0.)
+
+    async def _on_request(self, request: httpx.Request):
+        await self.acquire(request.url)
+
+    async def _on_response(self, response: httpx.Response):
+        if response.status_code == 412 and self.classify(response.request.url) is not None:
+            self.trip(reason=f"412 {response.request.url.path}")
+
+    def install(self, client: httpx.AsyncClient):
+        """limit all requests sent by client, cdn streams are passed through by classify"""
+        hooks = client.event_hooks
+        if self._on_request not in hooks['request']:
+            hooks['request'].append(self._on_request)
+            hooks['response'].append(self._on_response)
+        client.event_hooks = hooks
@@ -0,0 +1,47 @@
+import asyncio
+import httpx
+import pytest
+from bilix.download.ratelimit import TokenBucket, RateLimiter
+from bilix.download.utils import backoff_delay
+
+
+def test_backoff_delay():
+    for times in range(8):
+        d = min(30., .5 * 2 ** times)
+        assert d / 2 <= backoff_delay(times, .5) <= d
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    loop = asyncio.get_event_loop()
+    bucket = TokenBucket(rate=100, burst=2)
+    start = loop.time()
+    await asyncio.gather(*[bucket.acquire() for _ in range(6)])
+    assert loop.time() - start >= .035  # 2 at once, 4 at 100/s
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_cooldown():
+    def classify(url: httpx.URL):
+        return 'api' if url.host == 'api.test' else None
+
+    def handler(request: httpx.Request):
+        return httpx.Response(412 if request.url.path == '/risk' else 200)
+
+    limiter = RateLimiter({'api': (1000., 10)}, classify, cooldown=.1, max_cooldown=1.)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    limiter.install(client)
+    limiter.install(client)
+    assert len(client.event_hooks['request']) == 1
+    loop = asyncio.get_event_loop()
+    async with client:
+        await client.get('https://api.test/risk')
+        assert limiter.cooling()
+        start = loop.time()
+        await client.get('https://cdn.test/x')  # not limited
+        assert loop.time() - start < .05
+        await client.get('https://api.test/ok')
+        assert loop.time() - start >= .05
+        # hit again soon after: longer cool-down
+        await client.get('https://api.test/risk')
+        assert limiter._until[None] - loop.time() > .095
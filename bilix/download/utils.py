@@ -1,17 +1,19 @@
 import asyncio
-import errno
 import os
 import random
-from functools import wraps
-from pathlib import Path
+from functools import wraps, lru_cache
+from pathlib import Path, PurePath
+from urllib.parse import urlparse
 
 import aiofiles
 import httpx
 from typing import Union, Sequence, Tuple, List
 from bilix.exception import APIError, APIParseError
 from bilix.log import logger
+from bilix import metrics
 
 
+@metrics.timed('merge')
 async def merge_files(file_list: List[Path], new_path: Path):
     first_file = file_list[0]
     async with aiofiles.open(first_file, 'ab') as f:
@@ -22,6 +24,16 @@ async def merge_files(file_list: List[Path], new_path: Path):
     os.rename(first_file, new_path)
 
 
+def backoff_delay(times: int, base: float, cap: float = 30.) -> float:
+    """exponential backoff with jitter, in [d/2, d] where d = base * 2 ** times capped by cap"""
+    delay = min(cap, base * 2 ** times)
+    return random.uniform(delay / 2, delay)
+
+
+def _host(url) -> str:
+    return urlparse(str(url)).netloc
+
+
 async def req_retry(client: httpx.AsyncClient, url_or_urls: Union[str, Sequence[str]], method='GET',
                     follow_redirects=False, retry=5, **kwargs) -> httpx.Response:
     """Client request with multiple backup urls and retry"""
@@ -34,12 +46,14 @@ async def req_retry(client: httpx.AsyncClient, url_or_urls: Union[str, Sequence[
         except httpx.TransportError as e:
             msg = f'{method} {e.__class__.__name__} url: {url}'
             logger.warning(msg) if times > 0 else logger.debug(msg)
+            metrics.inc('bilix_request_retries_total', host=_host(url), reason=e.__class__.__name__)
             pre_exc = e
-            await asyncio.sleep(.1 * (times + 1))
+            await asyncio.sleep(backoff_delay(times, .1))
         except httpx.HTTPStatusError as e:
             logger.warning(f'{method} {e.response.status_code} {url}')
+            metrics.inc('bilix_request_retries_total', host=_host(url), reason=e.response.status_code)
             pre_exc = e
-            await asyncio.sleep(1. * (times + 1))
+            await asyncio.sleep(backoff_delay(times, 1.))
         except Exception as e:
             logger.warning(f'{method} {e.__class__.__name__} 未知异常 url: {url}')
             raise e
@@ -57,28 +71,58 @@ def eclipse_str(s: str, max_len: int = 100):
         return f"{s[:half_len]}…{s[-half_len:]}"
 
 
-def path_check(path: Path, retry: int = 100) -> Tuple[bool, Path]:
+def _existing(directory: Path) -> Path:
+    """nearest existing ancestor, a directory not created yet will be on the same filesystem"""
+    directory = Path(os.path.abspath(directory))
+    while not directory.exists() and directory.parent != directory:
+        directory = directory.parent
+    return directory
+
+
+@lru_cache(maxsize=256)
+def _pathconf(directory: Path, name: str, default: int) -> int:
+    try:
+        return os.pathconf(directory, name)
+    except (OSError, ValueError, AttributeError):  # unknown or not supported (Windows)
+        return default
+
+
+def name_max(directory: Path) -> int:
+    """max file name length in bytes of the filesystem holding directory"""
+    return _pathconf(_existing(directory), 'PC_NAME_MAX', 255)
+
+
+def path_max(directory: Path) -> int:
+    """max path length in bytes of the filesystem holding directory, including the terminating null"""
+    return _pathconf(_existing(directory), 'PC_PATH_MAX', 260 if os.name == 'nt' else 4096)
+
+
+def truncate_name(name: str, max_bytes: int) -> str:
+    """shorten file name in the middle to fit max_bytes in utf-8, suffix is kept"""
+    if len(name.encode('utf-8')) <= max_bytes:
+        return name
+    path = PurePath(name)
+    stem, suffix = path.stem.encode('utf-8'), path.suffix
+    budget = max_bytes - len(suffix.encode('utf-8')) - len('…'.encode('utf-8'))
+    head = stem[:budget - budget // 2].decode('utf-8', 'ignore')  # cut at character boundary
+    tail = stem[len(stem) - (budget - len(head.encode('utf-8'))):].decode('utf-8', 'ignore') if budget > 0 else ''
+    return f"{head}…{tail}{suffix}"
+
+
+def path_check(path: Path) -> Tuple[bool, Path]:
     """
     check whether path exist, if filename too long, truncate and return valid path
 
     :param path: path to check
-    :param retry: max retry times
     :return: exist, path
     """
-    for times in range(retry):
-        try:
-            exist = path.exists()
-            return exist, path
-        except OSError as e:
-            if e.errno == errno.ENAMETOOLONG:  # filename too long for os
-                if times == 0:
-                    logger.warning(f"filename too long for os, truncate will be applied. filename: {path.name}")
-                else:
-                    logger.debug(f"filename too long for os {path.name}")
-                path = path.with_stem(eclipse_str(path.stem, int(len(path.stem) * .8)))
-            else:
-                raise e
-    raise OSError(f"filename too long for os {path.name}")
+    parent = len(os.path.abspath(path.parent).encode('utf-8')) + len(os.sep)
+    # the full path must fit too, but a too deep directory can not be fixed by the file name
+    limit = min(name_max(path.parent), max(path_max(path.parent) - 1 - parent, 64))
+    if len(path.name.encode('utf-8')) > limit:
+        logger.warning(f"filename too long for os, truncate will be applied. filename: {path.name}")
+        path = path.with_name(truncate_name(path.name, limit))
+    return path.exists(), path
 
 
 def raise_api_error(func):
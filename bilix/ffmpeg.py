@@ -7,7 +7,10 @@ from typing import List
 from pathlib import Path
 import tempfile
 
+from bilix import metrics
 
+
+@metrics.timed('mux')
 async def concat(path_lst: List[Path], output_path: Path, remove=True):
     with tempfile.NamedTemporaryFile('w', dir=output_path.parent, delete=False) as fp:
         for path in path_lst:
@@ -22,6 +25,7 @@ async def concat(path_lst: List[Path], output_path: Path, remove=True):
             os.remove(path)
 
 
+@metrics.timed('mux')
 async def combine(path_lst: List[Path], output_path: Path, remove=True):
     cmd = ['ffmpeg']
     for path in path_lst:
@@ -35,6 +39,7 @@ async def combine(path_lst: List[Path], output_path: Path, remove=True):
             os.remove(path)
 
 
+@metrics.timed('mux')
 async def time_range_clip(input_path: Path, start: int, t: int, output_path: Path, remove=True):
     # for flac, use -strict -2
     cmd = ['ffmpeg', '-ss', f'{start:.1f}', '-t', f'{t:.1f}', '-i', str(input_path), '-codec', 'copy', '-strict', '-2',
@@ -43,3 +48,13 @@ async def time_range_clip(input_path: Path, start: int, t: int, output_path: Pat
     await run_process(cmd)
     if remove:
         os.remove(input_path)
+
+
+@metrics.timed('mux')
+async def trim_segment(input_path: Path, t: float, output_path: Path, remove=True):
+    """keep the first t seconds of a mpeg-ts segment, output stays mpeg-ts to be concatenated with other segments"""
+    cmd = ['ffmpeg', '-i', str(input_path), '-t', f'{t:.3f}', '-c', 'copy', '-loglevel', 'quiet', '-f', 'mpegts',
+           str(output_path)]
+    await run_process(cmd)
+    if remove:
+        os.remove(input_path)
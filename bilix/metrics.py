@@ -0,0 +1,427 @@
+"""
+lightweight in-process metrics: counters, gauges and histograms exported by pluggable sinks
+(prometheus text file, statsd over udp, json log). Nothing is recorded until enable() is called,
+so a disabled instrument costs one global check.
+"""
+import asyncio
+import inspect
+import json
+import socket
+import time
+from bisect import bisect_left
+from functools import wraps
+from pathlib import Path
+from typing import Dict, Tuple, Optional, Sequence, List, Union
+
+from bilix.log import logger
+
+__all__ = ['Registry', 'Histogram', 'enabled', 'registry', 'inc', 'set_gauge', 'add_gauge', 'observe', 'timed',
+           'Timer', 'LoopMonitor', 'MetricsSink', 'JSONLogSink', 'StatsdSink', 'PrometheusFileSink',
+           'PrometheusHTTPSink', 'render_prometheus', 'sink_from_spec', 'Reporter', 'enable', 'disable']
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60., 300.)
+HELP = {
+    'bilix_stream_bytes_total': 'bytes received by download streams',
+    'bilix_stream_seconds': 'duration of download streams',
+    'bilix_stream_errors_total': 'failed download streams by reason',
+    'bilix_stream_slowdown_seconds_total': 'seconds slept before retrying a stream, e.g. after 403',
+    'bilix_active_streams': 'download streams currently open',
+    'bilix_request_retries_total': 'retried api and static requests by reason',
+    'bilix_asset_cache_total': 'asset cache lookups by result',
+    'bilix_jobs': 'jobs in the queue by state',
+    'bilix_concurrency_limit': 'adaptive stream limit by host, or of videos',
+    'bilix_phase_seconds': 'duration of download phases',
+    'bilix_loop_lag_seconds': 'how late the event loop wakes up a sleeping task',
+    'bilix_process_cpu_ratio': 'process cpu time per wall time',
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float] = SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.help: Dict[str, str] = dict(HELP)
+
+    @staticmethod
+    def key(name: str, labels: dict) -> Key:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+    def inc(self, name: str, value: float = 1., labels: dict = None):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0.) + value
+
+    def set_gauge(self, name: str, value: float, labels: dict = None):
+        self.gauges[self.key(name, labels)] = value
+
+    def add_gauge(self, name: str, delta: float, labels: dict = None):
+        key = self.key(name, labels)
+        self.gauges[key] = self.gauges.get(key, 0.) + delta
+
+    def observe(self, name: str, value: float, labels: dict = None, buckets: Sequence[float] = SECONDS_BUCKETS):
+        key = self.key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+    def snapshot(self) -> dict:
+        def fmt(key: Key) -> str:
+            name, labels = key
+            return name + ('{' + ','.join(f'{k}={v}' for k, v in labels) + '}' if labels else '')
+
+        return {
+            'counters': {fmt(k): v for k, v in self.counters.items()},
+            'gauges': {fmt(k): v for k, v in self.gauges.items()},
+            'histograms': {fmt(k): {'count': h.count, 'sum': h.sum} for k, h in self.histograms.items()},
+        }
+
+
+_registry: Optional[Registry] = None
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def registry() -> Optional[Registry]:
+    return _registry
+
+
+def inc(name: str, value: float = 1., **labels):
+    if _registry is not None:
+        _registry.inc(name, value, labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if _registry is not None:
+        _registry.set_gauge(name, value, labels)
+
+
+def add_gauge(name: str, delta: float, **labels):
+    if _registry is not None:
+        _registry.add_gauge(name, delta, labels)
+
+
+def observe(name: str, value: float, **labels):
+    if _registry is not None:
+        _registry.observe(name, value, labels)
+
+
+class Timer:
+    """context manager observing elapsed seconds into histogram name"""
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if _registry is not None:
+            self.labels['status'] = 'ok' if exc_type is None else 'error'
+            _registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+
+def timed(phase: str, name: str = 'bilix_phase_seconds'):
+    """decorator to time a sync or async function as phase, e.g. info, transfer, merge, mux, sidecar"""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if _registry is None:
+                    return await func(*args, **kwargs)
+                with Timer(name, phase=phase):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if _registry is None:
+                    return func(*args, **kwargs)
+                with Timer(name, phase=phase):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class LoopMonitor:
+    """sample event loop lag and the share of wall time the process spends on cpu"""
+
+    def __init__(self, interval: float = .1):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        cpu, wall = time.process_time(), loop.time()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            observe('bilix_loop_lag_seconds', now - t - self.interval)
+            if now - wall >= 1.:
+                set_gauge('bilix_process_cpu_ratio', (time.process_time() - cpu) / (now - wall))
+                cpu, wall = time.process_time(), now
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class MetricsSink:
+    """export metrics of a registry, called periodically and once at the end"""
+
+    async def start(self):
+        pass
+
+    async def export(self, reg: Registry):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class JSONLogSink(MetricsSink):
+    def __init__(self, log=None):
+        self.logger = log or logger
+
+    async def export(self, reg: Registry):
+        self.logger.info(f"metrics {json.dumps(reg.snapshot(), ensure_ascii=False)}")
+
+
+class StatsdSink(MetricsSink):
+    """push to a statsd compatible daemon over udp, counters and histogram count/sum are sent as deltas"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8125, prefix: str = 'bilix'):
+        self.addr = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self._last: Dict[str, float] = {}
+
+    def _name(self, key: Key) -> str:
+        name, labels = key
+        name = name[len('bilix_'):] if name.startswith('bilix_') else name
+        return '.'.join([self.prefix, name, *(f'{k}_{v}'.replace('.', '_') for k, v in labels)])
+
+    def _delta(self, name: str, value: float) -> float:
+        delta = value - self._last.get(name, 0.)
+        self._last[name] = value
+        return delta
+
+    async def export(self, reg: Registry):
+        lines = []
+        for key, value in reg.counters.items():
+            name = self._name(key)
+            if delta := self._delta(name, value):
+                lines.append(f'{name}:{_num(delta)}|c')
+        for key, value in reg.gauges.items():
+            lines.append(f'{self._name(key)}:{_num(value)}|g')
+        for key, hist in reg.histograms.items():
+            name = self._name(key)
+            count, total = self._delta(name + '.count', hist.count), self._delta(name + '.sum', hist.sum)
+            if count:
+                lines.append(f'{name}.count:{_num(count)}|c')
+                lines.append(f'{name}:{total / count * 1000:.3f}|ms')  # mean of the interval
+        for i in range(0, len(lines), 20):  # keep datagrams small
+            try:
+                self.sock.sendto('\n'.join(lines[i:i + 20]).encode(), self.addr)
+            except OSError as e:
+                logger.debug(f"statsd send failed {e}")
+
+    async def aclose(self):
+        self.sock.close()
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _prom_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    items = [f'{k}="{_prom_escape(v)}"' for k, v in labels]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def render_prometheus(reg: Registry) -> str:
+    """prometheus text exposition format"""
+    lines = []
+    typed = set()
+
+    def head(name: str, kind: str):
+        if name not in typed:
+            typed.add(name)
+            if name in reg.help:
+                lines.append(f'# HELP {name} {reg.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in sorted(reg.counters.items()):
+        head(name, 'counter')
+        lines.append(f'{name}{_prom_labels(labels)} {_num(value)}')
+    for (name, labels), value in sorted(reg.gauges.items()):
+        head(name, 'gauge')
+        lines.append(f'{name}{_prom_labels(labels)} {_num(value)}')
+    for (name, labels), hist in sorted(reg.histograms.items(), key=lambda i: i[0]):
+        head(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip((*hist.buckets, '+Inf'), hist.counts):
+            cumulative += count
+            le = 'le="%s"' % (bound if isinstance(bound, str) else f'{bound:g}')
+            lines.append(f'{name}_bucket{_prom_labels(labels, le)} {cumulative}')
+        lines.append(f'{name}_sum{_prom_labels(labels)} {_num(hist.sum)}')
+        lines.append(f'{name}_count{_prom_labels(labels)} {hist.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusFileSink(MetricsSink):
+    """write prometheus text format to a file, e.g. for node_exporter textfile collector"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def _write(self, text: str):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(text)
+        tmp.replace(self.path)  # the collector must never read a partial file
+
+    async def export(self, reg: Registry):
+        await asyncio.get_event_loop().run_in_executor(None, self._write, render_prometheus(reg))
+
+
+class PrometheusHTTPSink(MetricsSink):
+    """serve prometheus text format at http://host:port/metrics for scraping, rendered on request"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9464):
+        self.host = host
+        self.port = port
+        self.registry: Optional[Registry] = None
+        self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            target = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+            if target.split(b'?')[0] == b'/metrics' and self.registry is not None:
+                status, body = '200 OK', render_prometheus(self.registry).encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"metrics at http://{self.host}:{self.port}/metrics")
+
+    async def export(self, reg: Registry):
+        self.registry = reg
+
+    async def aclose(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+def sink_from_spec(spec: str) -> MetricsSink:
+    """
+    build sink from cli spec
+
+    :param spec: json | statsd://host:port | prom:<file path> | http://host:port (scrape endpoint)
+    :return:
+    """
+    if spec.startswith('http://'):
+        host, _, port = spec[len('http://'):].rstrip('/').partition(':')
+        return PrometheusHTTPSink(host or '127.0.0.1', int(port or 9464))
+    if spec == 'json':
+        return JSONLogSink()
+    if spec.startswith('statsd://'):
+        host, _, port = spec[len('statsd://'):].partition(':')
+        return StatsdSink(host or '127.0.0.1', int(port or 8125))
+    if spec.startswith('prom:'):
+        return PrometheusFileSink(spec[len('prom:'):])
+    raise ValueError(f"unknown metrics sink {spec}")
+
+
+class Reporter:
+    """export the registry to sinks every interval seconds while running"""
+
+    def __init__(self, reg: Registry, sinks: List[MetricsSink], interval: float = 10.):
+        self.registry = reg
+        self.sinks = sinks
+        self.interval = interval
+        self.monitor = LoopMonitor()
+        self._task = None
+
+    async def export(self):
+        for sink in self.sinks:
+            try:
+                await sink.export(self.registry)
+            except Exception as e:
+                logger.debug(f"metrics export failed {sink.__class__.__name__} {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.export()
+
+    async def start(self):
+        for sink in self.sinks:
+            await sink.start()
+        await self.export()
+        self.monitor.start()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def aclose(self):
+        """stop and export the final values"""
+        self.monitor.stop()
+        if self._task is not None:
+            self._task.cancel()
+        await self.export()
+        for sink in self.sinks:
+            await sink.aclose()
+
+
+def enable(*sinks: MetricsSink, interval: float = 10.) -> Reporter:
+    """start recording, return reporter to start in the event loop"""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return Reporter(_registry, list(sinks), interval)
+
+
+def disable():
+    global _registry
+    _registry = None
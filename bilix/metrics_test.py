@@ -0,0 +1,76 @@
+import httpx
+import pytest
+from bilix import metrics
+
+
+@pytest.fixture
+def reg():
+    metrics.enable()
+    yield metrics.registry()
+    metrics.disable()
+
+
+def test_disabled_is_noop():
+    assert not metrics.enabled()
+    metrics.inc('x')
+    metrics.observe('y', 1.)
+    assert metrics.registry() is None
+
+
+def test_render_prometheus(reg):
+    metrics.inc('bilix_stream_bytes_total', 10, host='a.com')
+    metrics.inc('bilix_stream_bytes_total', 5, host='a.com')
+    metrics.set_gauge('bilix_process_cpu_ratio', .5)
+    metrics.observe('bilix_phase_seconds', .02, phase='merge')
+    text = metrics.render_prometheus(reg)
+    assert '# TYPE bilix_stream_bytes_total counter' in text
+    assert 'bilix_stream_bytes_total{host="a.com"} 15' in text
+    assert 'bilix_process_cpu_ratio 0.5' in text
+    assert 'bilix_phase_seconds_bucket{phase="merge",le="0.01"} 0' in text
+    assert 'bilix_phase_seconds_bucket{phase="merge",le="0.025"} 1' in text
+    assert 'bilix_phase_seconds_bucket{phase="merge",le="+Inf"} 1' in text
+    assert 'bilix_phase_seconds_count{phase="merge"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_timed(reg):
+    @metrics.timed('info')
+    async def ok():
+        return 1
+
+    @metrics.timed('mux')
+    def bad():
+        raise ValueError
+
+    assert await ok() == 1
+    with pytest.raises(ValueError):
+        bad()
+    snapshot = reg.snapshot()['histograms']
+    assert snapshot['bilix_phase_seconds{phase=info,status=ok}']['count'] == 1
+    assert snapshot['bilix_phase_seconds{phase=mux,status=error}']['count'] == 1
+
+
+@pytest.mark.asyncio
+async def test_prometheus_file_sink(reg, tmp_path):
+    metrics.inc('bilix_x_total')
+    reporter = metrics.enable(metrics.sink_from_spec(f'prom:{tmp_path / "bilix.prom"}'))
+    await reporter.start()
+    await reporter.aclose()
+    assert 'bilix_x_total 1' in (tmp_path / 'bilix.prom').read_text()
+
+
+@pytest.mark.asyncio
+async def test_prometheus_http_sink(reg, unused_tcp_port):
+    metrics.add_gauge('bilix_active_streams', 2)
+    metrics.add_gauge('bilix_active_streams', -1)
+    reporter = metrics.enable(metrics.sink_from_spec(f'http://127.0.0.1:{unused_tcp_port}'))
+    await reporter.start()
+    try:
+        async with httpx.AsyncClient() as client:
+            res = await client.get(f'http://127.0.0.1:{unused_tcp_port}/metrics')
+            assert res.status_code == 200
+            assert '# HELP bilix_active_streams' in res.text
+            assert 'bilix_active_streams 1' in res.text
+            assert (await client.get(f'http://127.0.0.1:{unused_tcp_port}/')).status_code == 404
+    finally:
+        await reporter.aclose()
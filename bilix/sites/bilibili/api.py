@@ -1,16 +1,18 @@
 import asyncio
-import json
 import re
+from collections import deque
+from itertools import islice
 from urllib.parse import quote
 import httpx
 from pydantic import field_validator, BaseModel, Field
 from typing import Union, List, Tuple, Dict, Optional
-import json5
-from danmakuC.bilibili import parse_view
 from bilix.download.utils import req_retry, raise_api_error
+from bilix.download.ratelimit import RateLimiter
 from bilix.sites.bilibili.utils import parse_ids_from_url
 from bilix.utils import legal_title
-from bilix.exception import APIInvalidError, APIError, APIResourceError, APIUnsupportedError
+from bilix.exception import APIInvalidError, APIResourceError, APIUnsupportedError
+from bilix._json import loads
+from bilix import metrics
 import hashlib
 import time
 
@@ -20,6 +22,38 @@ dft_client_settings = {
     'http2': True
 }
 
+# endpoint family -> (requests per second, burst), space (wbi) apis are the most sensitive to risk control
+RATE_LIMITS = {
+    'page': (2., 4),
+    'space': (1., 2),
+    'search': (2., 4),
+    'playurl': (4., 8),
+    'dm': (10., 20),
+    'api': (5., 10),
+}
+
+
+def _family(url: httpx.URL) -> Optional[str]:
+    host, path = url.host, url.path
+    if host == 'api.bilibili.com':
+        if path.startswith('/x/space/'):
+            return 'space'
+        if path.startswith(('/x/player/playurl', '/pgc/player/')):
+            return 'playurl'
+        if path.startswith('/x/v2/dm/'):
+            return 'dm'
+        return 'api'
+    if host in ('www.bilibili.com', 'space.bilibili.com', 'm.bilibili.com'):
+        return 'page'
+    if host == 's.search.bilibili.com':
+        return 'search'
+    return None  # cdn and static files
+
+
+# shared by all clients in the process, so that a risk control cool-down pauses every caller
+limiter = RateLimiter(RATE_LIMITS, _family)
+SPACE_RETRY = 3  # requests retried after a -352 cool-down
+
 
 @raise_api_error
 async def get_cate_meta(client: httpx.AsyncClient) -> dict:
@@ -29,6 +63,7 @@ async def get_cate_meta(client: httpx.AsyncClient) -> dict:
     :param client:
     :return:
     """
+    import json5  # only used here, import lazily to speed up startup
     cate_info = {}
     res = await req_retry(client, 'https://s1.hdslb.com/bfs/static/laputa-channel/client/assets/index.c0ea30e6.js')
     cate_data = re.search('Za=([^;]*);', res.text).groups()[0]
@@ -55,14 +90,14 @@ async def get_list_info(client: httpx.AsyncClient, url_or_sid: str, ):
     else:
         sid = url_or_sid
     res = await req_retry(client, f'https://api.bilibili.com/x/series/series?series_id={sid}')  # meta api
-    meta = json.loads(res.text)
+    meta = loads(res.content)
     mid = meta['data']['meta']['mid']
     params = {'mid': mid, 'series_id': sid, 'ps': meta['data']['meta']['total']}
     list_res, up_info = await asyncio.gather(
         req_retry(client, 'https://api.bilibili.com/x/series/archives', params=params),
         get_up_info(client, str(mid)),
     )
-    list_info = json.loads(list_res.text)
+    list_info = loads(list_res.content)
     list_name = meta['data']['meta']['name']
     up_name = up_info.get('name', '')
     bvids = [i['bvid'] for i in list_info['data']['archives']]
@@ -81,7 +116,7 @@ async def get_collect_info(client: httpx.AsyncClient, url_or_sid: str):
     sid = re.search(r'sid=(\d+)', url_or_sid).groups()[0] if url_or_sid.startswith('http') else url_or_sid
     params = {'season_id': sid}
     res = await req_retry(client, 'https://api.bilibili.com/x/space/fav/season/list', params=params)
-    data = json.loads(res.text)
+    data = loads(res.content)
     medias = data['data']['medias']
     info = data['data']['info']
     col_name, up_name = info['title'], medias[0]['upper']['name']
@@ -107,7 +142,7 @@ async def get_favour_page_info(client: httpx.AsyncClient, url_or_fid: str, pn=1,
         fid = url_or_fid
     params = {'media_id': fid, 'pn': pn, 'ps': ps, 'keyword': keyword, 'order': 'mtime'}
     res = await req_retry(client, 'https://api.bilibili.com/x/v3/fav/resource/list', params=params)
-    data = json.loads(res.text)['data']
+    data = loads(res.content)['data']
     fav_name, up_name = data['info']['title'], data['info']['upper']['name']
     bvids = [i['bvid'] for i in data['medias'] if i['title'] != '已失效视频']
     bvnames = [i['title'] for i in data['medias'] if i['title'] != '已失效视频']
@@ -134,7 +169,7 @@ async def get_cate_page_info(client: httpx.AsyncClient, cate_id, time_from, time
     params = {'search_type': 'video', 'view_type': 'hot_rank', 'cate_id': cate_id, 'pagesize': ps,
               'keyword': keyword, 'page': pn, 'order': order, 'time_from': time_from, 'time_to': time_to}
     res = await req_retry(client, 'https://s.search.bilibili.com/cate/search', params=params)
-    info = json.loads(res.text)
+    info = loads(res.content)
     bvids = [i['bvid'] for i in info['result']]
     return bvids
 
@@ -152,7 +187,7 @@ async def _add_sign(client: httpx.AsyncClient, params: dict):
     res = await req_retry(
         client, "https://api.bilibili.com/x/web-interface/nav"
     )
-    info = json.loads(res.text)
+    info = loads(res.content)
     img_val = info['data']['wbi_img']['img_url'].split('/')[-1].split('.')[0]
     sub_val = info['data']['wbi_img']['sub_url'].split('/')[-1].split('.')[0]
     val = img_val + sub_val
@@ -189,11 +224,18 @@ async def get_up_video_info(client: httpx.AsyncClient, url_or_mid: str, pn=1, ps
     else:
         mid = url_or_mid
 
-    params = {"mid": mid, "order": order, "ps": ps, "pn": pn, "keyword": quote(keyword or "")}
-    await _add_sign(client, params)
-
-    res = await req_retry(client, "https://api.bilibili.com/x/space/wbi/arc/search", params=params)
-    info = json.loads(res.text)
+    for times in range(1 + SPACE_RETRY):
+        params = {"mid": mid, "order": order, "ps": ps, "pn": pn, "keyword": quote(keyword or "")}
+        await _add_sign(client, params)
+        res = await req_retry(client, "https://api.bilibili.com/x/space/wbi/arc/search", params=params)
+        info = loads(res.content)
+        if info['code'] != -352:  # -352: risk control check failed
+            break
+        limiter.trip('space', reason='-352')
+        if times < SPACE_RETRY:  # wait for the cool-down instead of failing the other pages of get_up
+            await limiter.acquire(res.request.url)
+    else:
+        raise APIInvalidError("space api 访问被风控", url_or_mid)
     # print(info)
     up_name = info["data"]["list"]["vlist"][0]["author"]
     total_size = info["data"]["page"]["count"]
@@ -210,11 +252,20 @@ async def get_up_info(client: httpx.AsyncClient, url_or_mid: str):
     params = {"mid": mid}
     await _add_sign(client, params)
     res = await req_retry(client, "https://api.bilibili.com/x/space/wbi/acc/info", params=params)
-    data = json.loads(res.text)['data']
+    data = loads(res.content)['data']
     return data
 
 
-class Media(BaseModel):
+class _MediaMixin:
+    __slots__ = ()
+
+    @property
+    def urls(self):
+        """the copy of all url including backup"""
+        return [self.base_url, *self.backup_url] if self.backup_url else [self.base_url]
+
+
+class Media(_MediaMixin, BaseModel):
     base_url: str
     backup_url: Optional[List[str]] = None
     size: Optional[int] = None
@@ -225,62 +276,59 @@ class Media(BaseModel):
     codec: Optional[str] = None
     segment_base: Optional[dict] = None
 
-    @property
-    def urls(self):
-        """the copy of all url including backup"""
-        return [self.base_url, *self.backup_url] if self.backup_url else [self.base_url]
-
-
-class Dash(BaseModel):
-    duration: int
-    videos: List[Media]
-    audios: List[Media]
-    video_formats: Dict[str, Dict[str, Media]]
-    audio_formats: Dict[str, Optional[Media]]
-
     @classmethod
-    def from_dict(cls, play_info: dict):
-        dash = play_info['dash']  # may raise KeyError
-        video_formats = {}
-        quality_map = {}
-        for d in play_info['support_formats']:
-            quality_map[d['quality']] = d['new_description']
-            video_formats[d['new_description']] = {}
-        videos = []
-        for d in dash['video']:
-            if d['id'] not in quality_map:
-                continue  # https://github.com/HFrost0/bilix/issues/93
-            quality = quality_map[d['id']]
-            m = Media(quality=quality, codec=d['codecs'], **d)
-            video_formats[quality][m.codec] = m
-            videos.append(m)
-
-        audios = []
-        audio_formats = {}
-        if dash.get('audio', None):  # some video have NO audio
-            d = dash['audio'][0]
-            m = Media(quality="default", suffix='.aac', codec=d['codecs'], **d)
+    def from_trusted(cls, **data) -> 'Media':
+        """construct from already decoded api payload without pydantic validation (hot path)"""
+        return cls.model_construct(**data)
+
+
+def _parse_dash(play_info: dict, media_factory) -> dict:
+    """parse play info to the fields of Dash, media_factory is used to build each video/audio media"""
+    dash = play_info['dash']  # may raise KeyError
+    video_formats = {}
+    quality_map = {}
+    for d in play_info['support_formats']:
+        quality_map[d['quality']] = d['new_description']
+        video_formats[d['new_description']] = {}
+    videos = []
+    for d in dash['video']:
+        if d['id'] not in quality_map:
+            continue  # https://github.com/HFrost0/bilix/issues/93
+        quality = quality_map[d['id']]
+        m = media_factory(**d, quality=quality, codec=d['codecs'])
+        video_formats[quality][m.codec] = m
+        videos.append(m)
+
+    audios = []
+    audio_formats = {}
+    if dash.get('audio', None):  # some video have NO audio
+        d = dash['audio'][0]
+        m = media_factory(**d, quality="default", suffix='.aac', codec=d['codecs'])
+        audios.append(m)
+        audio_formats[m.quality] = m
+    if dash['dolby']['type'] != 0:
+        quality = "dolby"
+        audio_formats[quality] = None
+        if dash['dolby'].get('audio', None):
+            d = dash['dolby']['audio'][0]
+            m = media_factory(**d, quality=quality, suffix='.eac3', codec=d['codecs'])
+            audios.append(m)
+            audio_formats[m.quality] = m
+    if dash.get('flac', None):
+        quality = "flac"
+        audio_formats[quality] = None
+        if d := dash['flac']['audio']:
+            m = media_factory(**d, quality=quality, suffix='.flac', codec=d['codecs'])
             audios.append(m)
             audio_formats[m.quality] = m
-        if dash['dolby']['type'] != 0:
-            quality = "dolby"
-            audio_formats[quality] = None
-            if dash['dolby'].get('audio', None):
-                d = dash['dolby']['audio'][0]
-                m = Media(quality=quality, suffix='.eac3', codec=d['codecs'], **d)
-                audios.append(m)
-                audio_formats[m.quality] = m
-        if dash.get('flac', None):
-            quality = "flac"
-            audio_formats[quality] = None
-            if d := dash['flac']['audio']:
-                m = Media(quality=quality, suffix='.flac', codec=d['codecs'], **d)
-                audios.append(m)
-                audio_formats[m.quality] = m
-        return cls(duration=dash['duration'], videos=videos, audios=audios,
-                   video_formats=video_formats, audio_formats=audio_formats)
-
-    def choose_video(self, quality: Union[int, str], video_codec: str) -> Media:
+    return dict(duration=dash['duration'], videos=videos, audios=audios,
+                video_formats=video_formats, audio_formats=audio_formats)
+
+
+class _DashMixin:
+    __slots__ = ()
+
+    def choose_video(self, quality: Union[int, str], video_codec: str) -> 'Media':
         # 1. absolute choice with quality name like 4k 1080p '1080p 60帧'
         if isinstance(quality, str):
             for k in self.video_formats:
@@ -298,7 +346,7 @@ class Dash(BaseModel):
                     return self.video_formats[k][c]
         raise KeyError(f"no match for video quality: {quality} codec: {video_codec}")
 
-    def choose_audio(self, audio_codec: str) -> Optional[Media]:
+    def choose_audio(self, audio_codec: str) -> Optional['Media']:
         if len(self.audios) == 0:  # some video has no audio
             return
         for k in self.audio_formats:
@@ -306,12 +354,25 @@ class Dash(BaseModel):
                 return self.audio_formats[k]
         raise KeyError(f'no match for audio codec: {audio_codec}')
 
-    def choose_quality(self, quality: Union[str, int], codec: str = '') -> Tuple[Media, Optional[Media]]:
+    def choose_quality(self, quality: Union[str, int], codec: str = '') -> Tuple['Media', Optional['Media']]:
         v_codec, a_codec, *_ = codec.split(':') + [""]
         video, audio = self.choose_video(quality, v_codec), self.choose_audio(a_codec)
         return video, audio
 
 
+class Dash(_DashMixin, BaseModel):
+    duration: int
+    videos: List[Media]
+    audios: List[Media]
+    video_formats: Dict[str, Dict[str, Media]]
+    audio_formats: Dict[str, Optional[Media]]
+
+    @classmethod
+    def from_dict(cls, play_info: dict):
+        # all members are built from trusted api payload, skip re-validation of the nested Media
+        return cls.model_construct(**_parse_dash(play_info, Media.from_trusted))
+
+
 class Status(BaseModel):
     view: int = Field(description="播放量")
     danmaku: int = Field(description="弹幕数")
@@ -331,6 +392,8 @@ class Status(BaseModel):
 class Page(BaseModel):
     p_name: str
     p_url: str
+    cid: Optional[int] = None
+    bvid: Optional[str] = None
 
 
 class VideoInfo(BaseModel):
@@ -347,11 +410,83 @@ class VideoInfo(BaseModel):
     other: Optional[List[Media]] = None  # durl resource: flv, mp4.
     desc: Optional[str] = None
     tags: Optional[List[str]] = None
+    meta: Optional[dict] = None  # pubdate, ctime, duration, tname, owner, staff of the video, see META_KEYS
+
+
+# fields of view data kept in VideoInfo.meta for metadata (nfo) generation
+META_KEYS = ('pubdate', 'ctime', 'duration', 'tname', 'owner', 'staff')
+
+
+def _pick_meta(data: dict) -> dict:
+    return {k: data[k] for k in META_KEYS if k in data}
+
+
+class _Record:
+    """
+    slotted counterpart of a pydantic model used on the internal hot path, thousands of them may be queued at once.
+    fields are not validated and missing ones are None, use to_model to get the public pydantic model.
+    """
+    __slots__ = ()
+
+    def __init__(self, **data):
+        for name in self.__slots__:
+            setattr(self, name, data.get(name))
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class MediaRecord(_MediaMixin, _Record):
+    __slots__ = ('base_url', 'backup_url', 'size', 'width', 'height', 'suffix', 'quality', 'codec', 'segment_base')
+
+    def to_model(self) -> Media:
+        return Media.model_construct(**{name: getattr(self, name) for name in self.__slots__})
+
+
+class DashRecord(_DashMixin, _Record):
+    __slots__ = ('duration', 'videos', 'audios', 'video_formats', 'audio_formats')
 
+    @classmethod
+    def from_dict(cls, play_info: dict) -> 'DashRecord':
+        return cls(**_parse_dash(play_info, MediaRecord))
+
+    def to_model(self) -> Dash:
+        # keep the same Media object shared between videos/audios and formats
+        models = {id(m): m.to_model() for m in (*self.videos, *self.audios)}
+        return Dash.model_construct(
+            duration=self.duration,
+            videos=[models[id(m)] for m in self.videos],
+            audios=[models[id(m)] for m in self.audios],
+            video_formats={q: {c: models[id(m)] for c, m in d.items()} for q, d in self.video_formats.items()},
+            audio_formats={q: models[id(m)] if m else None for q, m in self.audio_formats.items()},
+        )
+
+
+class PageRecord(_Record):
+    __slots__ = ('p_name', 'p_url', 'cid', 'bvid')
+
+    def to_model(self) -> Page:
+        return Page.model_construct(p_name=self.p_name, p_url=self.p_url, cid=self.cid, bvid=self.bvid)
 
-def _parse_bv_html(url, html: str) -> VideoInfo:
+
+class VideoInfoRecord(_Record):
+    __slots__ = ('title', 'aid', 'cid', 'ep_id', 'p', 'pages', 'img_url', 'status', 'bvid', 'dash', 'other',
+                 'desc', 'tags', 'meta')
+
+    def to_model(self) -> VideoInfo:
+        return VideoInfo.model_construct(
+            title=self.title, aid=self.aid, cid=self.cid, ep_id=self.ep_id, p=self.p,
+            pages=[p.to_model() for p in self.pages], img_url=self.img_url, status=self.status, bvid=self.bvid,
+            dash=self.dash.to_model() if self.dash else None,
+            other=[m.to_model() for m in self.other] if self.other is not None else None,
+            desc=self.desc, tags=self.tags, meta=self.meta,
+        )
+
+
+def _parse_bv_html(url, html: str) -> VideoInfoRecord:
     init_info = re.search(r'<script>window.__INITIAL_STATE__=({.*});\(', html).groups()[0]  # this line may raise
-    init_info = json.loads(init_info)
+    init_info = loads(init_info)
     if len(init_info.get('error', {})) > 0:
         raise APIResourceError("视频已失效", url)  # 啊叻？视频不见了？在分区下载的时候可能产生
     # extract meta
@@ -369,19 +504,19 @@ def _parse_bv_html(url, html: str) -> VideoInfo:
     for idx, i in enumerate(init_info['videoData']['pages']):
         p_url = f"{base_url}?p={idx + 1}"
         p_name = f"P{idx + 1}-{i['part']}" if len(init_info['videoData']['pages']) > 1 else ''
-        pages.append(Page(p_name=p_name, p_url=p_url))
+        pages.append(PageRecord(p_name=p_name, p_url=p_url, cid=i.get('cid'), bvid=bvid))
     # extract dash and flv_url
     dash, other = None, []
     play_info = re.search('<script>window.__playinfo__=({.*})</script><script>', html).groups()[0]
-    play_info = json.loads(play_info)['data']
+    play_info = loads(play_info)['data']
     try:
-        dash = Dash.from_dict(play_info)
+        dash = DashRecord.from_dict(play_info)
     except KeyError:
         pass
     try:
         for i in play_info['durl']:
             suffix = re.search(r'\.([a-zA-Z0-9]+)\?', i['url']).group(1)
-            other.append(Media(base_url=i['url'], backup_url=i['backup_url'], suffix=suffix))
+            other.append(MediaRecord(base_url=i['url'], backup_url=i['backup_url'], suffix=suffix))
     except KeyError:
         pass
     # extract img url
@@ -389,15 +524,15 @@ def _parse_bv_html(url, html: str) -> VideoInfo:
     if not img_url.startswith('http'):  # https://github.com/HFrost0/bilix/issues/52 just for some video
         img_url = 'http:' + img_url.split('@')[0]
     # construct data
-    video_info = VideoInfo(title=title, aid=aid, cid=cid, status=status,
-                           p=p, pages=pages, img_url=img_url, bvid=bvid, dash=dash, other=other,
-                           desc=desc, tags=tags)
+    video_info = VideoInfoRecord(title=title, aid=aid, cid=cid, status=status,
+                                 p=p, pages=pages, img_url=img_url, bvid=bvid, dash=dash, other=other,
+                                 desc=desc, tags=tags, meta=_pick_meta(init_info['videoData']))
     return video_info
 
 
-def _parse_ep_html(url, html: str) -> VideoInfo:
+def _parse_ep_html(url, html: str) -> VideoInfoRecord:
     data = re.search(r'<script id="__NEXT_DATA__" type="application/json">({.*})</script>', html).groups()[0]
-    data = json.loads(data)
+    data = loads(data)
     queries = data['props']['pageProps']['dehydratedState']['queries']
     season_info = queries[0]['state']['data']['seasonInfo']
     media_info = season_info['mediaInfo']
@@ -418,17 +553,25 @@ def _parse_ep_html(url, html: str) -> VideoInfo:
             p = i
             aid, cid, bvid = ep["aid"], ep["cid"], ep["bvid"]
             img_url = ep["cover"]
-        pages.append(Page(p_name=legal_title(ep["playerEpTitle"]), p_url=ep["link"]))
-    video_info = VideoInfo(
+        pages.append(PageRecord(p_name=legal_title(ep["playerEpTitle"]), p_url=ep["link"],
+                                cid=ep.get("cid"), bvid=ep.get("bvid")))
+    video_info = VideoInfoRecord(
         title=title, status=status, desc=desc,
         aid=aid, cid=cid, bvid=bvid, p=p, pages=pages,
-        img_url=img_url, ep_id=ep_id,
+        img_url=img_url, ep_id=int(ep_id),
     )
     return video_info
 
 
 @raise_api_error
 async def get_video_info(client: httpx.AsyncClient, url: str) -> VideoInfo:
+    return (await get_video_record(client, url)).to_model()
+
+
+@metrics.timed('info')
+@raise_api_error
+async def get_video_record(client: httpx.AsyncClient, url: str) -> VideoInfoRecord:
+    """same as get_video_info but return the slotted record used on the internal hot path"""
     print(f"get_vedio_info:{url}")
     try:
         # try to get video info from web front-end first
@@ -438,12 +581,13 @@ async def get_video_info(client: httpx.AsyncClient, url: str) -> VideoInfo:
         return await _get_video_info_from_api(client, url)
 
 
-async def _get_video_info_from_html(client: httpx.AsyncClient, url: str) -> VideoInfo:
+async def _get_video_info_from_html(client: httpx.AsyncClient, url: str) -> VideoInfoRecord:
     res = await req_retry(client, url, follow_redirects=True)
     if str(res.url).startswith("https://www.bilibili.com/festival"):
         raise APIInvalidError("特殊节日页面", url)
     html = res.text
     if "window._riskdata_" in html:
+        limiter.trip('page', reason='web 前端')
         raise APIInvalidError("web 前端访问被风控", url)
     if "window.__INITIAL_STATE__" in html:
         return _parse_bv_html(url, html)
@@ -455,7 +599,7 @@ async def _get_video_info_from_html(client: httpx.AsyncClient, url: str) -> Vide
         raise APIUnsupportedError("未知页面类型", url)
 
 
-async def _get_video_info_from_api(client: httpx.AsyncClient, url: str) -> VideoInfo:
+async def _get_video_info_from_api(client: httpx.AsyncClient, url: str) -> VideoInfoRecord:
     assert '/av' in url or '/BV' in url  # TODO: only support BV or av url
     video_info = await _get_video_basic_info_from_api(client, url)
     # can not be parallelized since we need to get cid first
@@ -463,7 +607,8 @@ async def _get_video_info_from_api(client: httpx.AsyncClient, url: str) -> Video
     return video_info
 
 
-async def _attach_ep_dash(client: httpx.AsyncClient, video_info: VideoInfo):
+@metrics.timed('playurl')
+async def _attach_ep_dash(client: httpx.AsyncClient, video_info: VideoInfoRecord):
     params = {
         'support_multi_audio': True,
         'avid': video_info.aid,
@@ -474,19 +619,20 @@ async def _attach_ep_dash(client: httpx.AsyncClient, video_info: VideoInfo):
         'ep_id': video_info.ep_id,
     }
     res = await req_retry(client, 'https://api.bilibili.com/pgc/player/web/v2/playurl', params=params)
-    res = json.loads(res.text)
+    res = loads(res.content)
     data = res['result']['video_info']
     if "dash" in data:
-        video_info.dash = Dash.from_dict(data)
+        video_info.dash = DashRecord.from_dict(data)
     if "durl" in data:
         other = []
         for i in data['durl']:
             suffix = re.search(r'\.([a-zA-Z0-9]+)\?', i['url']).group(1)
-            other.append(Media(base_url=i['url'], backup_url=i['backup_url'], size=i['size'], suffix=suffix))
+            other.append(MediaRecord(base_url=i['url'], backup_url=i['backup_url'], size=i['size'], suffix=suffix))
         video_info.other = other
 
 
-async def _attach_dash_and_durl_from_api(client: httpx.AsyncClient, video_info: VideoInfo):
+@metrics.timed('playurl')
+async def _attach_dash_and_durl_from_api(client: httpx.AsyncClient, video_info: VideoInfoRecord):
     params = {'cid': video_info.cid, 'bvid': video_info.bvid,
               'qn': 120,  # 如无 dash 资源（少数老视频），fallback 到 4K 超清 durl
               'fnval': 4048,  # 如 dash 资源可用，请求 dash 格式的全部可用流
@@ -494,26 +640,26 @@ async def _attach_dash_and_durl_from_api(client: httpx.AsyncClient, video_info:
               'fnver': 0, 'platform': 'pc', 'otype': 'json'}
     dash_response = await req_retry(client, 'https://api.bilibili.com/x/player/playurl',
                                     params=params, follow_redirects=True)
-    dash_json = json.loads(dash_response.text)
+    dash_json = loads(dash_response.content)
     if dash_json['code'] != 0:
         raise APIResourceError(dash_json['message'], video_info.bvid)
     dash, other = None, []
     if 'dash' in dash_json['data']:
-        dash = Dash.from_dict(dash_json['data'])
+        dash = DashRecord.from_dict(dash_json['data'])
     if 'durl' in dash_json['data']:
         for i in dash_json['data']['durl']:
             suffix = re.search(r'\.([a-zA-Z0-9]+)\?', i['url']).group(1)
-            other.append(Media(base_url=i['url'], backup_url=i['backup_url'], size=i['size'], suffix=suffix))
+            other.append(MediaRecord(base_url=i['url'], backup_url=i['backup_url'], size=i['size'], suffix=suffix))
     video_info.dash, video_info.other = dash, other
 
 
-async def _get_video_basic_info_from_api(client: httpx.AsyncClient, url) -> VideoInfo:
+async def _get_video_basic_info_from_api(client: httpx.AsyncClient, url) -> VideoInfoRecord:
     """通过 view api 获取视频的基本信息，不包括 dash 或 durl(other) 视频流资源"""
     aid, bvid, selected_page_num = parse_ids_from_url(url)
     params = {'bvid': bvid} if bvid else {'aid': aid}
     r = await req_retry(client, 'https://api.bilibili.com/x/web-interface/view',
                         params=params, follow_redirects=True)
-    raw_json = json.loads(r.text)
+    raw_json = loads(r.content)
     if raw_json['code'] != 0:
         raise APIResourceError(raw_json['message'], raw_json['message'])
     title = legal_title(raw_json['data']['title'])
@@ -532,36 +678,60 @@ async def _get_video_basic_info_from_api(client: httpx.AsyncClient, url) -> Vide
             cid = int(i['cid'])  # selected_page_num 的分p 的 cid
         p_url = f"{base_url}?p={page_num}"
         p_name = f"P{page_num}-{i['part']}"
-        pages.append(Page(p_name=p_name, p_url=p_url))
+        pages.append(PageRecord(p_name=p_name, p_url=p_url, cid=int(i['cid']), bvid=bvid))
     assert p is not None, f"没有找到分P: p{selected_page_num}，请检查输入"  # cid 也会是 None
     img_url = raw_json['data']['pic']
-    basic_video_info = VideoInfo(title=title, h1_title=h1_title, aid=aid, cid=cid, status=status,
-                                 p=p, pages=pages, img_url=img_url, bvid=bvid, dash=None, other=None)
+    basic_video_info = VideoInfoRecord(title=title, aid=aid, cid=cid, status=status,
+                                       p=p, pages=pages, img_url=img_url, bvid=bvid, dash=None, other=None,
+                                       meta=_pick_meta(raw_json['data']))
     return basic_video_info
 
-async def _get_video_info_from_api(client: httpx.AsyncClient, url) -> VideoInfo:
-    """通过 view api 获取视频的基本信息，不包括 dash 或 durl(other) 视频流资源"""
+async def _get_view_json(client: httpx.AsyncClient, url) -> dict:
+    """view api 的原始json，包括 up主、标签等 meta 信息"""
     aid, bvid, selected_page_num = parse_ids_from_url(url)
     params = {'bvid': bvid} if bvid else {'aid': aid}
     r = await req_retry(client, 'https://api.bilibili.com/x/web-interface/view',
                         params=params, follow_redirects=True)
-    raw_json = json.loads(r.text)
+    raw_json = loads(r.content)
     return raw_json
 
 @raise_api_error
 async def get_subtitle_info(client: httpx.AsyncClient, bvid, cid):
     params = {'bvid': bvid, 'cid': cid}
     res = await req_retry(client, 'https://api.bilibili.com/x/player/v2', params=params)
-    info = json.loads(res.text)
+    info = loads(res.content)
     if info['code'] == -400:
-        raise APIError(f'未找到字幕信息', params)
+        raise APIResourceError(f'未找到字幕信息', params)
     return [[f'http:{i["subtitle_url"]}', i['lan_doc']] for i in info['data']['subtitle']['subtitles']]
 
 
 @raise_api_error
 async def get_dm_urls(client: httpx.AsyncClient, aid, cid) -> List[str]:
+    from danmakuC.bilibili import parse_view
     params = {'oid': cid, 'pid': aid, 'type': 1}
     res = await req_retry(client, f'https://api.bilibili.com/x/v2/dm/web/view', params=params)
     view = parse_view(res.content)
     total = int(view['dmSge']['total'])
     return [f'https://api.bilibili.com/x/v2/dm/web/seg.so?oid={cid}&type=1&segment_index={i + 1}' for i in range(total)]
+
+
+async def iter_dm_segments(client: httpx.AsyncClient, dm_urls: List[str], concurrency: int = 4):
+    """
+    fetch danmaku segments with at most concurrency requests in flight, yield content in segment order
+
+    :param client:
+    :param dm_urls: urls from get_dm_urls
+    :param concurrency: max concurrent requests
+    :return: async generator of protobuf bytes
+    """
+    urls = iter(dm_urls)
+    tasks = deque(asyncio.ensure_future(req_retry(client, u)) for u in islice(urls, concurrency))
+    try:
+        while tasks:
+            res = await tasks.popleft()
+            if (u := next(urls, None)) is not None:
+                tasks.append(asyncio.ensure_future(req_retry(client, u)))
+            yield res.content
+    finally:
+        for t in tasks:
+            t.cancel()
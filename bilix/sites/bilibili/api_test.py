@@ -67,6 +67,30 @@ async def test_get_up_video_info():
 
 
 # GitHub actions problem...
+@pytest.mark.asyncio
+async def test_get_up_video_info_risk_control(monkeypatch):
+    from bilix.download.ratelimit import RateLimiter
+    codes = [-352, -352, 0]
+
+    def handler(request: httpx.Request):
+        code = codes.pop(0)
+        vlist = [{'author': 'up', 'bvid': 'BV1', 'title': 'a'}]
+        return httpx.Response(200, json={'code': code, 'data': {'list': {'vlist': vlist}, 'page': {'count': 1}}})
+
+    async def add_sign(client, params):
+        return params
+
+    monkeypatch.setattr(api, '_add_sign', add_sign)
+    monkeypatch.setattr(api, 'limiter', RateLimiter({'space': (1000., 10)}, api._family, cooldown=.01,
+                                                     max_cooldown=.05))
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    # the request is sent again after the cool-down
+    assert await api.get_up_video_info(mock_client, '1') == ('up', 1, ['BV1'], ['a'])
+    codes.extend([-352] * (1 + api.SPACE_RETRY))
+    with pytest.raises(api.APIInvalidError):
+        await api.get_up_video_info(mock_client, '1')
+
+
 # @pytest.mark.asyncio
 # async.md def test_get_special_audio():
 #     # Dolby
@@ -114,6 +138,27 @@ async def test_get_video_info():
         assert data.status.follow
 
 
+@pytest.mark.asyncio
+async def test_get_video_record_fallback(monkeypatch):
+    record = api.VideoInfoRecord(title='title', bvid='BV1xx', p=0, pages=[api.PageRecord(p_name='', p_url='')])
+
+    async def banned(client, url):
+        raise api.APIInvalidError("web 前端访问被风控", url)
+
+    async def basic_info(client, url):
+        return record
+
+    async def attach(client, video_info):
+        pass
+
+    monkeypatch.setattr(api, '_get_video_info_from_html', banned)
+    monkeypatch.setattr(api, '_get_video_basic_info_from_api', basic_info)
+    monkeypatch.setattr(api, '_attach_dash_and_durl_from_api', attach)
+    # web front-end banned, the api fallback still gives a record
+    assert await api.get_video_record(client, 'https://www.bilibili.com/video/BV1xx') is record
+    assert (await api.get_video_info(client, 'https://www.bilibili.com/video/BV1xx')).bvid == 'BV1xx'
+
+
 @pytest.mark.asyncio
 async def test_get_subtitle_info():
     data = await api.get_video_info(client, "https://www.bilibili.com/video/BV1hS4y1m7Ma")
@@ -128,3 +173,44 @@ async def test_get_dm_info():
                                     "https://www.bilibili.com/bangumi/play/ss33343?theme=movie&spm_id_from=333.337.0.0")
     data = await api.get_dm_urls(client, data.aid, data.cid)
     assert len(data) > 0
+
+
+def test_dash_record_to_model():
+    play_info = {
+        'support_formats': [{'quality': 80, 'new_description': '1080P 高清'},
+                            {'quality': 64, 'new_description': '720P 准高清'}],
+        'dash': {
+            'duration': 10,
+            'video': [{'id': 80, 'codecs': 'avc1.640032', 'base_url': 'v1', 'backup_url': ['v1b'], 'width': 1920},
+                      {'id': 64, 'codecs': 'hev1.1.6.L120.90', 'base_url': 'v2', 'backup_url': None, 'width': 1280}],
+            'audio': [{'id': 30280, 'codecs': 'mp4a.40.2', 'base_url': 'a1', 'backup_url': None}],
+            'dolby': {'type': 0},
+        }
+    }
+    record = api.DashRecord.from_dict(play_info)
+    video, audio = record.choose_quality('720P', codec='hev')
+    assert video.urls == ['v2'] and audio.suffix == '.aac'
+    dash = record.to_model()
+    assert dash.model_dump() == api.Dash.from_dict(play_info).model_dump()
+    assert dash.video_formats['1080P 高清']['avc1.640032'] is dash.videos[0]
+    assert dash.choose_quality(0)[0].urls == ['v1', 'v1b']
+
+
+@pytest.mark.asyncio
+async def test_iter_dm_segments():
+    in_flight, peak = 0, 0
+
+    async def handler(request: httpx.Request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        i = int(request.url.params['segment_index'])
+        await asyncio.sleep(0.01 * (5 - i % 5))  # later segments arrive first
+        in_flight -= 1
+        return httpx.Response(200, content=str(i).encode())
+
+    urls = [f'https://api.bilibili.com/x/v2/dm/web/seg.so?segment_index={i}' for i in range(10)]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as c:
+        res = [content async for content in api.iter_dm_segments(c, urls, concurrency=3)]
+    assert res == [str(i).encode() for i in range(10)]
+    assert peak <= 3
@@ -0,0 +1,398 @@
+"""
+bilibili danmaku: compact columnar storage of parsed segments, ass conversion in a process pool with
+bounded queue and batching, and an on-disk segment store for incremental update
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Iterator, Union, NamedTuple, Sequence
+
+import aiofiles
+
+from bilix._json import loads
+from bilix._process import _init
+from bilix.log import logger
+
+__all__ = ['DanmakuBuffer', 'buffer2ass', 'AssLayout', 'ass_layout', 'DanmakuConverter', 'DanmakuStore']
+
+# bilibili danmaku mode -> danmakuC ass mode, mode > 8 (code or bas danmaku) is not supported
+MODE_MAP = {1: 0, 4: 2, 5: 1, 6: 3, 7: 4}
+# Ass and BiliCommentProto are not public api of danmakuC, keep in sync with the range pinned in pyproject.toml
+DANMAKUC_REQUIREMENT = "danmakuC>=0.3.5,<0.4"
+
+
+def _danmakuc():
+    """danmakuC internals used by the buffer, with a clear error when they moved"""
+    try:
+        from danmakuC.ass import Ass
+        from danmakuC.protobuf.bilibili import BiliCommentProto
+    except ImportError as e:
+        raise ImportError(f"{e}, bilix requires {DANMAKUC_REQUIREMENT}") from e
+    return Ass, BiliCommentProto
+
+
+class DanmakuBuffer:
+    """
+    columnar storage of danmaku, each field is kept in a typed array and all texts in one utf-8 buffer,
+    so parsed segments take a fraction of the memory of protobuf messages or raw bytes
+    """
+    __slots__ = ('progress', 'ctime', 'fontsize', 'color', 'mode', 'offsets', 'text')
+    # column name, array typecode, in serialization order
+    _columns = (('progress', 'i'), ('ctime', 'q'), ('fontsize', 'i'), ('color', 'I'), ('mode', 'b'))
+    _header = struct.Struct('<QQ')  # comment count, text size
+
+    def __init__(self):
+        for name, typecode in self._columns:
+            setattr(self, name, array(typecode))
+        self.offsets = array('Q', [0])  # text of comment i is text[offsets[i]:offsets[i + 1]]
+        self.text = bytearray()
+
+    def __len__(self):
+        return len(self.progress)
+
+    def add_segment(self, content: bytes) -> int:
+        """parse a protobuf segment (seg.so response) and append its comments, return number of comments added"""
+        _, BiliCommentProto = _danmakuc()
+        target = BiliCommentProto()
+        target.ParseFromString(content)
+        n = 0
+        for elem in target.elems:
+            mode = MODE_MAP.get(elem.mode)
+            if mode is None:
+                continue
+            self.progress.append(elem.progress)
+            self.ctime.append(elem.ctime)
+            self.fontsize.append(elem.fontsize)
+            self.color.append(elem.color)
+            self.mode.append(mode)
+            self.text += elem.content.encode('utf-8')
+            self.offsets.append(len(self.text))
+            n += 1
+        return n
+
+    def __iter__(self) -> Iterator[Tuple[float, int, str, int, int, int]]:
+        """yield (progress in seconds, ctime, content, fontsize, mode, color) like Ass.add_comment arguments"""
+        text, offsets = self.text, self.offsets
+        for i in range(len(self)):
+            yield (self.progress[i] / 1000, self.ctime[i], text[offsets[i]:offsets[i + 1]].decode('utf-8'),
+                   self.fontsize[i], self.mode[i], self.color[i])
+
+    def to_bytes(self) -> bytes:
+        parts = [self._header.pack(len(self), len(self.text))]
+        parts.extend(getattr(self, name).tobytes() for name, _ in self._columns)
+        parts.append(self.offsets.tobytes())
+        parts.append(bytes(self.text))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DanmakuBuffer':
+        buffer = cls()
+        n, text_size = cls._header.unpack_from(data)
+        view, pos = memoryview(data), cls._header.size
+        del buffer.offsets[:]
+        for column, length in [(getattr(buffer, name), n) for name, _ in cls._columns] + [(buffer.offsets, n + 1)]:
+            size = length * column.itemsize
+            column.frombytes(view[pos:pos + size])
+            pos += size
+        buffer.text = bytearray(view[pos:pos + text_size])
+        return buffer
+
+
+def buffer2ass(
+        buffer: DanmakuBuffer,
+        width: int,
+        height: int,
+        reserve_blank: int = 0,
+        font_face: str = "sans-serif",
+        font_size: float = 25.0,
+        alpha: float = 1.0,
+        duration_marquee: float = 5.0,
+        duration_still: float = 5.0,
+        comment_filter: str = "",
+        reduced: bool = False,
+) -> str:
+    """render danmaku to ass text in one pass, arguments are the same as danmakuC.bilibili.proto2ass"""
+    Ass, _ = _danmakuc()
+    try:  # the extension takes positional arguments only
+        ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
+                  duration_still, comment_filter, reduced)
+    except TypeError as e:
+        raise TypeError(f"{e}, bilix requires {DANMAKUC_REQUIREMENT}") from e
+    for comment in buffer:
+        try:
+            ass.add_comment(*comment)
+        except TypeError:  # incase integer overflow https://github.com/HFrost0/bilix/issues/102
+            continue
+    return ass.to_string()
+
+
+class AssLayout(NamedTuple):
+    """rendering parameters of one ass output"""
+    width: int
+    height: int
+    font_size: float
+    alpha: float
+
+
+@functools.lru_cache(maxsize=64)
+def ass_layout(width: int, height: int, font_size: float = None, alpha: float = 0.5) -> AssLayout:
+    """layout for a video resolution, font size default to width / 50"""
+    return AssLayout(width, height, font_size or width / 50, alpha)
+
+
+DEFAULT_LAYOUT = ass_layout(1920, 1080)
+
+# (src path, [(dst path, layout), ...]), one parsed danmaku rendered to several layouts
+_Job = Tuple[str, List[Tuple[str, AssLayout]]]
+
+
+def _convert_batch(jobs: List[_Job]) -> List[Optional[str]]:
+    """run in worker process, read serialized DanmakuBuffer from src path and write ass of each layout, return error message if any"""
+    errors = []
+    for src, targets in jobs:
+        try:
+            with open(src, 'rb') as f:
+                buffer = DanmakuBuffer.from_bytes(f.read())
+            for dst, layout in targets:
+                content = buffer2ass(buffer, layout.width, layout.height, font_size=layout.font_size, alpha=layout.alpha)
+                with open(dst, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            errors.append(None)
+        except Exception as e:  # report per job, one bad video should not fail the whole batch
+            errors.append(f"{e.__class__.__name__}: {e}")
+    return errors
+
+
+class DanmakuConverter:
+    """
+    convert danmaku in a process pool. Submission blocks when max_pending jobs are waiting, small jobs are batched
+    into one worker call, and danmaku/ass content is handed over by file path instead of pickling bytes.
+    Several layouts of the same danmaku are rendered from one parse, and recent results are cached by content and layout.
+    """
+
+    def __init__(
+            self,
+            max_workers: int = None,
+            max_pending: int = 32,
+            batch_size: int = 8,
+            batch_bytes: int = 1024 * 1024,
+            tmp_dir: Path = None,
+            cache_bytes: int = 64 * 1024 * 1024,
+    ):
+        """
+
+        :param max_workers: worker process number, default to os.cpu_count()
+        :param max_pending: max jobs waiting for a worker, producer will wait when exceeded
+        :param batch_size: max jobs sent to a worker in one call
+        :param batch_bytes: only jobs smaller than this are batched, and a batch stays under this size in total
+        :param tmp_dir: where to place handoff files, default to system temp dir
+        :param cache_bytes: max total size of rendered ass kept in memory
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self._tmp_root = tmp_dir
+        self._tmp_dir: Optional[Path] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dispatchers: List[asyncio.Task] = []
+        self._closed = False
+        self.cache_bytes = cache_bytes
+        self._cache_size = 0
+        self._cache: OrderedDict[Tuple[str, AssLayout], bytes] = OrderedDict()
+
+    def _start(self):
+        if self._closed:
+            raise RuntimeError("DanmakuConverter is closed")
+        self._tmp_dir = Path(tempfile.mkdtemp(prefix='bilix-dm-', dir=self._tmp_root))
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init)
+        # one dispatcher per worker, so the executor never holds more batches than workers
+        self._dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.max_workers)]
+
+    async def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        carry, batch = None, []
+        try:
+            while True:
+                batch = [carry or await self._queue.get()]
+                carry, total = None, batch[0][1]
+                # batch small jobs that are already waiting, a job that does not fit starts the next batch
+                while len(batch) < self.batch_size and total < self.batch_bytes and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if total + item[1] > self.batch_bytes:
+                        carry = item
+                        break
+                    batch.append(item)
+                    total += item[1]
+                try:
+                    errors = await loop.run_in_executor(self._executor, _convert_batch, [i[0] for i in batch])
+                except Exception as e:  # e.g. BrokenProcessPool or a job that can not be pickled, only this batch fails
+                    errors = [f"{e.__class__.__name__}: {e}"] * len(batch)
+                for (_, _, fut), error in zip(batch, errors):
+                    if fut.done():
+                        continue
+                    if error:
+                        fut.set_exception(RuntimeError(f"danmaku convert failed {error}"))
+                    else:
+                        fut.set_result(None)
+                batch = []
+        finally:
+            for _, _, fut in [*batch, *([carry] if carry else [])]:
+                fut.cancel()
+
+    async def convert_file(self, src: Path, targets: Sequence[Tuple[Path, AssLayout]]):
+        """convert serialized DanmakuBuffer file src to ass file of each (dst, layout) in targets"""
+        if self._queue is None:
+            self._start()
+        fut = asyncio.get_event_loop().create_future()
+        job = (str(src), [(str(dst), layout) for dst, layout in targets])
+        await self._queue.put((job, os.path.getsize(src), fut))
+        await fut
+
+    async def render(self, buffer: DanmakuBuffer, layouts: Sequence[AssLayout]) -> List[bytes]:
+        """convert danmaku to ass bytes of each layout, content is handed over to worker by temporary file"""
+        if self._queue is None:
+            self._start()
+        data = buffer.to_bytes()
+        digest = hashlib.sha1(data).hexdigest()
+        res = {layout: self._cache.get((digest, layout)) for layout in layouts}
+        missing = [layout for layout, content in res.items() if content is None]
+        if missing:
+            name = uuid.uuid4().hex
+            src = self._tmp_dir / f"{name}.dm"
+            targets = [(self._tmp_dir / f"{name}-{i}.ass", layout) for i, layout in enumerate(missing)]
+            try:
+                async with aiofiles.open(src, 'wb') as f:
+                    await f.write(data)
+                del data
+                await self.convert_file(src, targets)
+                for dst, layout in targets:
+                    async with aiofiles.open(dst, 'rb') as f:
+                        res[layout] = await f.read()
+            finally:
+                for p in (src, *(t[0] for t in targets)):
+                    if p.exists():
+                        os.remove(p)
+        for layout, content in res.items():
+            self._cache_put((digest, layout), content)
+        return [res[layout] for layout in layouts]
+
+    def _cache_put(self, key: Tuple[str, AssLayout], content: bytes):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return
+        if len(content) > self.cache_bytes:
+            return
+        self._cache[key] = content
+        self._cache_size += len(content)
+        while self._cache_size > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= len(evicted)
+
+    async def convert(self, buffer: DanmakuBuffer, width: int, height: int,
+                      font_size: float = None, alpha: float = 0.5) -> bytes:
+        """convert danmaku to ass bytes for a video resolution"""
+        return (await self.render(buffer, [ass_layout(width, height, font_size, alpha)]))[0]
+
+    async def aclose(self):
+        """cancel pending jobs, stop worker processes and remove temporary files"""
+        self._closed = True
+        if self._queue is None:
+            return
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, fut = self._queue.get_nowait()
+            fut.cancel()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        logger.debug("danmaku converter closed")
+        self._queue = None
+        self._cache.clear()
+        self._cache_size = 0
+
+
+class DanmakuStore:
+    """
+    keep raw protobuf segments of each video on disk with their fetch time and content hash. A refresh only
+    fetches missing, tail and outdated segments, and the ass file is re-rendered only when the merged content changed.
+
+    layout: root/<cid>/index.json, root/<cid>/<segment index>.pb
+    """
+
+    def __init__(self, root: Union[str, Path], tail: int = 1, max_age: float = 30 * 86400):
+        """
+
+        :param root: store directory
+        :param tail: number of last segments always re-fetched when refresh, new danmaku mostly arrives there
+        :param max_age: seconds after which a stored segment is considered outdated and re-fetched
+        """
+        self.root = Path(root)
+        self.tail = tail
+        self.max_age = max_age
+
+    def _dir(self, cid) -> Path:
+        return self.root / str(cid)
+
+    async def load_index(self, cid) -> dict:
+        try:
+            async with aiofiles.open(self._dir(cid) / 'index.json', 'rb') as f:
+                return loads(await f.read())
+        except (OSError, ValueError):
+            return {'segments': {}, 'rendered': {}}
+
+    async def save_index(self, cid, index: dict):
+        path = self._dir(cid) / 'index.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"index.json.{os.getpid()}")
+        async with aiofiles.open(tmp, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(index, ensure_ascii=False))
+        os.replace(tmp, path)
+
+    def outdated(self, index: dict, total: int) -> List[int]:
+        """segments (0-based) that need to be fetched"""
+        deadline = time.time() - self.max_age
+        res = []
+        for i in range(total):
+            seg = index['segments'].get(str(i))
+            if seg is None or i >= total - self.tail or seg['time'] < deadline:
+                res.append(i)
+        return res
+
+    async def put(self, cid, index: dict, i: int, content: bytes) -> bool:
+        """save segment content, return True if it changed"""
+        digest = hashlib.sha1(content).hexdigest()
+        seg = index['segments'].get(str(i))
+        path = self._dir(cid) / f"{i}.pb"
+        changed = seg is None or seg['hash'] != digest
+        if changed or not path.exists():  # removed by hand, the index alone is not enough
+            path.parent.mkdir(parents=True, exist_ok=True)
+            async with aiofiles.open(path, 'wb') as f:
+                await f.write(content)
+        index['segments'][str(i)] = {'hash': digest, 'time': time.time()}
+        return changed
+
+    @staticmethod
+    def digest(index: dict, total: int) -> str:
+        """hash of the merged danmaku of first total segments"""
+        return hashlib.sha1(''.join(index['segments'][str(i)]['hash'] for i in range(total)).encode()).hexdigest()
+
+    async def iter_segments(self, cid, total: int):
+        for i in range(total):
+            async with aiofiles.open(self._dir(cid) / f"{i}.pb", 'rb') as f:
+                yield await f.read()
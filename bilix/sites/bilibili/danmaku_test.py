@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from danmakuC.bilibili import proto2ass
+from danmakuC.protobuf.bilibili import BiliCommentProto
+from bilix.sites.bilibili.danmaku import DanmakuBuffer, DanmakuConverter, DanmakuStore, buffer2ass, ass_layout
+
+
+def make_segment(start: int, n: int) -> bytes:
+    target = BiliCommentProto()
+    for i in range(start, start + n):
+        target.elems.add(progress=i * 1000, mode=[1, 4, 5, 9][i % 4], fontsize=25, color=0xffffff,
+                         content=f"弹幕{i}", ctime=1600000000 + i)
+    return target.SerializeToString()
+
+
+def test_buffer():
+    segments = [make_segment(0, 20), make_segment(20, 20)]
+    buffer = DanmakuBuffer()
+    assert sum(buffer.add_segment(s) for s in segments) == len(buffer) == 30  # mode 9 is dropped
+    assert next(iter(buffer)) == (0., 1600000000, "弹幕0", 25, 0, 0xffffff)
+    restored = DanmakuBuffer.from_bytes(buffer.to_bytes())
+    assert list(restored) == list(buffer)
+    assert buffer2ass(restored, 1920, 1080) == proto2ass(b''.join(segments), 1920, 1080)
+
+
+@pytest.mark.asyncio
+async def test_convert():
+    buffer = DanmakuBuffer()
+    buffer.add_segment(make_segment(0, 10))
+    converter = DanmakuConverter(max_workers=2, max_pending=4, batch_size=3)
+    try:
+        res = await asyncio.gather(*[converter.convert(buffer, 1920, 1080) for _ in range(8)])
+        assert all(r.startswith(b'[Script Info]') and '弹幕1'.encode() in r for r in res)
+        tmp_dir = converter._tmp_dir
+        assert not list(tmp_dir.iterdir())
+    finally:
+        await converter.aclose()
+    assert not tmp_dir.exists()
+    assert not converter._cache
+    with pytest.raises(RuntimeError):
+        await converter.convert(buffer, 1920, 1080)
+
+
+@pytest.mark.asyncio
+async def test_convert_error(tmp_path):
+    buffer = DanmakuBuffer()
+    buffer.add_segment(make_segment(0, 10))
+    src = tmp_path / 'a.dm'
+    src.write_bytes(buffer.to_bytes())
+    converter = DanmakuConverter(max_workers=1)
+    try:
+        with pytest.raises(RuntimeError):  # layout can not be pickled
+            await converter.convert_file(src, [(tmp_path / 'a.ass', lambda: None)])
+        # the dispatcher is still alive
+        await asyncio.wait_for(converter.convert_file(src, [(tmp_path / 'b.ass', ass_layout(1920, 1080))]), 10)
+        assert (tmp_path / 'b.ass').read_bytes().startswith(b'[Script Info]')
+    finally:
+        await converter.aclose()
+
+
+@pytest.mark.asyncio
+async def test_store(tmp_path):
+    store = DanmakuStore(tmp_path, tail=1, max_age=3600)
+    index = await store.load_index(1)
+    assert store.outdated(index, 3) == [0, 1, 2]
+    for i in range(3):
+        assert await store.put(1, index, i, make_segment(i * 10, 10))
+    digest = store.digest(index, 3)
+    await store.save_index(1, index)
+
+    index = await store.load_index(1)
+    assert store.outdated(index, 3) == [2]
+    assert not await store.put(1, index, 2, make_segment(20, 10))
+    assert store.digest(index, 3) == digest
+    assert await store.put(1, index, 2, make_segment(20, 11))
+    assert store.digest(index, 3) != digest
+    index['segments']['0']['time'] -= 7200
+    assert store.outdated(index, 4) == [0, 3]
+    assert [s async for s in store.iter_segments(1, 3)] == [make_segment(0, 10), make_segment(10, 10),
+                                                            make_segment(20, 11)]
+    # segment file removed, written again although the hash is known
+    (tmp_path / '1' / '1.pb').unlink()
+    assert not await store.put(1, index, 1, make_segment(10, 10))
+    assert (tmp_path / '1' / '1.pb').read_bytes() == make_segment(10, 10)
+    # index of a video without any segment written
+    await store.save_index(2, {'segments': {}, 'rendered': {}})
+    assert await store.load_index(2) == {'segments': {}, 'rendered': {}}
+
+
+@pytest.mark.asyncio
+async def test_render_layouts():
+    buffer = DanmakuBuffer()
+    buffer.add_segment(make_segment(0, 10))
+    layouts = [ass_layout(1920, 1080), ass_layout(3840, 2160)]
+    assert ass_layout(1920, 1080) is layouts[0]
+    converter = DanmakuConverter(max_workers=1)
+    try:
+        res = await converter.render(buffer, layouts)
+        assert res[0] == buffer2ass(buffer, 1920, 1080, font_size=1920 / 50, alpha=0.5).encode()
+        assert b'PlayResX: 3840' in res[1]
+        assert len(converter._cache) == 2
+        assert await converter.convert(buffer, 3840, 2160) is res[1]  # cached
+    finally:
+        await converter.aclose()
@@ -1,26 +1,36 @@
 import asyncio
-import functools
+import inspect
+import os
 import re
-import xml.etree.ElementTree as ET
 from datetime import datetime
 from pathlib import Path
-from typing import Union, Sequence, Tuple, List
+from typing import Union, Sequence, Tuple, List, Dict, Optional, Awaitable
 import aiofiles
 import httpx
 from datetime import datetime, timedelta
 from . import api
 from bilix.download.base_downloader_part import BaseDownloaderPart
-from bilix._process import SingletonPPE
-from bilix.utils import legal_title, cors_slice, valid_sess_data, t2s, json2srt
-from bilix.download.utils import req_retry, path_check
+from .subtitle import SubtitleManager
+from .nfo import build_nfo, people_of, PeopleIndex
+from .danmaku import DanmakuConverter, DanmakuBuffer, DanmakuStore, AssLayout, ass_layout, DEFAULT_LAYOUT
+from bilix.utils import legal_title, legal_name, cors_slice, valid_sess_data, t2s, json2srt
+from bilix.download.fs import BatchWriter, afs
+from bilix.download.asset_cache import AssetCache
 from bilix.exception import HandleMethodError, APIUnsupportedError, APIResourceError, APIError
-from bilix.cli.assign import kwargs_filter, auto_assemble
+from bilix.cli.assign import auto_assemble
 from bilix import ffmpeg
+from bilix import metrics
 import re
 import sqlite3 as sql
 
 
-from danmakuC.bilibili import proto2ass
+def _takes_buffer(convert_func) -> bool:
+    """danmaku converters annotated with DanmakuBuffer get the parsed buffer, others the raw protobuf bytes"""
+    try:
+        params = list(inspect.signature(convert_func).parameters.values())
+    except (TypeError, ValueError):
+        return False
+    return bool(params) and params[0].annotation in (DanmakuBuffer, 'DanmakuBuffer')
 
 
 class DownloaderBilibili(BaseDownloaderPart):
@@ -41,6 +51,9 @@ class DownloaderBilibili(BaseDownloaderPart):
             sess_data: str = None,
             video_concurrency: Union[int, asyncio.Semaphore] = 3,
             hierarchy: bool = True,
+            dm_workers: int = None,
+            dm_store: Union[str, Path, None] = None,
+            asset_cache: Union[str, Path, bool] = False,
     ):
         """
 
@@ -54,6 +67,9 @@ class DownloaderBilibili(BaseDownloaderPart):
         :param part_concurrency: 媒体分段并发数
         :param video_concurrency: 视频并发数
         :param hierarchy: 是否使用层级目录
+        :param dm_workers: 弹幕转换进程数，默认为cpu核数
+        :param dm_store: 弹幕分段存储目录，提供时更新弹幕只重新获取缺失、末尾和过期的分段，内容无变化时不重新生成
+        :param asset_cache: 封面头像等图片的缓存目录，True为默认目录，默认False不使用缓存
         """
         client = client or httpx.AsyncClient(**api.dft_client_settings)
         super(DownloaderBilibili, self).__init__(
@@ -66,11 +82,34 @@ class DownloaderBilibili(BaseDownloaderPart):
             part_concurrency=part_concurrency,
         )
         client.cookies.set('SESSDATA', valid_sess_data(sess_data))
+        api.limiter.install(client)
         self._cate_meta = None
         self.v_sema = asyncio.Semaphore(video_concurrency)
         self.api_sema = asyncio.Semaphore(video_concurrency)
         self.hierarchy = hierarchy
         self.title_overflow = 50
+        self.dm_converter = DanmakuConverter(max_workers=dm_workers)
+        self.dm_store = DanmakuStore(dm_store) if dm_store else None
+        self.sub_manager = SubtitleManager(client, logger=self.logger)
+        self.writer = BatchWriter()
+        self._people: Dict[Path, PeopleIndex] = {}
+        if asset_cache:
+            self.asset_cache = AssetCache(None if asset_cache is True else asset_cache)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.writer.aclose()
+        if self.asset_cache:
+            await self.asset_cache.save()
+        await self.dm_converter.aclose()
+        await super().__aexit__(exc_type, exc_val, exc_tb)
+
+    async def aclose(self):
+        """Wait for pending writes, close danmaku converter and httpx client"""
+        await self.writer.aclose()
+        if self.asset_cache:
+            await self.asset_cache.save()
+        await self.dm_converter.aclose()
+        await super().aclose()
 
     @classmethod
     def parse_url(cls, url: str):
@@ -112,12 +151,12 @@ class DownloaderBilibili(BaseDownloaderPart):
         else:
             raise ValueError(f'{url} invalid for get_collect_or_list')
         if self.hierarchy:
-            path /= name
-            path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-            path.mkdir(parents=True, exist_ok=True)
+            path /= legal_name(name)
+            await afs.mkdir(path)
         await asyncio.gather(
-            *[self.get_series(f"https://www.bilibili.com/video/{i}", path=path, quality=quality, codec=codec, meta=meta, update=update,
-                              image=image, subtitle=subtitle, dm=dm, only_audio=only_audio)
+            *[self._submit(self.get_series, f"https://www.bilibili.com/video/{i}", path=path, quality=quality,
+                           codec=codec, meta=meta, update=update,
+                           image=image, subtitle=subtitle, dm=dm, only_audio=only_audio)
               for i in bvids])
 
     async def get_favour(self, url_or_fid, path=Path('.'), people_path=Path("./People/"),
@@ -147,9 +186,8 @@ class DownloaderBilibili(BaseDownloaderPart):
         fav_name, up_name, total_size, bvids, _ = await api.get_favour_page_info(self.client, url_or_fid, keyword=keyword)
         if self.hierarchy:
             name = legal_title(f"【收藏夹】{up_name}-{fav_name}")
-            path /= name
-            path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-            path.mkdir(parents=True, exist_ok=True)
+            path /= legal_name(name)
+            await afs.mkdir(path)
             if not db is None:
                 cursor.execute("SELECT * FROM BILIBILI_FAV WHERE name = ?", (name,))
                 row = cursor.fetchone()
@@ -195,8 +233,9 @@ class DownloaderBilibili(BaseDownloaderPart):
             if ((conn is None) or findFromDb(conn, bv, bvname, "fav_id", fav_id, "BILIBILI_FAV_VIDEO", image=image, subtitle=subtitle, dm=dm, meta=meta)):
                 func = self.get_series if series else self.get_video
                 # noinspection PyArgumentList
-                cors.append(func(f'https://www.bilibili.com/video/{bv}', path=path, quality=quality, codec=codec, meta=meta, update=update,
-                                image=image, subtitle=subtitle, dm=dm, only_audio=only_audio))
+                cors.append(self._submit(func, f'https://www.bilibili.com/video/{bv}', path=path, quality=quality,
+                                         codec=codec, meta=meta, update=update,
+                                         image=image, subtitle=subtitle, dm=dm, only_audio=only_audio))
         await asyncio.gather(*cors)
 
     @property
@@ -236,9 +275,8 @@ class DownloaderBilibili(BaseDownloaderPart):
             sub_names = [i['name'] for i in cate_meta[cate_name]['sub']]
             return self.logger.error(f'{cate_name} 是主分区，仅支持子分区，试试 {sub_names}')
         if self.hierarchy:
-            path /= legal_title(f"【分区】{cate_name}")
-            path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-            path.mkdir(parents=True, exist_ok=True)
+            path /= legal_name(legal_title(f"【分区】{cate_name}"))
+            await afs.mkdir(path)
         cate_id = cate_meta[cate_name]['tid']
         time_to = datetime.now()
         time_from = time_to - timedelta(days=days)
@@ -261,8 +299,8 @@ class DownloaderBilibili(BaseDownloaderPart):
         bvids = bvids[:num]
         func = self.get_series if series else self.get_video
         # noinspection PyArgumentList
-        cors = [func(f"https://www.bilibili.com/video/{i}", path=path, quality=quality, codec=codec, meta=meta, update=update,
-                     image=image, subtitle=subtitle, dm=dm, only_audio=only_audio)
+        cors = [self._submit(func, f"https://www.bilibili.com/video/{i}", path=path, quality=quality, codec=codec,
+                             meta=meta, update=update, image=image, subtitle=subtitle, dm=dm, only_audio=only_audio)
                 for i in bvids]
         await asyncio.gather(*cors)
 
@@ -298,6 +336,7 @@ class DownloaderBilibili(BaseDownloaderPart):
         up_uid = up_info.get('mid', '')# get('fans_medal').get('medal').get('uid', '')
         print(up_uid)
 
+        conn = None
         if not db is None:
             conn = sql.connect(db)
             cursor = conn.cursor()
@@ -309,9 +348,8 @@ class DownloaderBilibili(BaseDownloaderPart):
         add_cors = []
         up_name, total_size, bv_ids, bv_names = await api.get_up_video_info(self.client, url_or_mid, 1, ps, order, keyword)
         if self.hierarchy:
-            path /= legal_title(f"【up】{up_name}")
-            path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-            path.mkdir(parents=True, exist_ok=True)
+            path /= legal_name(legal_title(f"【up】{up_name}"))
+            await afs.mkdir(path)
             if not db is None:
                 cursor.execute("SELECT * FROM BILIBILI_UP WHERE name = ?", (up_name,))
                 row = cursor.fetchone()
@@ -323,7 +361,7 @@ class DownloaderBilibili(BaseDownloaderPart):
                     row = cursor.fetchone()
                 up_id = row[0]
         if meta:
-            exist, file_path = path_check(path / f'poster.jpg')
+            exist, file_path = await afs.path_check(path / f'poster.jpg')
             if not exist and update:
                 add_cors.append(self.get_static(up_face_url, path=path / f'poster')) # base_name))
                 self.logger.info(f"[cyan]已完成[/cyan] {path / f'poster.jpg'}")
@@ -375,8 +413,8 @@ class DownloaderBilibili(BaseDownloaderPart):
         func = self.get_series if series else self.get_video
         # noinspection PyArgumentList
         await asyncio.gather(
-            *[func(f'https://www.bilibili.com/video/{bv}', path=path, quality=quality, codec=codec, meta=meta, update=update,
-                   image=image, subtitle=subtitle, dm=dm, only_audio=only_audio) 
+            *[self._submit(func, f'https://www.bilibili.com/video/{bv}', path=path, quality=quality, codec=codec,
+                           meta=meta, update=update, image=image, subtitle=subtitle, dm=dm, only_audio=only_audio)
             for bv,bvname in zip(bvids, bvnames) 
             if (conn is None) or findFromDb(conn, bv, bvname, "up_id", up_id, "BILIBILI_UP_VIDEO", image=image, subtitle=subtitle, dm=dm, meta=meta) ])
         
@@ -403,7 +441,7 @@ class DownloaderBilibili(BaseDownloaderPart):
         """
         try:
             async with self.api_sema:
-                video_info = await api.get_video_info(self.client, url)
+                video_info = await api.get_video_record(self.client, url)
         except (APIResourceError, APIUnsupportedError) as e:
             return self.logger.warning(e)
         # print(video_info)
@@ -415,13 +453,12 @@ class DownloaderBilibili(BaseDownloaderPart):
             return
             
         if self.hierarchy and len(pages) > 1:
-            path /= video_info.title
-            path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-            path.mkdir(parents=True, exist_ok=True)
+            path /= legal_name(video_info.title)
+            await afs.mkdir(path)
             add_cors = []
             media_cors = []
             if meta:
-                exist, file_path = path_check(path / f'poster.jpg')
+                exist, file_path = await afs.path_check(path / f'poster.jpg')
                 if not exist and update:
                     add_cors.append(self.get_static(video_info.img_url, path=path / f'poster')) # base_name))
                     path_lst, _ = await asyncio.gather(asyncio.gather(*media_cors), asyncio.gather(*add_cors))
@@ -429,18 +466,29 @@ class DownloaderBilibili(BaseDownloaderPart):
                 else:
                     self.logger.info(f"[green]已存在[/green] {path / f'poster.jpg'}")
         
-        cors = [self.get_video(p.p_url, path=path,
-                               quality=quality, image=image, subtitle=subtitle, dm=dm,
-                               only_audio=only_audio, codec=codec, meta=meta, update=update,
-                               video_info=video_info if idx == video_info.p else None)
-                for idx, p in enumerate(pages)]
-        if p_range:
-            cors = cors_slice(cors, p_range)
+        if subtitle:  # look up subtitles of all pages in advance with bounded concurrency
+            selected = pages[p_range[0] - 1:p_range[1]] if p_range else pages
+            self.sub_manager.prefetch((p.bvid or video_info.bvid, p.cid) for p in selected if p.cid)
+        if self.job_queue is not None:  # each page is a sub job, video_info can not be persisted
+            selected = pages[p_range[0] - 1:p_range[1]] if p_range else pages
+            cors = [self._submit(self.get_video, p.p_url, path=path, quality=quality, image=image, subtitle=subtitle,
+                                 dm=dm, only_audio=only_audio, codec=codec, meta=meta, update=update)
+                    for p in selected]
+        else:
+            cors = [self.get_video(p.p_url, path=path,
+                                   quality=quality, image=image, subtitle=subtitle, dm=dm,
+                                   only_audio=only_audio, codec=codec, meta=meta, update=update,
+                                   video_info=video_info if idx == video_info.p else None)
+                    for idx, p in enumerate(pages)]
+            if p_range:
+                cors = cors_slice(cors, p_range)
         await asyncio.gather(*cors)
 
     async def get_video(self, url: str, path=Path('.'), people_path=Path("./People/"), 
                         quality: Union[str, int] = 0, image=False, subtitle=False, dm=False, only_audio=False,
-                        codec: str = '', meta=False, time_range: Tuple[int, int] = None, video_info: api.VideoInfo = None, update=False):
+                        codec: str = '', meta=False,
+                        time_range: Union[Tuple[int, int], Sequence[Tuple[int, int]]] = None,
+                        video_info: Union[api.VideoInfo, api.VideoInfoRecord] = None, update=False):
         """
         下载单个视频
         :cli: short: v
@@ -453,14 +501,18 @@ class DownloaderBilibili(BaseDownloaderPart):
         :param only_audio: 是否仅下载音频
         :param codec: 视频编码（可通过codec获取）
         :param meta: 是否保存meta信息
-        :param time_range: 切片的时间范围
+        :param time_range: 切片的时间范围，提供多个范围的列表时见get_clips
         :param video_info: 额外数据，提供时不用再次请求页面
         :return:
         """
+        if time_range and isinstance(time_range[0], (tuple, list)):
+            return await self.get_clips(url, time_range, path=path, people_path=people_path, quality=quality,
+                                        codec=codec, only_audio=only_audio, image=image, subtitle=subtitle, dm=dm,
+                                        meta=meta, video_info=video_info, update=update)
         async with self.v_sema:
             if not video_info:
                 try:
-                    video_info = await api.get_video_info(self.client, url)
+                    video_info = await api.get_video_record(self.client, url)
                 except (APIResourceError, APIUnsupportedError) as e:
                     return self.logger.warning(e)
             # print( video_info )
@@ -475,6 +527,7 @@ class DownloaderBilibili(BaseDownloaderPart):
             print( bv_id )
             media_cors = []
             task_id = await self.progress.add_task(total=None, description=task_name)
+            video = None
             if video_info.dash:
                 try:  # choose video quality
                     video, audio = video_info.dash.choose_quality(quality, codec)
@@ -482,43 +535,16 @@ class DownloaderBilibili(BaseDownloaderPart):
                     self.logger.warning(
                         f"{task_name} 清晰度<{quality}> 编码<{codec}>不可用，请检查输入是否正确或是否需要大会员")
                 else:
-                    # 该方法只支持单个字符
-                    # table = str.maketrans({"S0": "S·0", "S1": "S·1", "S2": "S·2", "S3": "S·3", "S4": "S·4", "S5": "S·5", "S6": "S·6", "S7": "S·7", "S8": "S·8", "S9": "S·9", \
-                    #                        "E0": "E·0", "E1": "E·1", "E2": "E·2", "E3": "E·3", "E4": "E·4", "E5": "E·5", "E6": "E·6", "E7": "E·7", "E8": "E·8", "E9": "E·9"})
-                    # video_name = media_name.translate(table)
-                    
-                    # 该方法可以支持多个字符
-                    video_name = media_name
-                    video_name = video_name.replace("S0", "S·0")
-                    video_name = video_name.replace("S1", "S·1")
-                    video_name = video_name.replace("S2", "S·2")
-                    video_name = video_name.replace("S3", "S·3")
-                    video_name = video_name.replace("S4", "S·4")
-                    video_name = video_name.replace("S5", "S·5")
-                    video_name = video_name.replace("S6", "S·6")
-                    video_name = video_name.replace("S7", "S·7")
-                    video_name = video_name.replace("S8", "S·8")
-                    video_name = video_name.replace("S9", "S·9")
-                    video_name = video_name.replace("E0", "E·0")
-                    video_name = video_name.replace("E1", "E·1")
-                    video_name = video_name.replace("E2", "E·2")
-                    video_name = video_name.replace("E3", "E·3")
-                    video_name = video_name.replace("E4", "E·4")
-                    video_name = video_name.replace("E5", "E·5")
-                    video_name = video_name.replace("E6", "E·6")
-                    video_name = video_name.replace("E7", "E·7")
-                    video_name = video_name.replace("E8", "E·8")
-                    video_name = video_name.replace("E9", "E·9")
-                    path = path / f'{video_name} - {video_info.bvid}'          # 每个视频单独文件夹存放
-                    path = Path(re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(path)))
-                    path.mkdir(exist_ok=True)
+                    # 每个视频单独文件夹存放
+                    path = path / f'{legal_name(media_name, split_episode=True)} - {video_info.bvid}'
+                    await afs.mkdir(path)
                     tmp: List[Tuple[api.Media, Path]] = []
                     # 1. only video
                     if not audio and not only_audio:
                         tmp.append((video, path / f'{bv_id}.mp4'))
                     # 2. video and audio
                     elif audio and not only_audio:
-                        exists, media_path = path_check(path / f'{bv_id}.mp4')
+                        exists, media_path = await afs.path_check(path / f'{bv_id}.mp4')
                         if exists:
                             self.logger.info(f'[green]已存在[/green] {media_path}') # {media_path.name}')
                         else:
@@ -560,7 +586,7 @@ class DownloaderBilibili(BaseDownloaderPart):
                     media_cors.append(
                         self.get_file(m.urls, path=path / f'{bv_id}.{m.suffix}', task_id=task_id))
                 else:
-                    exist, media_path = path_check(path / f'{bv_id}.mp4')
+                    exist, media_path = await afs.path_check(path / f'{bv_id}.mp4')
                     if exist:
                         self.logger.info(f'[green]已存在[/green] {media_path}')# .name}')
                     else:
@@ -577,26 +603,8 @@ class DownloaderBilibili(BaseDownloaderPart):
             else:
                 self.logger.warning(f'{task_name} 需要大会员或该地区不支持')
             # additional task
-            add_cors = []
-            if image or subtitle or dm or meta:
-                extra_path = path
-                if image:
-                    add_cors.append(self.get_static(video_info.img_url, path=extra_path / f'{bv_id}-fanart')) # base_name))
-                    add_cors.append(self.get_static(video_info.img_url, path=extra_path / f'{bv_id}-backdrop1')) # base_name))
-                if subtitle:
-                    add_cors.append(self.get_subtitle(url, path=extra_path, video_info=video_info))
-                if dm:
-                    try:
-                        width, height = video.width, video.height
-                    except UnboundLocalError:
-                        width, height = 1920, 1080
-                    add_cors.append(self.get_dm(
-                        url, path=extra_path, convert_func=self._dm2ass_factory(width, height), video_info=video_info, update=update))
-                if meta:
-                    add_cors.append(self.get_meta_nfo(url, path=extra_path, video_info=video_info, bv_id=bv_id))
-                    # with open(extra_path / f'{bv_id}.json', 'w', encoding='utf-8') as f:
-                    #     f.write(video_info.model_dump_json(exclude={"dash", "other"}))
-                    # self.logger.info(f'{bv_id}.json')
+            add_cors = self._sidecar_cors(url, path, people_path, bv_id, video_info, video, image=image,
+                                          subtitle=subtitle, dm=dm, meta=meta, update=update)
             path_lst, _ = await asyncio.gather(asyncio.gather(*media_cors), asyncio.gather(*add_cors))
 
         if upper := self.progress.tasks[task_id].fields.get('upper', None):
@@ -604,16 +612,128 @@ class DownloaderBilibili(BaseDownloaderPart):
             self.logger.info(f'[cyan]已完成[/cyan] {media_path}')# .name}')
         await self.progress.update(task_id, visible=False)
 
-    @staticmethod
-    def _dm2ass_factory(width: int, height: int):
-        async def dm2ass(protobuf_bytes: bytes) -> bytes:
-            loop = asyncio.get_event_loop()
-            f = functools.partial(proto2ass, protobuf_bytes, width, height, font_size=width / 50, alpha=0.5)    # 设置弹幕参数，具体参考danmakuC的__main__.py
-            content = await loop.run_in_executor(SingletonPPE(), f)
-            return content.encode('utf-8')
+    def _sidecar_cors(self, url: str, path: Path, people_path: Path, bv_id: str,
+                      video_info: Union[api.VideoInfo, api.VideoInfoRecord], video: Optional[api.Media],
+                      image=False, subtitle=False, dm=False, meta=False, update=False) -> List[Awaitable]:
+        """cover, subtitle, danmaku and nfo saved beside the media of a video"""
+        add_cors = []
+        if image:
+            add_cors.append(self.get_static(video_info.img_url, path=path / f'{bv_id}-fanart')) # base_name))
+            add_cors.append(self.get_static(video_info.img_url, path=path / f'{bv_id}-backdrop1')) # base_name))
+        if subtitle:
+            add_cors.append(self.get_subtitle(url, path=path, video_info=video_info))
+        if dm:
+            layout = ass_layout(video.width, video.height) if video and video.width else DEFAULT_LAYOUT
+            add_cors.append(self.get_dm(
+                url, path=path, convert_func=self._dm2ass_factory(layout), video_info=video_info, update=update))
+        if meta:
+            add_cors.append(self.get_meta_nfo(url, path=path, people_path=people_path, video_info=video_info,
+                                              bv_id=bv_id, update=update))
+            # with open(path / f'{bv_id}.json', 'w', encoding='utf-8') as f:
+            #     f.write(video_info.model_dump_json(exclude={"dash", "other"}))
+            # self.logger.info(f'{bv_id}.json')
+        return add_cors
+
+    async def get_clips(self, url: str, time_ranges: Sequence[Tuple[int, int]], path=Path('.'),
+                        people_path=Path("./People/"), quality: Union[str, int] = 0, codec: str = '',
+                        only_audio=False, snap=False, image=False, subtitle=False, dm=False, meta=False,
+                        video_info: Union[api.VideoInfo, api.VideoInfoRecord] = None, update=False) -> List[Path]:
+        """
+        从一个视频切出多个片段，视频信息和sidx只获取一次，各片段需要的分段合并后只下载一次
+        :param url: 视频的url
+        :param time_ranges: 各片段的时间范围
+        :param path: 保存路径
+        :param quality: 画面质量
+        :param codec: 视频编码
+        :param only_audio: 是否仅下载音频
+        :param snap: 片段边界扩展到关键帧（分段边界），直接拼接分段而不用ffmpeg切割
+        :param image: 是否下载封面
+        :param subtitle: 是否下载字幕
+        :param dm: 是否下载弹幕
+        :param meta: 是否保存meta信息
+        :param video_info: 额外数据，提供时不用再次请求页面
+        :param update: 是否更新弹幕和meta信息
+        :return: 片段路径
+        """
+        async with self.v_sema:
+            if not video_info:
+                try:
+                    async with self.api_sema:
+                        video_info = await api.get_video_record(self.client, url)
+                except (APIResourceError, APIUnsupportedError) as e:
+                    self.logger.warning(e)
+                    return []
+            p_name = legal_title(video_info.pages[video_info.p].p_name)
+            task_name = legal_title(video_info.title, p_name)
+            base_name = p_name if len(video_info.title) > self.title_overflow and self.hierarchy and p_name else \
+                task_name
+            bv_id = legal_title(video_info.bvid, p_name)
+            path = path / f'{legal_name(base_name, split_episode=True)} - {video_info.bvid}'
+            await afs.mkdir(path)
+            video = audio = None
+            if not video_info.dash:
+                self.logger.warning(f"{task_name} 未解析到dash资源，无法切片")
+            else:
+                try:
+                    video, audio = video_info.dash.choose_quality(quality, codec)
+                except KeyError:
+                    self.logger.warning(
+                        f"{task_name} 清晰度<{quality}> 编码<{codec}>不可用，请检查输入是否正确或是否需要大会员")
+            # additional task, run like the single range path
+            add_cors = self._sidecar_cors(url, path, people_path, bv_id, video_info, video, image=image,
+                                          subtitle=subtitle, dm=dm, meta=meta, update=update)
+            if only_audio and video and not audio:
+                self.logger.warning(f"No audio for {task_name}")
+                video = None
+            if video is None:
+                await asyncio.gather(*add_cors)
+                return []
+            names = [legal_title(bv_id, *map(t2s, time_range)) for time_range in time_ranges]
+            suffix = audio.suffix if only_audio else '.mp4'
+            clip_paths = [path / f'{name}{suffix}' for name in names]
+            todo = []
+            for i, clip_path in enumerate(clip_paths):
+                exist, clip_paths[i] = await afs.path_check(clip_path)
+                if exist:
+                    self.logger.info(f'[green]已存在[/green] {clip_paths[i]}')
+                else:
+                    todo.append(i)
+            if not todo:
+                await asyncio.gather(*add_cors)
+                return clip_paths
+            ranges = [time_ranges[i] for i in todo]
+            task_id = await self.progress.add_task(total=None, description=task_name)
+
+            def clips(media: api.Media, paths: List[Path], **kwargs):
+                return self.get_media_clips(media.urls, paths, ranges, init_range=media.segment_base['initialization'],
+                                            seg_range=media.segment_base['index_range'], snap=snap,
+                                            task_id=task_id, **kwargs)
+
+            async def cut():
+                if only_audio or not audio:
+                    await clips(audio if only_audio else video, [clip_paths[i] for i in todo])
+                    return
+                await self.progress.update(task_id=task_id, upper=ffmpeg.combine)
+                futs = [asyncio.get_event_loop().create_future() for _ in todo]  # to fix key frame
+                v_paths, a_paths = await asyncio.gather(
+                    clips(video, [path / f'{names[i]}-v' for i in todo], set_s=futs),
+                    clips(audio, [path / f'{names[i]}-a' for i in todo], get_s=futs))
+                for i, v_path, a_path in zip(todo, v_paths, a_paths):
+                    await ffmpeg.combine([v_path, a_path], clip_paths[i])
+                    self.logger.info(f'[cyan]已完成[/cyan] {clip_paths[i]}')
+
+            await asyncio.gather(cut(), *add_cors)
+            await self.progress.update(task_id, visible=False)
+        return clip_paths
+
+    def _dm2ass_factory(self, layout: AssLayout = DEFAULT_LAYOUT):
+        async def dm2ass(buffer: DanmakuBuffer) -> bytes:
+            # 弹幕参数见ass_layout，具体参考danmakuC的__main__.py
+            return (await self.dm_converter.render(buffer, [layout]))[0]
 
         return dm2ass
 
+    @metrics.timed('sidecar')
     async def get_dm(self, url, path=Path('.'), people_path=Path("./People/"), update=False, convert_func=None, video_info=None):
         """
         下载视频的弹幕
@@ -621,12 +741,13 @@ class DownloaderBilibili(BaseDownloaderPart):
         :param url: 视频url
         :param path: 保存路径
         :param update: 是否更新覆盖之前下载的弹幕文件
-        :param convert_func:
+        :param convert_func: 转换函数，接收原始protobuf bytes，首个参数标注为DanmakuBuffer时接收解析后的弹幕，
+            不提供时保存原始protobuf
         :param video_info: 额外数据，提供则不再访问前端
         :return:
         """
         if not video_info:
-            video_info = await api.get_video_info(self.client, url)
+            video_info = await api.get_video_record(self.client, url)
         aid, cid = video_info.aid, video_info.cid
         file_type = '.' + ('pb' if not convert_func else convert_func.__name__.split('2')[-1])
         p_name = video_info.pages[video_info.p].p_name
@@ -637,22 +758,51 @@ class DownloaderBilibili(BaseDownloaderPart):
         # print(p_name)
         file_name = legal_title(video_info.bvid, p_name, "弹幕.zh", join_str = ".") + file_type
         file_path = path / file_name
-        exist, file_path = path_check(file_path)
+        exist, file_path = await afs.path_check(file_path)
         if not update and exist:
             self.logger.info(f"[green]已存在[/green] {file_name}")
             return file_path
         dm_urls = await api.get_dm_urls(self.client, aid, cid)
-        cors = [req_retry(self.client, dm_url) for dm_url in dm_urls]
-        results = await asyncio.gather(*cors)
-        content = b''.join(res.content for res in results)
-        content = convert_func(content) if convert_func else content
-        if asyncio.iscoroutine(content):
-            content = await content
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(content)
+        if self.dm_store is None:
+            segments = api.iter_dm_segments(self.client, dm_urls)
+        else:
+            store, index = self.dm_store, await self.dm_store.load_index(cid)
+            outdated = store.outdated(index, len(dm_urls))
+            changed, indices = 0, iter(outdated)
+            async for content in api.iter_dm_segments(self.client, [dm_urls[i] for i in outdated]):
+                changed += await store.put(cid, index, next(indices), content)
+            digest = store.digest(index, len(dm_urls))
+            if exist and index['rendered'].get(file_name) == digest:
+                await store.save_index(cid, index)
+                self.logger.info(f"[green]无变化[/green] {file_name}")
+                return file_path
+            self.logger.debug(f"{file_name} fetched {len(outdated)}/{len(dm_urls)} segments, {changed} changed")
+            segments = store.iter_segments(cid, len(dm_urls))
+        if convert_func is None:  # protobuf segments can be concatenated directly, write as they arrive
+            tmp_path = file_path.with_name(file_path.name + '.tmp')
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for content in segments:
+                    await f.write(content)
+            os.replace(tmp_path, file_path)
+        else:
+            if _takes_buffer(convert_func):
+                content = DanmakuBuffer()
+                async for segment in segments:
+                    content.add_segment(segment)
+            else:
+                content = b''.join([segment async for segment in segments])
+            content = convert_func(content)
+            if asyncio.iscoroutine(content):
+                content = await content
+            async with aiofiles.open(file_path, 'wb') as f:
+                await f.write(content)
+        if self.dm_store is not None:
+            index['rendered'][file_name] = digest
+            await self.dm_store.save_index(cid, index)
         self.logger.info(f"[cyan]已完成[/cyan] {file_name}")
         return file_path
 
+    @metrics.timed('sidecar')
     async def get_subtitle(self, url, path=Path('.'), people_path=Path("./People/"), convert_func=json2srt, video_info=None):
         """
         下载视频的字幕文件
@@ -664,13 +814,15 @@ class DownloaderBilibili(BaseDownloaderPart):
         :return:
         """
         if not video_info:
-            video_info = await api.get_video_info(self.client, url)
+            video_info = await api.get_video_record(self.client, url)
         p, cid = video_info.p, video_info.cid
         p_name = video_info.pages[p].p_name
         try:
-            subtitles = await api.get_subtitle_info(self.client, video_info.bvid, cid)
+            subtitles = await self.sub_manager.lookup(video_info.bvid, cid)
         except APIError as e:
             return self.logger.warning(e)
+        if not subtitles:
+            return self.logger.debug(f"{video_info.bvid} {p_name} 无字幕")
         cors = []
 
         for sub_url, sub_name in subtitles:
@@ -678,10 +830,11 @@ class DownloaderBilibili(BaseDownloaderPart):
             #     file_name = legal_title(p_name, sub_name)
             # else:
             file_name = legal_title(video_info.bvid, p_name, sub_name, "zh", join_str = ".")
-            cors.append(self.get_static(sub_url, path / file_name, convert_func=convert_func))
+            cors.append(self.sub_manager.save(sub_url, path / file_name, convert_func=convert_func))
         paths = await asyncio.gather(*cors)
         return paths
     
+    @metrics.timed('sidecar')
     async def get_meta_nfo(self, url, path=Path('.'), people_path=Path("./People/"), video_info=None, bv_id=None, update=False):
         """
         提取生成nfo文件
@@ -692,118 +845,48 @@ class DownloaderBilibili(BaseDownloaderPart):
         :return:
         """
         if not video_info:
-            video_info = await api.get_video_info(self.client, url)
+            video_info = await api.get_video_record(self.client, url)
             bv_id = legal_title(video_info.bvid)
-        p, cid = video_info.p, video_info.cid
-        p_name = video_info.pages[p].p_name
-
         exist_path = path / f'{legal_title(bv_id)}.nfo'# , p_name)}.nfo'
-        exist, exist_path = path_check(exist_path)
+        exist, exist_path = await afs.path_check(exist_path)
         if not update and exist:
             self.logger.info(f"[green]已存在[/green] {exist_path}")
             return exist_path
-        video_user_info = await api._get_video_info_from_api(self.client, url)
-        # print(video_user_info)
-        pubdate_timestamp = video_user_info.get('data').get('pubdate','0')
-        pubdate_date = datetime.fromtimestamp(pubdate_timestamp)
-        ctime_timestamp = video_user_info.get('data').get('ctime','0')
-        ctime_date = datetime.fromtimestamp(ctime_timestamp)
-        
-        root = ET.Element("movie")
-        ET.SubElement(root, "plot").text = video_info.desc
-        ET.SubElement(root, "title").text = legal_title(video_info.title, p_name)
-        ET.SubElement(root, "trailer").text = f"{url}"
-        pubdateText = datetime(pubdate_date.year, pubdate_date.month, pubdate_date.day).strftime('%Y-%m-%d')
-        ctimeText = datetime(ctime_date.year, ctime_date.month, ctime_date.day).strftime('%Y-%m-%d')
-        ET.SubElement(root, "premiered").text = f'{pubdateText}'
-        ET.SubElement(root, "releasedate").text = f'{ctimeText}'
-        ET.SubElement(root, "aired").text = f'{pubdateText}'
-        ET.SubElement(root, "year").text = f'{pubdate_date.year}'
-        ET.SubElement(root, "mpaa").text = "PG"
-        ET.SubElement(root, "customrating").text = "CN"
-        ET.SubElement(root, "country").text = "中国"
-        ET.SubElement(root, "runtime").text = f"{video_user_info.get('data').get('duration','')}秒"
-        ET.SubElement(root, "id").text = video_info.bvid
-        ET.SubElement(root, "num").text = video_info.bvid
-        ET.SubElement(root, "genre").text = video_user_info.get('data').get('tname','')
-        ET.SubElement(root, "studio").text = f"bilibili"
-
-        # 获取tag信息
-        tags = video_info.tags
-        tag = [None]*len(tags)
-        # print(video_info.tags)
-        for index, member in enumerate(tags):
-            # print(index)
-            # print(member)
-            tag[index] = ET.SubElement(root, "tag")
-            tag[index].text = f"{member}"
-        
-        # 获取演员信息
-        staff = video_user_info.get('data').get('staff','')
-        if staff == '':
-            owner = video_user_info.get('data').get('owner','')
-            actor = ET.SubElement(root, "actor")
-            ET.SubElement(actor, "name").text = f"{owner.get('name','')}"
-            ET.SubElement(actor, "mid").text = f"{owner.get('mid','')}"
-            ET.SubElement(actor, "type").text = f"UP主"
-            ET.SubElement(actor, "sortorder").text = f"0"
-            ET.SubElement(actor, "thumb").text = f"/nfo/People/{owner.get('name','')[:1]}/{owner.get('name','')}/folder.jpg"
-            # print(f"/nfo/People/{owner.get('name','')[:1]}/{owner.get('name','')}/folder.jpg")
-            file_path = Path(people_path, f"{owner.get('name','')[:1]}/{owner.get('name','')}")
-            file_path.mkdir(parents=True, exist_ok=True)
-            file_name = file_path / f"folder.jpg"
-            # print(file_name)
-            path1 = "."
-            exist, file_name = path_check(file_name)
-            if not update and exist:
-                self.logger.info(f"[green]已存在[/green] {file_name}")
-            else:
-                media_cors = []
-                add_cors = []
-                pic_url = owner.get('face','')
-                add_cors.append(self.get_static(pic_url, path=file_path / f"folder")) # base_name))
-                path_lst, _ = await asyncio.gather(asyncio.gather(*media_cors), asyncio.gather(*add_cors))
-                self.logger.info(f"[cyan]已完成[/cyan] {file_name}")
-        else:
-            actor = [None]*len(staff)
-            for index, member in enumerate(staff):
-                # print(index)
-                # print(member)
-                actor[index] = ET.SubElement(root, "actor")
-                ET.SubElement(actor[index], "name").text = f"{member.get('name','')}"
-                ET.SubElement(actor[index], "mid").text = f"{member.get('mid','')}"
-                ET.SubElement(actor[index], "role").text = f"{member.get('title','')}"
-                ET.SubElement(actor[index], "type").text = f"Producer"
-                ET.SubElement(actor[index], "sortorder").text = f"{index}"
-                ET.SubElement(actor[index], "thumb").text = f"/nfo/People/{member.get('name','')[:1]}/{member.get('name','')}/folder.jpg"
-                # print(f"/nfo/People/{member.get('name','')[:1]}/{member.get('name','')}/folder.jpg")
-                # todo: 检查演员文件夹是否有该UP主的信息
-                file_path = Path(people_path, f"{member.get('name','')[:1]}/{member.get('name','')}")
-                file_path.mkdir(parents=True, exist_ok=True)
-                file_name = file_path / f"folder.jpg"
-                # print(file_name)
-                path1 = "."
-                exist, file_name = path_check(file_name)
-                if not update and exist:
-                    self.logger.info(f"[green]已存在[/green] {file_name}")
-                else:
-                    media_cors = []
-                    add_cors = []
-                    pic_url = member.get('face','')
-                    add_cors.append(self.get_static(pic_url, path=file_path / f"folder")) # base_name))
-                    path_lst, _ = await asyncio.gather(asyncio.gather(*media_cors), asyncio.gather(*add_cors))
-                    self.logger.info(f"[cyan]已完成[/cyan] {file_name}")
-
-        
-        # 存入nfo文件
-        tree = ET.ElementTree(root)
-        file_name = legal_title(bv_id)#, p_name)
-        file_path = path / f'{file_name}.nfo'
-        with open(file_path, 'w', encoding='utf-8') as f:
-            tree.write(file_path, encoding="utf-8", xml_declaration=True)
+        meta = video_info.meta
+        if not meta:  # e.g. bangumi page has no view data
+            meta = api._pick_meta((await api._get_view_json(self.client, url)).get('data') or {})
+        people = self._people_index(people_path)
+        cors = [self._get_avatar(people, person['name'], person['face'], force=update) for person in people_of(meta)]
+        if any(await asyncio.gather(*cors)):
+            await people.save()
+        file_path = path / f'{legal_title(bv_id)}.nfo'
+        await self.writer.write(file_path, build_nfo(video_info, meta, url))
         self.logger.info(f"[cyan]已完成[/cyan] {file_path}")
         return file_path
-    
+
+    def _people_index(self, people_path: Path) -> PeopleIndex:
+        people_path = Path(people_path)
+        if people_path not in self._people:
+            self._people[people_path] = PeopleIndex(people_path, self.writer)
+        return self._people[people_path]
+
+    async def _get_avatar(self, people: PeopleIndex, name: str, face: str, force=False) -> bool:
+        """
+        download avatar to People/<first char>/<name>/folder.jpg if not saved before or the face changed,
+        return True if downloaded
+
+        :param force: download again even if the face did not change, once per run
+        """
+        if not await people.claim(name, face, force):
+            return False
+        try:
+            avatar_dir = await self.writer.mkdir(people.avatar_dir(name))
+            await self.get_static(face, path=avatar_dir / "folder", overwrite=True)
+        except Exception:
+            await people.release(name)
+            raise
+        return True
+
     @classmethod
     @auto_assemble
     def handle(cls, method: str, keys: Tuple[str, ...], options: dict):
@@ -814,8 +897,11 @@ class DownloaderBilibili(BaseDownloaderPart):
                 m = cls._cli_map[method]
             else:
                 raise HandleMethodError(cls, method=method)
-            d = cls(sess_data=options['cookie'], **kwargs_filter(cls, options))
-            return d, m
+            return cls.from_options(options), m
+
+    @classmethod
+    def from_options(cls, options: dict):
+        return super().from_options({**options, 'sess_data': options.get('cookie')})
 
 def findFromDb( conn:sql.connect, bvid, bvname, pid_name, pid, tableName, image=False, subtitle=False, dm=False, meta=False, update=False):
     if conn is None:
@@ -825,27 +911,7 @@ def findFromDb( conn:sql.connect, bvid, bvname, pid_name, pid, tableName, image=
     
     cursor = conn.cursor() 
 
-    bvname = bvname.replace("S0", "S·0")
-    bvname = bvname.replace("S1", "S·1")
-    bvname = bvname.replace("S2", "S·2")
-    bvname = bvname.replace("S3", "S·3")
-    bvname = bvname.replace("S4", "S·4")
-    bvname = bvname.replace("S5", "S·5")
-    bvname = bvname.replace("S6", "S·6")
-    bvname = bvname.replace("S7", "S·7")
-    bvname = bvname.replace("S8", "S·8")
-    bvname = bvname.replace("S9", "S·9")
-    bvname = bvname.replace("E0", "E·0")
-    bvname = bvname.replace("E1", "E·1")
-    bvname = bvname.replace("E2", "E·2")
-    bvname = bvname.replace("E3", "E·3")
-    bvname = bvname.replace("E4", "E·4")
-    bvname = bvname.replace("E5", "E·5")
-    bvname = bvname.replace("E6", "E·6")
-    bvname = bvname.replace("E7", "E·7")
-    bvname = bvname.replace("E8", "E·8")
-    bvname = bvname.replace("E9", "E·9")
-    bvname = re.sub('[\.\:\*\?\"\<\>\|]', str('_'), str(bvname))
+    bvname = legal_name(bvname, split_episode=True)
         
     haveVideo = 0
     haveCover = 0
@@ -82,3 +82,54 @@ async def test_choose_quality():
         video, audio = data.dash.choose_quality(quality='1080P', codec="hev:fLaC")
     except KeyError:
         assert not os.getenv("BILI_TOKEN")
+
+
+@pytest.mark.asyncio
+async def test_get_video_clips_sidecar(tmp_path, monkeypatch):
+    from bilix.sites.bilibili import api
+    calls = []
+
+    async def sidecar(self, url, path, **kwargs):
+        calls.append(kwargs.get('update'))
+
+    for name in ('get_subtitle', 'get_dm', 'get_meta_nfo'):
+        monkeypatch.setattr(DownloaderBilibili, name, sidecar)
+    video_info = api.VideoInfoRecord(title='title', bvid='BV1xx', p=0, img_url='', dash=None,
+                                     pages=[api.PageRecord(p_name='', p_url='')])
+    d = DownloaderBilibili()
+    # more than one range goes to get_clips, sidecar files are still saved
+    assert await d.get_video('https://www.bilibili.com/video/BV1xx', path=tmp_path, time_range=[(0, 1), (2, 3)],
+                             subtitle=True, dm=True, meta=True, update=True, video_info=video_info) == []
+    await d.aclose()
+    assert calls == [None, True, True]
+
+
+@pytest.mark.asyncio
+async def test_get_dm_convert_func(tmp_path, monkeypatch):
+    from bilix.sites.bilibili import api
+    from bilix.sites.bilibili.danmaku import DanmakuBuffer
+
+    async def get_dm_urls(client, aid, cid):
+        return ['1', '2']
+
+    async def iter_dm_segments(client, dm_urls):
+        for u in dm_urls:
+            yield u.encode()
+
+    def dm2txt(content: bytes) -> bytes:  # converters written for raw protobuf still work
+        return content
+
+    def dm2len(buffer: DanmakuBuffer) -> bytes:
+        return str(len(buffer)).encode()
+
+    monkeypatch.setattr(api, 'get_dm_urls', get_dm_urls)
+    monkeypatch.setattr(api, 'iter_dm_segments', iter_dm_segments)
+    video_info = api.VideoInfoRecord(title='title', bvid='BV1xx', p=0, aid=1, cid=2,
+                                     pages=[api.PageRecord(p_name='', p_url='')])
+    d = DownloaderBilibili()
+    path = await d.get_dm('', path=tmp_path, convert_func=dm2txt, video_info=video_info)
+    assert path.suffix == '.txt' and path.read_bytes() == b'12'
+    monkeypatch.setattr(api, 'iter_dm_segments', lambda client, dm_urls: iter_dm_segments(client, ['', '']))
+    path = await d.get_dm('', path=tmp_path, convert_func=dm2len, video_info=video_info)
+    assert path.read_bytes() == b'0'
+    await d.aclose()
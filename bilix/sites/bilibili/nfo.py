@@ -0,0 +1,125 @@
+"""
+nfo metadata of bilibili videos for media servers (jellyfin, emby, kodi) and the People avatar index
+"""
+import asyncio
+import json
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Set, Union, Optional
+
+import aiofiles
+
+from bilix._json import loads
+from bilix.download.fs import BatchWriter
+from bilix.utils import legal_title
+from . import api
+
+__all__ = ['build_nfo', 'people_of', 'PeopleIndex']
+
+
+def people_of(meta: dict) -> List[dict]:
+    """staff of the video, or the up owner when there is no staff"""
+    staff = meta.get('staff')
+    if staff:
+        return [{'name': m.get('name', ''), 'mid': m.get('mid', ''), 'face': m.get('face', ''),
+                 'role': m.get('title', ''), 'type': 'Producer'} for m in staff]
+    owner = meta.get('owner') or {}
+    return [{'name': owner.get('name', ''), 'mid': owner.get('mid', ''), 'face': owner.get('face', ''),
+             'role': None, 'type': 'UP主'}]
+
+
+def _date(timestamp) -> datetime:
+    return datetime.fromtimestamp(int(timestamp or 0))
+
+
+def build_nfo(video_info: Union[api.VideoInfo, api.VideoInfoRecord], meta: dict, url: str) -> bytes:
+    """
+    build nfo xml of a video from already fetched info
+
+    :param video_info:
+    :param meta: view data with META_KEYS
+    :param url: video url
+    :return: utf-8 xml with declaration
+    """
+    p_name = video_info.pages[video_info.p].p_name
+    pubdate, ctime = _date(meta.get('pubdate')), _date(meta.get('ctime'))
+    root = ET.Element("movie")
+    ET.SubElement(root, "plot").text = video_info.desc
+    ET.SubElement(root, "title").text = legal_title(video_info.title, p_name)
+    ET.SubElement(root, "trailer").text = f"{url}"
+    ET.SubElement(root, "premiered").text = pubdate.strftime('%Y-%m-%d')
+    ET.SubElement(root, "releasedate").text = ctime.strftime('%Y-%m-%d')
+    ET.SubElement(root, "aired").text = pubdate.strftime('%Y-%m-%d')
+    ET.SubElement(root, "year").text = f'{pubdate.year}'
+    ET.SubElement(root, "mpaa").text = "PG"
+    ET.SubElement(root, "customrating").text = "CN"
+    ET.SubElement(root, "country").text = "中国"
+    ET.SubElement(root, "runtime").text = f"{meta.get('duration', '')}秒"
+    ET.SubElement(root, "id").text = video_info.bvid
+    ET.SubElement(root, "num").text = video_info.bvid
+    ET.SubElement(root, "genre").text = meta.get('tname', '')
+    ET.SubElement(root, "studio").text = "bilibili"
+    for tag in video_info.tags or ():
+        ET.SubElement(root, "tag").text = f"{tag}"
+    for index, person in enumerate(people_of(meta)):
+        actor = ET.SubElement(root, "actor")
+        ET.SubElement(actor, "name").text = f"{person['name']}"
+        ET.SubElement(actor, "mid").text = f"{person['mid']}"
+        if person['role'] is not None:
+            ET.SubElement(actor, "role").text = f"{person['role']}"
+        ET.SubElement(actor, "type").text = person['type']
+        ET.SubElement(actor, "sortorder").text = f"{index}"
+        ET.SubElement(actor, "thumb").text = f"/nfo/People/{person['name'][:1]}/{person['name']}/folder.jpg"
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+class PeopleIndex:
+    """
+    avatars already saved under a People directory, kept in memory and persisted to .bilix_people.json,
+    an avatar is downloaded again only when the face url of the person changed
+    """
+    file_name = '.bilix_people.json'
+
+    def __init__(self, root: Path, writer: BatchWriter):
+        self.root = Path(root)
+        self.writer = writer
+        self._faces: Optional[Dict[str, str]] = None  # name -> face url
+        self._claimed: Set[str] = set()  # names claimed in this run
+        self._lock = asyncio.Lock()
+
+    def avatar_dir(self, name: str) -> Path:
+        return self.root / name[:1] / name
+
+    async def _load(self):
+        if self._faces is None:
+            try:
+                async with aiofiles.open(self.root / self.file_name, 'rb') as f:
+                    self._faces = loads(await f.read())
+            except (OSError, ValueError):
+                self._faces = {}
+
+    async def claim(self, name: str, face: str, force=False) -> bool:
+        """
+        return True if the avatar of this person should be downloaded by the caller
+
+        :param force: claim even if the face did not change, but only once per run
+        """
+        async with self._lock:
+            await self._load()
+            if not face or (name in self._claimed if force else self._faces.get(name) == face):
+                return False
+            self._faces[name] = face  # claim it so other videos in this run skip the person
+            self._claimed.add(name)
+            return True
+
+    async def release(self, name: str):
+        """download failed, let a later video retry"""
+        async with self._lock:
+            self._faces.pop(name, None)
+            self._claimed.discard(name)
+
+    async def save(self):
+        async with self._lock:
+            content = json.dumps(self._faces, ensure_ascii=False)
+        await self.writer.write(self.root / self.file_name, content)
@@ -0,0 +1,56 @@
+import httpx
+import pytest
+import xml.etree.ElementTree as ET
+from bilix.download.fs import BatchWriter
+from bilix.sites.bilibili import api
+from bilix.sites.bilibili.nfo import build_nfo, PeopleIndex
+
+meta = {'pubdate': 1600000000, 'ctime': 1600000000, 'duration': 60, 'tname': '动画',
+        'owner': {'mid': 1, 'name': 'up', 'face': 'http://i0.hdslb.com/face.jpg'}}
+
+
+def test_build_nfo():
+    video_info = api.VideoInfoRecord(title='title', bvid='BV1xx', p=0, desc='desc', tags=['a', 'b'],
+                                     pages=[api.PageRecord(p_name='', p_url='')])
+    root = ET.fromstring(build_nfo(video_info, meta, 'https://www.bilibili.com/video/BV1xx'))
+    assert root.find('title').text == 'title'
+    assert root.find('premiered').text[:4] == root.find('year').text
+    assert [t.text for t in root.findall('tag')] == ['a', 'b']
+    actor = root.find('actor')
+    assert actor.find('name').text == 'up' and actor.find('type').text == 'UP主' and actor.find('role') is None
+
+
+@pytest.mark.asyncio
+async def test_people_index(tmp_path):
+    writer = BatchWriter()
+    people = PeopleIndex(tmp_path, writer)
+    assert await people.claim('up', 'http://face/1.jpg')
+    assert not await people.claim('up', 'http://face/1.jpg')
+    await people.save()
+    people = PeopleIndex(tmp_path, writer)
+    assert not await people.claim('up', 'http://face/1.jpg')
+    assert await people.claim('up', 'http://face/2.jpg')
+    await people.release('up')
+    assert await people.claim('up', 'http://face/2.jpg')
+    assert people.avatar_dir('up') == tmp_path / 'u' / 'up'
+    await people.save()
+    # update: once per run even if the face did not change
+    people = PeopleIndex(tmp_path, writer)
+    assert await people.claim('up', 'http://face/2.jpg', force=True)
+    assert not await people.claim('up', 'http://face/2.jpg', force=True)
+
+
+@pytest.mark.asyncio
+async def test_avatar_refresh(tmp_path):
+    from bilix.sites.bilibili.downloader import DownloaderBilibili
+
+    def handler(request: httpx.Request):
+        return httpx.Response(200, content=request.url.path.encode())
+
+    d = DownloaderBilibili(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    avatar = tmp_path / 'u' / 'up' / 'folder.jpg'
+    assert await d._get_avatar(PeopleIndex(tmp_path, d.writer), 'up', 'http://face/1.jpg')
+    # face changed in a later run, the existing avatar is replaced
+    assert await d._get_avatar(PeopleIndex(tmp_path, d.writer), 'up', 'http://face/2.jpg')
+    assert avatar.read_bytes() == b'/2.jpg'
+    assert [p.name for p in avatar.parent.iterdir()] == ['folder.jpg']
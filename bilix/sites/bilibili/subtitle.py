@@ -0,0 +1,140 @@
+"""
+bilibili subtitle lookup and download shared by all videos of a downloader
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple, Callable, Iterable, Optional
+
+import aiofiles
+import httpx
+
+from bilix.download.utils import req_retry
+from bilix.download.fs import afs
+from bilix.exception import APIResourceError
+from bilix.log import logger as dft_logger
+from . import api
+
+__all__ = ['SubtitleManager']
+
+
+class SubtitleManager:
+    """
+    player/v2 lookups run with bounded concurrency and are shared by all callers asking for the same video,
+    videos without subtitle are remembered for negative_ttl seconds, and a subtitle url used by several pages
+    is downloaded and converted only once.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, concurrency: int = 4, negative_ttl: float = 3600,
+                 cache_size: int = 64, logger=None):
+        """
+
+        :param client:
+        :param concurrency: max concurrent player/v2 and subtitle requests
+        :param negative_ttl: seconds to remember a video has no subtitle
+        :param cache_size: number of finished lookups and converted subtitles kept in memory for dedup
+        :param logger:
+        """
+        self.client = client
+        self.logger = logger or dft_logger
+        self.sema = asyncio.Semaphore(concurrency)
+        self.negative_ttl = negative_ttl
+        self.cache_size = cache_size
+        self._lookups: 'OrderedDict[Tuple[str, int], asyncio.Future]' = OrderedDict()
+        self._negative: Dict[Tuple[str, int], float] = {}
+        self._contents: OrderedDict = OrderedDict()
+
+    async def _lookup(self, bvid: str, cid: int) -> List[Tuple[str, str]]:
+        async with self.sema:
+            try:
+                return await api.get_subtitle_info(self.client, bvid, cid)
+            except APIResourceError:
+                return []
+
+    def _lookup_future(self, bvid: str, cid: int) -> Optional[asyncio.Future]:
+        key = (bvid, cid)
+        if self._negative.get(key, 0) > time.monotonic():
+            return None
+        fut = self._lookups.get(key)
+        if fut is None:
+            fut = self._lookups[key] = asyncio.ensure_future(self._lookup(bvid, cid))
+            fut.add_done_callback(lambda f: self._lookup_done(key, f))
+        else:
+            self._lookups.move_to_end(key)
+        return fut
+
+    def _lookup_done(self, key: Tuple[str, int], fut: asyncio.Future):
+        if fut.cancelled() or fut.exception() is not None:
+            self._lookups.pop(key, None)  # allow retry
+        elif not fut.result():
+            self._lookups.pop(key, None)
+            self._negative[key] = time.monotonic() + self.negative_ttl
+        else:  # keep the last cache_size finished lookups, running ones are still shared
+            done = [k for k, f in self._lookups.items() if f.done()]
+            for k in done[:len(done) - self.cache_size]:
+                del self._lookups[k]
+
+    def prefetch(self, videos: Iterable[Tuple[str, int]]):
+        """start lookups of (bvid, cid) in background, e.g. all pages of a series"""
+        for bvid, cid in videos:
+            self._lookup_future(bvid, cid)
+
+    async def lookup(self, bvid: str, cid: int) -> List[Tuple[str, str]]:
+        """
+        get [(subtitle url, language name), ...] of a video, empty if no subtitle
+
+        :param bvid:
+        :param cid:
+        :return:
+        """
+        fut = self._lookup_future(bvid, cid)
+        if fut is None:
+            return []
+        # shield since the lookup may be shared with other callers
+        return await asyncio.shield(fut)
+
+    async def _fetch(self, url: str, convert_func: Optional[Callable]) -> bytes:
+        async with self.sema:
+            res = await req_retry(self.client, url)
+        if convert_func is None:
+            return res.content
+        return await asyncio.get_event_loop().run_in_executor(None, convert_func, res.content)
+
+    async def fetch(self, url: str, convert_func: Callable = None) -> bytes:
+        """download and convert subtitle, identical url is only requested once"""
+        key = (url, convert_func)
+        fut = self._contents.get(key)
+        if fut is None:
+            fut = self._contents[key] = asyncio.ensure_future(self._fetch(url, convert_func))
+            while len(self._contents) > self.cache_size:
+                self._contents.popitem(last=False)
+        else:
+            self._contents.move_to_end(key)
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            if self._contents.get(key) is fut:
+                del self._contents[key]
+            raise
+
+    async def save(self, url: str, path: Path, convert_func: Callable = None) -> Path:
+        """
+        save subtitle to path, suffix is decided by convert_func like get_static
+
+        :param url:
+        :param path: file path without suffix
+        :param convert_func:
+        :return:
+        """
+        suffix = '.' + convert_func.__name__.split('2')[-1] if convert_func else Path(url.split('?')[0]).suffix
+        path = path.with_name(path.name + suffix)
+        exist, path = await afs.path_check(path)
+        if exist:
+            self.logger.info(f'[green]已存在[/green] {path}')
+            return path
+        content = await self.fetch(url, convert_func)
+        async with aiofiles.open(path, 'wb') as f:
+            await f.write(content)
+        self.logger.info(f'[cyan]已完成[/cyan] {path}')
+        return path
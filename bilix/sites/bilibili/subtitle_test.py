@@ -0,0 +1,36 @@
+import json
+import httpx
+import pytest
+from bilix.sites.bilibili.subtitle import SubtitleManager
+from bilix.subtitle import json2srt
+
+
+@pytest.mark.asyncio
+async def test_subtitle_manager(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.url.path)
+        if request.url.path == '/x/player/v2':
+            if request.url.params['cid'] == '0':
+                return httpx.Response(200, json={'code': -400, 'message': ''})
+            subtitles = [{'subtitle_url': '//aisubtitle.hdslb.com/ai.json', 'lan_doc': '中文（自动生成）'}]
+            return httpx.Response(200, json={'code': 0, 'data': {'subtitle': {'subtitles': subtitles}}})
+        body = {'body': [{'from': 0, 'to': 1, 'content': 'hi'}]}
+        return httpx.Response(200, content=json.dumps(body).encode())
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        manager = SubtitleManager(client)
+        manager.prefetch([('BV1', 1), ('BV1', 2), ('BV1', 0)])
+        subs = [await manager.lookup('BV1', cid) for cid in (1, 2, 1)]
+        assert subs[0] == subs[1] == subs[2] == [['http://aisubtitle.hdslb.com/ai.json', '中文（自动生成）']]
+        assert await manager.lookup('BV1', 0) == [] and await manager.lookup('BV1', 0) == []
+        assert requests.count('/x/player/v2') == 3
+        paths = [await manager.save(subs[0][0][0], tmp_path / f'p{i}', json2srt) for i in range(2)]
+        assert [p.name for p in paths] == ['p0.srt', 'p1.srt']
+        assert paths[1].read_text() == '1\n00:00:00,000 --> 00:00:01,000\nhi\n\n'
+        assert requests.count('/ai.json') == 1
+        # finished lookups are bounded like converted subtitles
+        manager.cache_size = 1
+        await manager.lookup('BV1', 3)
+        assert list(manager._lookups) == [('BV1', 3)]
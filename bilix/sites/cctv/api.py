@@ -1,13 +1,12 @@
 import asyncio
 import re
-import json
 from typing import Sequence, Tuple
 
 import httpx
-import m3u8
 
 from bilix.download.utils import req_retry, raise_api_error
 from bilix.utils import legal_title
+from bilix._json import loads
 
 dft_client_settings = {
     'headers': {'user-agent': 'PostmanRuntime/7.29.0'},
@@ -28,25 +27,19 @@ async def get_id(client: httpx.AsyncClient, url: str) -> Tuple[str, str, str]:
 
 
 @raise_api_error
-async def get_media_info(client: httpx.AsyncClient, pid: str) -> Tuple[str, Sequence[str]]:
+async def get_media_info(client: httpx.AsyncClient, pid: str) -> Tuple[str, str]:
     """
 
     :param pid:
     :param client:
-    :return: title and m3u8 urls sorted by quality
+    :return: title and master m3u8 url, variants are chosen by BaseDownloaderM3u8 from declared bandwidth and resolution
     """
     res = await req_retry(client, f'https://vdn.apps.cntv.cn/api/getHttpVideoInfo.do?pid={pid}')
-    info_data = json.loads(res.text)
+    info_data = loads(res.content)
     # extract
     title = legal_title(info_data['title'])
     m3u8_main_url = info_data['hls_url']
-    res = await req_retry(client, m3u8_main_url)
-    m3u8_info = m3u8.loads(res.text)
-    if m3u8_info.base_uri is None:
-        m3u8_info.base_uri = re.match(r'(https?://[^/]*)/', m3u8_main_url).groups()[0]
-    m3u8_urls = list(sorted((i.absolute_uri for i in m3u8_info.playlists), reverse=True,
-                            key=lambda s: int(re.findall(r'/(\d+).m3u8', s)[0])))
-    return title, m3u8_urls
+    return title, m3u8_main_url
 
 
 @raise_api_error
@@ -63,8 +56,8 @@ async def get_series_info(client: httpx.AsyncClient, vide: str, vida: str) -> Tu
         req_retry(client, f"https://api.cntv.cn/NewVideoset/getVideoAlbumInfoByVideoId?id={vide}&serviceId=tvcctv"),
         req_retry(client, f'https://api.cntv.cn/NewVideo/getVideoListByAlbumIdNew', params=params)
     )
-    meta_data = json.loads(res_meta.text)
-    list_data = json.loads(res_list.text)
+    meta_data = loads(res_meta.content)
+    list_data = loads(res_list.content)
     # extract
     title = legal_title(meta_data['data']['title'])
     pids = [i['guid'] for i in list_data['data']['list']]
@@ -6,6 +6,7 @@ import httpx
 
 from . import api
 from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+from bilix.download.fs import afs
 
 
 class DownloaderCctv(BaseDownloaderM3u8):
@@ -38,38 +39,41 @@ class DownloaderCctv(BaseDownloaderM3u8):
         )
         self.hierarchy = hierarchy
 
-    async def get_series(self, url: str, path=Path('.'), quality: int = 0):
+    async def get_series(self, url: str, path=Path('.'), quality: Union[int, str] = 0, speedup: float = None):
         """
         :cli: short: s
         :param url:
         :param path:
         :param quality:
+        :param speedup: see get_m3u8_video
         :return:
         """
         pid, vide, vida = await api.get_id(self.client, url)
         if vida is None:  # 单个视频
-            await self.get_video(pid, quality=quality)
+            await self.get_video(pid, quality=quality, speedup=speedup)
         else:  # 剧集
             title, pids = await api.get_series_info(self.client, vide, vida)
             if self.hierarchy:
                 path /= title
-                path.mkdir(parents=True, exist_ok=True)
-            await asyncio.gather(*[self.get_video(pid, path, quality) for pid in pids])
+                await afs.mkdir(path)
+            await asyncio.gather(*[self.get_video(pid, path, quality, speedup=speedup) for pid in pids])
 
-    async def get_video(self, url_or_pid: str, path=Path('.'), quality: int = 0, time_range: Tuple[int, int] = None):
+    async def get_video(self, url_or_pid: str, path=Path('.'), quality: Union[int, str] = 0,
+                        time_range: Tuple[int, int] = None, speedup: float = None):
         """
         :cli: short: v
         :param url_or_pid:
         :param path:
-        :param quality:
+        :param quality: int for relative choice, 0 is the highest, or str like '720p'
         :param time_range:
+        :param speedup: see get_m3u8_video
         :return:
         """
         if url_or_pid.startswith('http'):
             pid, _, _ = await api.get_id(self.client, url_or_pid)
         else:
             pid = url_or_pid
-        title, m3u8_urls = await api.get_media_info(self.client, pid)
-        m3u8_url = m3u8_urls[min(quality, len(m3u8_urls) - 1)]
-        file_path = await self.get_m3u8_video(m3u8_url, path / f"{title}.mp4", time_range=time_range)
+        title, m3u8_url = await api.get_media_info(self.client, pid)
+        file_path = await self.get_m3u8_video(m3u8_url, path / f"{title}.mp4", time_range=time_range,
+                                              quality=quality, speedup=speedup)
         return file_path
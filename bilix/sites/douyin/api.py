@@ -8,12 +8,12 @@ Modified by
 """
 import asyncio
 import re
-import json
 from typing import List
 import httpx
 from pydantic import BaseModel
 from bilix.utils import legal_title
 from bilix.download.utils import req_retry, raise_api_error
+from bilix._json import loads
 
 dft_client_settings = {
     'headers': {'user-agent': 'Mozilla/5.0 (Linux; Android 8.0; Pixel 2 Build/OPD3.170816.012)'
@@ -43,7 +43,7 @@ async def get_video_info(client: httpx.AsyncClient, url: str) -> VideoInfo:
     else:
         key = re.search(r"modal_id=(\d+)", url).groups()[0]
     res = await req_retry(client, f'https://www.iesdouyin.com/web/api/v2/aweme/iteminfo/?item_ids={key}')
-    data = json.loads(res.text)
+    data = loads(res.content)
     data = data['item_list'][0]
     # 视频标题
     title = legal_title(data['desc'])
@@ -5,6 +5,7 @@ from typing import Union, Tuple
 import httpx
 from . import api
 from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+from bilix.download.fs import afs
 
 
 class DownloaderJable(BaseDownloaderM3u8):
@@ -50,7 +51,7 @@ class DownloaderJable(BaseDownloaderM3u8):
         data = await api.get_actor_info(self.client, url)
         if self.hierarchy:
             path /= data['actor_name']
-            path.mkdir(parents=True, exist_ok=True)
+            await afs.mkdir(path)
         await asyncio.gather(*[self.get_video(url, path, image) for url in data['urls']])
 
     async def get_video(self, url: str, path=Path("."), image=True, time_range: Tuple[int, int] = None):
@@ -65,7 +66,7 @@ class DownloaderJable(BaseDownloaderM3u8):
         video_info = await api.get_video_info(self.client, url)
         if self.hierarchy:
             path /= f"{video_info.avid} {video_info.actor_name}"
-            path.mkdir(parents=True, exist_ok=True)
+            await afs.mkdir(path)
         cors = [self.get_m3u8_video(m3u8_url=video_info.m3u8_url, path=path / f"{video_info.title}.mp4",
                                     time_range=time_range)]
         if image:
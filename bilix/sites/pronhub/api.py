@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-import json
 import re
 from typing import Union
 
@@ -7,6 +6,7 @@ import httpx
 from bs4 import BeautifulSoup
 from bilix.utils import legal_title
 from bilix.download.utils import raise_api_error, req_retry
+from bilix._json import loads
 
 BASE_URL = "https://cn.pornhub.com/"
 dft_client_settings = {
@@ -38,7 +38,7 @@ async def get_video_info(client: httpx.AsyncClient, url: str) -> VideoInfo:
     script = soup.find("div", id="player").script.text
     flash_var = re.findall(r'flashvars_\d+ = ({.*?});', script)[0]
     uploader = re.search(r"'video_uploader_name'\s?:\s?'(\S+)'", res.text).group(1)
-    video_data = json.loads(flash_var)
+    video_data = loads(flash_var)
     title = legal_title(video_data['video_title'])
     qualities = {str(q): None for q in sorted(video_data['defaultQuality'], reverse=True)}
     for media in video_data['mediaDefinitions']:
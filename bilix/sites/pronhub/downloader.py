@@ -5,6 +5,7 @@ from typing import Union, Tuple, Annotated
 import httpx
 from . import api
 from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+from bilix.download.fs import afs
 from bilix.download.utils import str2path, parse_speed_str
 
 
@@ -70,7 +71,7 @@ class DownloaderPornhub(BaseDownloaderM3u8):
             video_info = await api.get_video_info(self.client, url)
         if self.hierarchy:
             path /= f"{video_info.uploader}"
-            path.mkdir(parents=True, exist_ok=True)
+            await afs.mkdir(path)
         m3u8_url = video_info.choose_quality(quality)
         cors = [self.get_m3u8_video(m3u8_url=m3u8_url, path=path / f"{video_info.title}.mp4", time_range=time_range)]
         if image:
@@ -5,13 +5,13 @@ https://github.com/Evil0ctal/Douyin_TikTok_Download_API
 """
 
 import re
-import json
 import random
 from typing import List
 import httpx
 from pydantic import BaseModel
 from bilix.utils import legal_title
 from bilix.download.utils import req_retry, raise_api_error
+from bilix._json import loads
 
 dft_client_settings = {
     'headers': {'user-agent': 'com.ss.android.ugc.trill/494+Mozilla/5.0+(Linux;+Android+12;'
@@ -43,7 +43,7 @@ async def get_video_info(client: httpx.AsyncClient, url: str) -> VideoInfo:
     params = {'aweme_id': key, 'aid': 1180, 'iid': 6165993682518218889,
               'device_id': random.randint(10 * 10 * 10, 9 * 10 ** 10)}
     res = await req_retry(client, 'https://api16-normal-c-useast1a.tiktokv.com/aweme/v1/feed/', params=params)
-    data = json.loads(res.text)
+    data = loads(res.content)
     data = data['aweme_list'][0]
     # 视频标题 (如果为空则使用分享标题)
     title = legal_title(data['desc'] if data['desc'] != '' else data['share_info']['share_title'])
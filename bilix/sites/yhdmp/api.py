@@ -1,5 +1,4 @@
 import asyncio
-import json
 import random
 import re
 from pathlib import Path
@@ -10,6 +9,7 @@ import execjs
 from bs4 import BeautifulSoup
 from bilix.utils import legal_title
 from bilix.download.utils import req_retry as rr, raise_api_error
+from bilix._json import loads
 
 BASE_URL = "https://www.yhdmp.cc"
 dft_client_settings = {
@@ -93,7 +93,7 @@ async def get_m3u8_url(client: httpx.AsyncClient, url):
     res_play = await req_retry(client, f"{BASE_URL}/_getplay", params=params)
     if res_play.text.startswith("err"):  # maybe first time
         res_play = await req_retry(client, f"{BASE_URL}/_getplay", params=params)
-    data = json.loads(res_play.text)
+    data = loads(res_play.content)
     purl, vurl = _decode(data['purl']), _decode(data['vurl'])
     m3u8_url = purl.split("url=")[-1] + vurl
     return m3u8_url
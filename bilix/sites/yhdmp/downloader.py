@@ -5,6 +5,7 @@ from typing import Sequence, Union, Tuple
 from . import api
 from bilix.utils import legal_title, cors_slice
 from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+from bilix.download.fs import afs
 
 
 class DownloaderYhdmp(BaseDownloaderM3u8):
@@ -50,7 +51,7 @@ class DownloaderYhdmp(BaseDownloaderM3u8):
         title = video_info.title
         if self.hierarchy:
             path = path / title
-            path.mkdir(parents=True, exist_ok=True)
+            await afs.mkdir(path)
 
         # no need to reuse get_video since we only need m3u8_url
         async def get_video(page_url, name):
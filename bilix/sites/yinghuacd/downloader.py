@@ -7,6 +7,7 @@ from typing import Sequence, Union, Tuple
 from . import api
 from bilix.utils import legal_title, cors_slice
 from bilix.download.base_downloader_m3u8 import BaseDownloaderM3u8
+from bilix.download.fs import afs
 from bilix.exception import APIError
 
 
@@ -56,7 +57,7 @@ class DownloaderYinghuacd(BaseDownloaderM3u8):
         video_info = await api.get_video_info(self.api_client, url)
         if self.hierarchy:
             path /= video_info.title
-            path.mkdir(parents=True, exist_ok=True)
+            await afs.mkdir(path)
         cors = [self.get_video(u, path=path, video_info=video_info if u == url else None)
                 for _, u in video_info.play_info]
         if p_range:
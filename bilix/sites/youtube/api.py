@@ -1,9 +1,9 @@
 import re
-import json
 from pydantic import BaseModel
 import httpx
 from bilix.download.utils import req_retry
 from bilix.utils import legal_title
+from bilix._json import loads
 
 dft_client_settings = {
     'headers': {
@@ -26,7 +26,7 @@ async def get_video_info(client: httpx.AsyncClient, url: str):
     response = await req_retry(client=client, url_or_urls=url)
     # 解析
     json_str = re.findall('var ytInitialPlayerResponse = (.*?);var', response.text)[0]
-    json_data = json.loads(json_str)
+    json_data = loads(json_str)
     video_url = json_data['streamingData']['adaptiveFormats'][0]['url']
     audio_url = json_data['streamingData']['adaptiveFormats'][-2]['url']
     title = legal_title(json_data['videoDetails']['title'])
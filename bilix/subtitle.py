@@ -0,0 +1,105 @@
+"""
+subtitle conversion: bilibili json subtitle (body of {from, to, content} cues) to srt, vtt and ass
+"""
+from typing import Union, List, Iterable
+
+from bilix._json import loads
+
+__all__ = ['json2srt', 'json2vtt', 'json2ass', 'format_times']
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, \
+Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, \
+MarginV, Encoding
+Style: Default,{font_face},{font_size},&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,2,0,2,\
+20,20,{margin},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def format_times(times: Iterable[float], sep: str = ',', precision: int = 3) -> List[str]:
+    """
+    format seconds to HH:MM:SS,mmm (srt) or HH:MM:SS.mmm (vtt) or H:MM:SS.cc (ass, precision=2)
+
+    :param times: seconds
+    :param sep: separator between seconds and fraction
+    :param precision: digits of fraction, 3 or 2
+    :return:
+    """
+    unit = 10 ** precision
+    hms_fmt = '%02d:%02d:%02d' if precision == 3 else '%d:%02d:%02d'
+    fracs = [f"{sep}{i:0{precision}d}" for i in range(unit)]
+    hms = {}  # cues are dense in time, most seconds are formatted more than once
+    res = []
+    append = res.append
+    for t in times:
+        s, frac = divmod(round(t * unit), unit)
+        prefix = hms.get(s)
+        if prefix is None:
+            m, sec = divmod(s, 60)
+            prefix = hms[s] = hms_fmt % (m // 60, m % 60, sec)
+        append(prefix + fracs[frac])
+    return res
+
+
+def _load(data: Union[bytes, str, dict]) -> List[dict]:
+    if isinstance(data, (bytes, str)):
+        data = loads(data)
+    return data['body']
+
+
+def json2srt(data: Union[bytes, str, dict]) -> Union[bytes, str]:
+    """convert bilibili json subtitle to srt, return bytes when data is bytes"""
+    body = _load(data)
+    starts = format_times(i['from'] for i in body)
+    ends = format_times(i['to'] for i in body)
+    res = ''.join([f"{idx}\n{s} --> {e}\n{i['content']}\n\n"
+                   for idx, (s, e, i) in enumerate(zip(starts, ends, body), 1)])
+    return res.encode('utf-8') if isinstance(data, bytes) else res
+
+
+def json2vtt(data: Union[bytes, str, dict]) -> Union[bytes, str]:
+    """convert bilibili json subtitle to WebVTT, return bytes when data is bytes"""
+    body = _load(data)
+    starts = format_times((i['from'] for i in body), sep='.')
+    ends = format_times((i['to'] for i in body), sep='.')
+    parts = ['WEBVTT\n\n']
+    parts.extend([f"{s} --> {e}\n{_vtt_escape(i['content'])}\n\n" for s, e, i in zip(starts, ends, body)])
+    res = ''.join(parts)
+    return res.encode('utf-8') if isinstance(data, bytes) else res
+
+
+def _vtt_escape(content: str) -> str:
+    if '&' in content or '<' in content or '-->' in content:
+        content = content.replace('&', '&amp;').replace('<', '&lt;').replace('-->', '--&gt;')
+    return content
+
+
+def json2ass(data: Union[bytes, str, dict], width: int = 1920, height: int = 1080,
+             font_face: str = 'sans-serif', font_size: int = None) -> Union[bytes, str]:
+    """convert bilibili json subtitle to ass with one bottom centered style, return bytes when data is bytes"""
+    body = _load(data)
+    starts = format_times((i['from'] for i in body), sep='.', precision=2)
+    ends = format_times((i['to'] for i in body), sep='.', precision=2)
+    font_size = font_size or height // 18
+    parts = [ASS_HEADER.format(width=width, height=height, font_face=font_face, font_size=font_size,
+                               margin=height // 20)]
+    parts.extend([f"Dialogue: 0,{s},{e},Default,,0,0,0,,{_ass_escape(i['content'])}\n"
+                  for s, e, i in zip(starts, ends, body)])
+    res = ''.join(parts)
+    return res.encode('utf-8') if isinstance(data, bytes) else res
+
+
+def _ass_escape(content: str) -> str:
+    if '\n' in content:
+        content = content.replace('\r', '').replace('\n', '\\N')
+    return content
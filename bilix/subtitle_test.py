@@ -0,0 +1,28 @@
+import json
+from bilix.subtitle import json2srt, json2vtt, json2ass, format_times
+
+data = {'body': [{'from': 0.57, 'to': 2.1, 'content': '第一句'}, {'from': 3661.5, 'to': 3663, 'content': 'a<b\nc'}]}
+
+
+def test_format_times():
+    assert format_times([0.57, 3661.5, 59.9996]) == ['00:00:00,570', '01:01:01,500', '00:01:00,000']
+    assert format_times([3661.505], sep='.', precision=2) == ['1:01:01.50']
+
+
+def test_json2srt():
+    res = json2srt(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+    assert isinstance(res, bytes)
+    assert res.decode('utf-8') == "1\n00:00:00,570 --> 00:00:02,100\n第一句\n\n" \
+                                  "2\n01:01:01,500 --> 01:01:03,000\na<b\nc\n\n"
+
+
+def test_json2vtt():
+    res = json2vtt(data)
+    assert res.startswith('WEBVTT\n\n00:00:00.570 --> 00:00:02.100\n第一句\n\n')
+    assert 'a&lt;b\nc' in res
+
+
+def test_json2ass():
+    res = json2ass(data, 1280, 720)
+    assert 'PlayResX: 1280' in res
+    assert res.endswith('Dialogue: 0,1:01:01.50,1:01:03.00,Default,,0,0,0,,a<b\\Nc\n')
@@ -2,13 +2,15 @@
 some useful functions
 """
 import html
-import json
+import os
 import re
 import time
-from functools import wraps
+from functools import wraps, lru_cache
 from urllib.parse import quote_plus
-from typing import Union, Sequence, Coroutine, List, Tuple, Optional
+from pathlib import Path
+from typing import Sequence, Coroutine, List, Tuple, Optional
 from bilix.log import logger
+from bilix.subtitle import json2srt  # keep import path for compatibility
 
 
 def cors_slice(cors: Sequence[Coroutine], p_range: Sequence[int]):
@@ -28,15 +30,40 @@ def legal_title(*parts: str, join_str: str = '-'):
     :param join_str: the string to join each part
     :return:
     """
-    return join_str.join(filter(lambda x: len(x) > 0, map(replace_illegal, parts)))
+    return join_str.join([p for p in map(replace_illegal, parts) if p])
 
 
+_ILLEGAL_CHARS = re.compile(r"[/\\:*?\"<>|\n\t]")
+
+
+@lru_cache(maxsize=4096)  # the same titles are sanitized for video, cover, subtitle, danmaku and nfo
 def replace_illegal(s: str):
     """strip, unescape html and replace os illegal character in s"""
     s = s.strip()
-    s = html.unescape(s)  # handel & "...
-    s = re.sub(r"[/\\:*?\"<>|\n\t]", '', s)  # replace illegal filename character
-    return s
+    if '&' in s:
+        s = html.unescape(s)  # handel & "...
+    return _ILLEGAL_CHARS.sub('', s)  # replace illegal filename character
+
+
+# S0/E0 are split to S·0/E·0 so that media servers do not take a title as season/episode number
+_NAME_CHARS = re.compile(r'[.:*?"<>|]')
+_NAME_CHARS_EPISODE = re.compile(r'(?<=[SE])(?=[0-9])|[.:*?"<>|]')
+
+
+def _name_repl(m: re.Match) -> str:
+    return '_' if m.group() else '·'
+
+
+@lru_cache(maxsize=4096)
+def legal_name(name: str, split_episode: bool = False) -> str:
+    """
+    make a file/dir name: . : * ? " < > | are replaced by _
+
+    :param name:
+    :param split_episode: also insert · between S/E and a following digit
+    :return:
+    """
+    return (_NAME_CHARS_EPISODE if split_episode else _NAME_CHARS).sub(_name_repl, name)
 
 
 def convert_size(total_bytes: int) -> str:
@@ -94,29 +121,9 @@ def s2t(s: str) -> int:
     return h * 60 * 60 + m * 60 + s
 
 
-def json2srt(data: Union[bytes, str, dict]):
-    b = False
-    if type(data) is bytes:
-        data = data.decode('utf-8')
-        b = True
-    if type(data) is str:
-        data = json.loads(data)
-
-    def t2str(t):
-        ms = int(round(t % 1, 3) * 1000)
-        s = int(t)
-        m = s // 60
-        h = m // 60
-        m, s = m % 60, s % 60
-        t_str = f'{h:0>2}:{m:0>2}:{s:0>2},{ms:0>3}'
-        return t_str
-
-    res = ''
-    for idx, i in enumerate(data['body']):
-        from_time, to_time = t2str(i['from']), t2str(i['to'])
-        content = i['content']
-        res += f"{idx + 1}\n{from_time} --> {to_time}\n{content}\n\n"
-    return res.encode('utf-8') if b else res
+def cache_dir() -> Path:
+    """bilix cache directory, $XDG_CACHE_HOME/bilix or ~/.cache/bilix"""
+    return Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser() / 'bilix'
 
 
 def timer(func):
@@ -0,0 +1,24 @@
+import random
+import re
+from bilix.utils import legal_title, legal_name
+
+
+def legacy_name(s: str) -> str:
+    for c in 'SE':
+        for d in '0123456789':
+            s = s.replace(f"{c}{d}", f"{c}·{d}")
+    return re.sub(r'[\.\:\*\?\"\<\>\|]', '_', s)
+
+
+def test_legal_title():
+    assert legal_title(' a&amp;b ', '', 'c/d:e') == 'a&b-cde'
+    assert legal_title('x', 'y', join_str='.') == 'x.y'
+
+
+def test_legal_name():
+    assert legal_name('S01E02 v1.0: "x"') == 'S01E02 v1_0_ _x_'
+    assert legal_name('S01E02 v1.0', split_episode=True) == 'S·01E·02 v1_0'
+    rnd = random.Random(0)
+    for _ in range(1000):
+        s = ''.join(rnd.choice('SE0123.:*?"<>|ab ') for _ in range(rnd.randint(0, 20)))
+        assert legal_name(s, split_episode=True) == legacy_name(s)